@@ -1,6 +1,10 @@
 import ModelInterfaces
 import torch
 import numpy as np
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+clause_boundary_pattern = re.compile(r'(?<=[,;:.!?…])\s+')
 
 
 class NeuralASR(ModelInterfaces.IASRModel):
@@ -48,6 +52,25 @@ class NeuralTTS(ModelInterfaces.ITextToSpeechModel):
 
         return audio_transcript
 
+    def getAudioChunksFromSentence(self, sentence: str, number_of_workers: int = 1):
+        """Yield the audio clause by clause, so playback can start before the whole sentence is synthesized"""
+        clauses = splitSentenceIntoClauses(sentence)
+        if number_of_workers <= 1 or len(clauses) == 1:
+            for clause in clauses:
+                yield self.getAudioFromSentence(clause)
+            return
+
+        with ThreadPoolExecutor(max_workers=number_of_workers) as executor:
+            # map keeps the clause order and yields each one as soon as it is ready
+            for audio in executor.map(self.getAudioFromSentence, clauses):
+                yield audio
+
+
+def splitSentenceIntoClauses(sentence: str) -> list:
+    clauses = [clause for clause in clause_boundary_pattern.split(
+        sentence.strip()) if clause]
+    return clauses if clauses else [sentence]
+
 
 class NeuralTranslator(ModelInterfaces.ITranslationModel):
     def __init__(self, model: torch.nn.Module, tokenizer) -> None:
@@ -1,29 +1,149 @@
+import os
+import re
+import sqlite3
+import threading
+from contextlib import closing
+from itertools import groupby
+from operator import itemgetter
+
 import ModelInterfaces
 import torch
 import numpy as np
 import epitran
 import eng_to_ipa
+from eng_to_ipa import transcribe
+
+import cacheUtils
+
+
+# Words transliterated one at a time, the punctuation and spaces between them are kept as they are
+word_pattern = re.compile(r"\w+(?:['’]\w+)*")
+
+
+def getVocabulary(database_path: str) -> list:
+    """Distinct words of the sentences of a sample database, e.g. ./databases/data_de.csv"""
+    import pandas as pd
+
+    sentences = pd.read_csv(database_path, delimiter=';')['sentence']
+    return list(dict.fromkeys([word for sentence in sentences
+                               for word in word_pattern.findall(sentence)]))
 
 
 class EpitranPhonemConverter(ModelInterfaces.ITextToPhonemModel):
+    """Transliterates word by word: the words of the vocabulary are precomputed, epitran only runs
+    for unseen words, which are then kept in an LRU cache.
+    Epitran anchors its word boundary rules to the start and end of the whole text, so a word gets
+    the same phonemes alone and inside a sentence only when each word is transliterated on its own."""
     word_locations_in_samples = None
     audio_transcript = None
 
-    def __init__(self, epitran_model) -> None:
+    def __init__(self, epitran_model, vocabulary: list = (), cache_size: int = 65536) -> None:
         super().__init__()
         self.epitran_model = epitran_model
+        self.word_table = {word: self.epitran_model.transliterate(word) for word in vocabulary}
+        self.learned_words = cacheUtils.LRUCache(max_size=cache_size)
+
+    def transliterateWord(self, word: str) -> str:
+        phonem_representation = self.word_table.get(word)
+        if phonem_representation is None:
+            phonem_representation = self.learned_words.get(word)
+            if phonem_representation is None:
+                phonem_representation = self.epitran_model.transliterate(word)
+                self.learned_words.put(word, phonem_representation)
+        return phonem_representation
 
     def convertToPhonem(self, sentence: str) -> str:
-        phonem_representation = self.epitran_model.transliterate(sentence)
+        phonem_representation = word_pattern.sub(
+            lambda match: self.transliterateWord(match.group()), sentence)
         return phonem_representation
 
 
+class CMUDictionary():
+    """The CMU dictionary of eng_to_ipa loaded once into memory, instead of one SQLite query
+    (a full table scan) per call. Words are kept in a sorted byte array and the CMU phonemes
+    of each word in one byte buffer, '\\n' separating the variants of a word."""
+
+    database_path = os.path.join(os.path.dirname(eng_to_ipa.__file__), 'resources', 'CMU_dict.db')
+
+    def __init__(self, database_path: str = database_path, cache_size: int = 65536) -> None:
+        with closing(sqlite3.connect(database_path)) as connection:
+            rows = connection.execute(
+                'SELECT word, phonemes FROM dictionary ORDER BY word').fetchall()
+
+        words = []
+        pronunciations = []
+        for word, word_rows in groupby(rows, key=itemgetter(0)):
+            words.append(word.encode('utf-8'))
+            pronunciations.append('\n'.join([phonemes for _, phonemes in word_rows]).encode('utf-8'))
+
+        self.words = np.array(words)
+        self.offsets = np.zeros(len(pronunciations)+1, dtype=np.int64)
+        np.cumsum([len(pronunciation) for pronunciation in pronunciations], out=self.offsets[1:])
+        self.pronunciations = b''.join(pronunciations)
+        # IPA of the words already converted
+        self.word_ipa_cache = cacheUtils.LRUCache(max_size=cache_size)
+
+    def lookup(self, words: list) -> list:
+        """CMU phonemes of every word (a list of variants, None if unknown) with one binary search"""
+        if len(words) == 0:
+            return []
+        keys = np.array([word.encode('utf-8') for word in words])
+        positions = np.minimum(np.searchsorted(self.words, keys), len(self.words)-1)
+        found = self.words[positions] == keys
+
+        cmu_words = []
+        for position, is_found in zip(positions, found):
+            if is_found:
+                cmu_words.append(self.pronunciations[self.offsets[position]:
+                                                     self.offsets[position+1]].decode('utf-8').split('\n'))
+            else:
+                cmu_words.append(None)
+        return cmu_words
+
+    def convertWords(self, words: list) -> list:
+        """IPA of lower case words without punctuation, the same as eng_to_ipa.convert would give"""
+        ipa_words = [self.word_ipa_cache.get(word) for word in words]
+        unknown_words = list(dict.fromkeys(
+            [word for word, ipa_word in zip(words, ipa_words) if ipa_word is None]))
+
+        converted_words = {}
+        for word, cmu_word in zip(unknown_words, self.lookup(unknown_words)):
+            if cmu_word is None:
+                cmu_word = ['__IGNORE__' + word]
+            # The last of the sorted variants, like eng_to_ipa.transcribe.get_top
+            converted_words[word] = transcribe.cmu_to_ipa([cmu_word], stress_marking='both')[0][-1]
+            self.word_ipa_cache.put(word, converted_words[word])
+
+        return [converted_words[word] if ipa_word is None else ipa_word
+                for word, ipa_word in zip(words, ipa_words)]
+
+    def convert(self, text: str) -> str:
+        """Same result as eng_to_ipa.convert(text)"""
+        words = [transcribe.preserve_punc(word.lower())[0] for word in text.split()]
+        ipa_words = self.convertWords([word[1] for word in words])
+        return ' '.join([word[0] + ipa_word + word[2] for word, ipa_word in zip(words, ipa_words)])
+
+
+cmu_dictionary = None
+cmu_dictionary_lock = threading.Lock()
+
+
+def getCMUDictionary() -> CMUDictionary:
+    """The dictionary shared by all the converters, loaded on first use"""
+    global cmu_dictionary
+    with cmu_dictionary_lock:
+        if cmu_dictionary is None:
+            cmu_dictionary = CMUDictionary()
+    return cmu_dictionary
+
+
 class EngPhonemConverter(ModelInterfaces.ITextToPhonemModel):
 
-    def __init__(self,) -> None:
+    def __init__(self, dictionary: CMUDictionary = None) -> None:
         super().__init__()
+        self.dictionary = dictionary if dictionary is not None else getCMUDictionary()
 
     def convertToPhonem(self, sentence: str) -> str:
-        phonem_representation = eng_to_ipa.convert(sentence)
+        phonem_representation = self.dictionary.convert(sentence)
         phonem_representation = phonem_representation.replace('*','')
         return phonem_representation
@@ -2,12 +2,15 @@ import WordMetrics
 import numpy as np
 from string import punctuation
 from dtwalign import dtw_from_distance_matrix
-import time
+import bisect
+from collections import Counter
 from typing import List, Tuple
-#from ortools.sat.python import cp_model
+import textNormalization
 
 offset_blank = 1
-TIME_THRESHOLD_MAPPING = 5.0
+# With use_anchors, texts with at least this many words are aligned between anchor words first
+ANCHOR_ALIGNMENT_MIN_WORDS = 50
+ANCHOR_BAND_WIDTH = 8
 
 
 def get_word_distance_matrix(words_estimated: list, words_real: list) -> np.ndarray:
@@ -29,57 +32,40 @@ def get_word_distance_matrix(words_estimated: list, words_real: list) -> np.ndar
 
 
 def get_best_path_from_distance_matrix(word_distance_matrix):
-    modelCpp = cp_model.CpModel()
+    """Exact monotonic mapping of the estimated words to the real words.
 
+    Minimizes the sum of the distances of the mapped pairs plus the blank distance (last row)
+    of every real word left without an estimated word, like the former OR-tools model.
+    Estimated words that are left out cost nothing and are mapped to -1."""
     number_of_real_words = word_distance_matrix.shape[1]
-    number_of_estimated_words = word_distance_matrix.shape[0]-1
-
-    number_words = np.maximum(number_of_real_words, number_of_estimated_words)
-
-    estimated_words_order = [modelCpp.NewIntVar(0, int(
-        number_words - 1 + offset_blank), 'w%i' % i) for i in range(number_words+offset_blank)]
+    number_of_estimated_words = word_distance_matrix.shape[0]-offset_blank
+    blank_distance = word_distance_matrix[number_of_estimated_words] if offset_blank == 1 else np.zeros(number_of_real_words)
+    blank_prefix = np.concatenate(([0.], np.cumsum(blank_distance)))
+
+    # cost[i, j]: lowest cost of mapping the first i estimated words to the first j real words
+    cost = np.empty((number_of_estimated_words+1, number_of_real_words+1))
+    cost[0] = blank_prefix
+    for idx_estimated in range(1, number_of_estimated_words+1):
+        previous = cost[idx_estimated-1]
+        best_without_blank = previous.copy()
+        best_without_blank[1:] = np.minimum(
+            previous[1:], previous[:-1]+word_distance_matrix[idx_estimated-1])
+        # Blanks chain along the row: cost[j] = min over k <= j of best_without_blank[k] + blanks of k+1..j
+        cost[idx_estimated] = np.minimum.accumulate(
+            best_without_blank-blank_prefix)+blank_prefix
+
+    mapped_indices = np.full(number_of_estimated_words, -1, dtype=int)
+    idx_estimated, idx_real = number_of_estimated_words, number_of_real_words
+    while idx_estimated > 0 and idx_real > 0:
+        if cost[idx_estimated, idx_real] == cost[idx_estimated-1, idx_real-1]+word_distance_matrix[idx_estimated-1, idx_real-1]:
+            mapped_indices[idx_estimated-1] = idx_real-1
+            idx_estimated, idx_real = idx_estimated-1, idx_real-1
+        elif cost[idx_estimated, idx_real] == cost[idx_estimated-1, idx_real]:
+            idx_estimated -= 1
+        else:
+            idx_real -= 1
 
-    # They are in ascending order
-    for word_idx in range(number_words-1):
-        modelCpp.Add(
-            estimated_words_order[word_idx+1] >= estimated_words_order[word_idx])
-
-    total_phoneme_distance = 0
-    real_word_at_time = {}
-    for idx_estimated in range(number_of_estimated_words):
-        for idx_real in range(number_of_real_words):
-            real_word_at_time[idx_estimated, idx_real] = modelCpp.NewBoolVar(
-                'real_word_at_time'+str(idx_real)+'-'+str(idx_estimated))
-            modelCpp.Add(estimated_words_order[idx_estimated] == idx_real).OnlyEnforceIf(
-                real_word_at_time[idx_estimated, idx_real])
-            total_phoneme_distance += word_distance_matrix[idx_estimated,
-                                                           idx_real]*real_word_at_time[idx_estimated, idx_real]
-
-    # If no word in time, difference is calculated from empty string
-    for idx_real in range(number_of_real_words):
-        word_has_a_match = modelCpp.NewBoolVar(
-            'word_has_a_match'+str(idx_real))
-        modelCpp.Add(sum([real_word_at_time[idx_estimated, idx_real] for idx_estimated in range(
-            number_of_estimated_words)]) == 1).OnlyEnforceIf(word_has_a_match)
-        total_phoneme_distance += word_distance_matrix[number_of_estimated_words,
-                                                       idx_real]*word_has_a_match.Not()
-
-    # Loss should be minimized
-    modelCpp.Minimize(total_phoneme_distance)
-
-    solver = cp_model.CpSolver()
-    solver.parameters.max_time_in_seconds = TIME_THRESHOLD_MAPPING
-    status = solver.Solve(modelCpp)
-
-    mapped_indices = []
-    try:
-        for word_idx in range(number_words):
-            mapped_indices.append(
-                (solver.Value(estimated_words_order[word_idx])))
-
-        return np.array(mapped_indices, dtype=int)
-    except:
-        return []
+    return mapped_indices
 
 
 def get_resulting_string(mapped_indices: np.ndarray, words_estimated: list, words_real: list) -> Tuple[List,List]:
@@ -124,32 +110,108 @@ def get_resulting_string(mapped_indices: np.ndarray, words_estimated: list, word
     return mapped_words, mapped_words_indices
 
 
-def get_best_mapped_words(words_estimated: list, words_real: list,use_dtw:bool = True) -> list:
+def get_anchor_pairs(words_estimated: list, words_real: list) -> list:
+    """(estimated, real) index pairs of the words that appear exactly once in both texts,
+    keeping the longest subset that is in the same order in both"""
+    def normalize(word: str) -> str:
+        return textNormalization.removePunctuation(word.lower())
+
+    estimated_counts = Counter([normalize(word) for word in words_estimated])
+    real_positions = {}
+    for idx_real, word in enumerate(words_real):
+        real_positions.setdefault(normalize(word), []).append(idx_real)
+
+    candidates = []
+    for idx_estimated, word in enumerate(words_estimated):
+        word = normalize(word)
+        if word and estimated_counts[word] == 1 and len(real_positions.get(word, [])) == 1:
+            candidates.append((idx_estimated, real_positions[word][0]))
+
+    # Longest increasing subsequence of the real indices (patience sorting)
+    tails, tail_indices, previous = [], [], [-1]*len(candidates)
+    for candidate_idx, (_, idx_real) in enumerate(candidates):
+        position = bisect.bisect_left(tails, idx_real)
+        if position > 0:
+            previous[candidate_idx] = tail_indices[position-1]
+        if position == len(tails):
+            tails.append(idx_real)
+            tail_indices.append(candidate_idx)
+        else:
+            tails[position] = idx_real
+            tail_indices[position] = candidate_idx
+
+    anchors = []
+    candidate_idx = tail_indices[-1] if tail_indices else -1
+    while candidate_idx >= 0:
+        anchors.append(candidates[candidate_idx])
+        candidate_idx = previous[candidate_idx]
+    return anchors[::-1]
+
+
+def get_banded_word_distance_matrix(words_estimated: list, words_real: list, band_width: int) -> np.ndarray:
+    """Word distance matrix computed only near the diagonal, the other pairs cannot be mapped"""
+    number_of_real_words = len(words_real)
+    number_of_estimated_words = len(words_estimated)
+    band_width = max(band_width, abs(number_of_real_words-number_of_estimated_words))
+
+    word_distance_matrix = np.full(
+        (number_of_estimated_words+offset_blank, number_of_real_words), np.inf)
+    for idx_estimated in range(number_of_estimated_words):
+        diagonal = idx_estimated*number_of_real_words//max(number_of_estimated_words, 1)
+        for idx_real in range(max(0, diagonal-band_width), min(number_of_real_words, diagonal+band_width+1)):
+            word_distance_matrix[idx_estimated, idx_real] = WordMetrics.edit_distance_python(
+                words_estimated[idx_estimated], words_real[idx_real])
+
+    if offset_blank == 1:
+        for idx_real in range(number_of_real_words):
+            word_distance_matrix[number_of_estimated_words,
+                                 idx_real] = len(words_real[idx_real])
+    return word_distance_matrix
+
+
+def get_anchored_mapped_indices(words_estimated: list, words_real: list, band_width: int = ANCHOR_BAND_WIDTH) -> np.ndarray:
+    """Real word index of every estimated word (-1 if none), aligning only the gaps between anchor words"""
+    mapped_indices = np.full(len(words_estimated), -1, dtype=int)
+    anchors = get_anchor_pairs(words_estimated, words_real)
+
+    gap_start = (0, 0)
+    for gap_end in anchors + [(len(words_estimated), len(words_real))]:
+        gap_estimated = words_estimated[gap_start[0]:gap_end[0]]
+        gap_real = words_real[gap_start[1]:gap_end[1]]
+        if len(gap_estimated) > 0 and len(gap_real) > 0:
+            gap_indices = get_best_path_from_distance_matrix(
+                get_banded_word_distance_matrix(gap_estimated, gap_real, band_width))
+            mapped_indices[gap_start[0]:gap_end[0]] = np.where(
+                gap_indices >= 0, gap_indices+gap_start[1], -1)
+        if gap_end[0] < len(words_estimated):
+            mapped_indices[gap_end[0]] = gap_end[1]
+        gap_start = (gap_end[0]+1, gap_end[1]+1)
+
+    return mapped_indices
+
+
+def get_best_mapped_words(words_estimated: list, words_real: list,use_dtw:bool = True, use_anchors: bool = False) -> list:
+    """Mapped word of every real word ('-' if none) and its index in words_estimated.
+
+    With use_anchors, texts of ANCHOR_ALIGNMENT_MIN_WORDS words or more are aligned between anchor words,
+    each gap with the exact DP, and use_dtw only applies to shorter texts."""
+
+    if use_anchors and max(len(words_estimated), len(words_real)) >= ANCHOR_ALIGNMENT_MIN_WORDS:
+        # Paragraphs: the dense matrix and DTW are quadratic in words, align between anchors instead
+        return get_resulting_string(get_anchored_mapped_indices(words_estimated, words_real),
+                                    words_estimated, words_real)
 
     word_distance_matrix = get_word_distance_matrix(
         words_estimated, words_real)
 
-    start = time.time()
-    
     if use_dtw:
         alignment = (dtw_from_distance_matrix(
                 word_distance_matrix.T))
             
         mapped_indices = alignment.get_warping_path()[:len(words_estimated)]
-        duration_of_mapping = time.time()-start
     else:
         mapped_indices = get_best_path_from_distance_matrix(word_distance_matrix)
 
-        duration_of_mapping = time.time()-start
-        # In case or-tools doesn't converge, go to a faster, low-quality solution
-        if len(mapped_indices) == 0 or duration_of_mapping > TIME_THRESHOLD_MAPPING+0.5:
-            #mapped_indices = (dtw_from_distance_matrix(
-            #    word_distance_matrix)).path[:len(words_estimated), 1]
-            alignment = (dtw_from_distance_matrix(
-                word_distance_matrix.T))
-            
-            mapped_indices = alignment.get_warping_path()
-
     mapped_words, mapped_words_indices = get_resulting_string(
         mapped_indices, words_estimated, words_real)
 
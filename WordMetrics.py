@@ -52,4 +52,69 @@ def edit_distance_python(seq1, seq2):
                     matrix[x,y-1] + 1
                 )
     #print (matrix)
-    return (matrix[size_x - 1, size_y - 1])
\ No newline at end of file
+    return (matrix[size_x - 1, size_y - 1])
+
+def letter_codes(word: str) -> np.ndarray:
+    """Code points of the word as a read-only array, to compare letters with edit_distance_ids"""
+    return np.frombuffer(word.encode('utf-32-le'), dtype=np.uint32)
+
+def edit_distance_ids(seq1, seq2) -> int:
+    """Levenshtein distance between two integer arrays (e.g. ipaSegmentation.encodeWord),
+    computed one row at a time with numpy instead of one cell at a time"""
+    seq1 = np.asarray(seq1)
+    seq2 = np.asarray(seq2)
+    if len(seq1) < len(seq2):
+        seq1, seq2 = seq2, seq1
+    if len(seq2) == 0:
+        return len(seq1)
+
+    positions = np.arange(len(seq2)+1)
+    previous_row = positions
+    current_row = np.empty_like(positions)
+    for token in seq1:
+        current_row[0] = previous_row[0] + 1
+        np.minimum(previous_row[1:] + 1, previous_row[:-1] + (seq2 != token),
+                   out=current_row[1:])
+        # Insertions within the row: row[j] = min(row[j], row[j-1]+1)
+        current_row = np.minimum.accumulate(current_row - positions) + positions
+        previous_row = current_row
+        current_row = np.empty_like(positions)
+    return int(previous_row[-1])
+
+
+
+def weighted_edit_distances_ids(pairs, substitution_costs) -> np.ndarray:
+    """Levenshtein distances of many (seq1, seq2) integer array pairs, where a substitution costs
+    substitution_costs[token1, token2] (e.g. phonemeDistance.getSubstitutionCosts) instead of 1.
+    The pairs are padded and filled in together, one row of every matrix per numpy operation."""
+    number_of_pairs = len(pairs)
+    lengths1 = np.array([len(seq1) for seq1, _ in pairs], dtype=int)
+    lengths2 = np.array([len(seq2) for _, seq2 in pairs], dtype=int)
+    height = lengths1.max(initial=0)
+    width = lengths2.max(initial=0) + 1
+
+    # Padding tokens only reach rows and columns past the end of their pair
+    tokens1 = np.zeros((number_of_pairs, height), dtype=int)
+    tokens2 = np.zeros((number_of_pairs, width-1), dtype=int)
+    for idx, (seq1, seq2) in enumerate(pairs):
+        tokens1[idx, :len(seq1)] = seq1
+        tokens2[idx, :len(seq2)] = seq2
+    pair_costs = substitution_costs[tokens1[:, :, None], tokens2[:, None, :]]
+
+    positions = np.arange(width, dtype=pair_costs.dtype)
+    previous_rows = np.tile(positions, (number_of_pairs, 1))
+    distances = positions[lengths2]
+    for i in range(height):
+        current_rows = np.empty_like(previous_rows)
+        current_rows[:, 0] = previous_rows[:, 0] + 1
+        np.minimum(previous_rows[:, 1:] + 1, previous_rows[:, :-1] + pair_costs[:, i],
+                   out=current_rows[:, 1:])
+        # Insertions within the row: row[j] = min(row[j], row[j-1]+1)
+        previous_rows = np.minimum.accumulate(current_rows - positions, axis=1) + positions
+        finished = np.flatnonzero(lengths1 == i+1)
+        distances[finished] = previous_rows[finished, lengths2[finished]]
+    return distances
+
+
+def weighted_edit_distance_ids(seq1, seq2, substitution_costs) -> float:
+    return float(weighted_edit_distances_ids([(seq1, seq2)], substitution_costs)[0])
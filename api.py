@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import webbrowser
 import os
 from flask_cors import CORS
@@ -6,11 +6,19 @@ import json
 import uuid
 
 import lambdaTTS
+import models
 import lambdaSpeechToScore
 import lambdaGetSample
+import requestTypes
 from mp3_to_base64Audio import process_audio_file_in_memory
 from urllib.parse import urlparse
 import utils
+import streamingAssessment
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
 cors = CORS(app)
@@ -36,22 +44,34 @@ def main():
 # ----------------------------------------------------------------
 @app.route(rootPath+'/getAudioFromText', methods=['POST'])
 def getAudioFromText():
-    event = {'body': json.dumps(request.get_json(force=True))}
-    return lambdaTTS.lambda_handler(event, [])
+    tts_request = requestTypes.TTSRequest.fromDict(request.get_json(force=True))
+    return lambdaTTS.process_request(tts_request)
+
+# ----------------------------------------------------------------
+@app.route(rootPath+'/getAudioFromTextStream', methods=['POST'])
+def getAudioFromTextStream():
+    tts_request = requestTypes.TTSRequest.fromDict(request.get_json(force=True))
+    # Checked before streaming: once the response has started it can no longer become an error
+    try:
+        models.getTTSSpeaker(tts_request.language)
+    except ValueError as error:
+        return jsonify({"status": "error", "message": str(error)}), 400
+    return Response(stream_with_context(lambdaTTS.stream_request(tts_request)),
+                    mimetype='audio/wav')
 
 # ----------------------------------------------------------------
 @app.route(rootPath+'/getSample', methods=['POST'])
 def getNext():
-    event = {'body':  json.dumps(request.get_json(force=True))}
-    return lambdaGetSample.lambda_handler(event, [])
+    sample_request = requestTypes.SampleRequest.fromDict(request.get_json(force=True))
+    return lambdaGetSample.process_request(sample_request)
 
 # ----------------------------------------------------------------
 @app.route(rootPath+'/GetAccuracyFromRecordedAudio', methods=['POST'])
 def GetAccuracyFromRecordedAudio():
 
     try:
-        event = {'body': json.dumps(request.get_json(force=True))}
-        lambda_correct_output = lambdaSpeechToScore.lambda_handler(event, [])
+        score_request = requestTypes.SpeechToScoreRequest.fromDict(request.get_json(force=True))
+        lambda_correct_output = lambdaSpeechToScore.process_request(score_request)
     except Exception as e:
         print('Error: ', str(e))
         return {
@@ -67,6 +87,23 @@ def GetAccuracyFromRecordedAudio():
 
     return lambda_correct_output
 
+# ----------------------------------------------------------------
+# Thống kê cache chấm điểm theo transcript (số lần trúng/trượt)
+@app.route(rootPath+'/scoringCacheStats', methods=['GET'])
+def scoringCacheStats():
+    return lambdaSpeechToScore.getScoringCacheStats()
+
+# ----------------------------------------------------------------
+# Chấm điểm trong khi người học đang nói (WebSocket, cần flask-sock)
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route(rootPath + '/streamAccuracy')
+    def streamAccuracy(websocket):
+        streamingAssessment.serve(websocket)
+else:
+    print('flask-sock is not installed, /streamAccuracy is disabled')
+
 # ----------------------------------------------------------------
 @app.route(rootPath + '/GetAccuracyFromRecordedAudio2', methods=['POST'])
 def get_accuracy_from_recorded_audio2():
@@ -90,16 +127,11 @@ def get_accuracy_from_recorded_audio2():
             return jsonify({"status": "error", "message": "Failed to process audio file."})
 
         # Chuẩn bị payload cho lambdaSpeechToScore
-        event = {
-            'body': json.dumps({
-                'base64Audio': base64_audio,
-                'title': title,
-                'language': language
-            })
-        }
+        score_request = requestTypes.SpeechToScoreRequest.fromDict(
+            {**data, 'title': title, 'base64Audio': base64_audio, 'language': language})
 
         # Gọi hàm lambda để xử lý dữ liệu
-        lambda_correct_output = lambdaSpeechToScore.lambda_handler(event, [])
+        lambda_correct_output = lambdaSpeechToScore.process_request(score_request)
 
         # Tạo UUID duy nhất cho yêu cầu này
         request_id = str(uuid.uuid4())
@@ -143,22 +175,27 @@ def view_result(request_id):
         if isinstance(raw_data, str):  # Nếu raw_data là chuỗi JSON, giải mã nó
             raw_data = json.loads(raw_data)
 
+        if not raw_data:
+            return "No pronunciation data available.", 404
+
         # Trích xuất thông tin cần thiết
         real_transcripts = raw_data.get("real_transcripts")
+        matched_transcripts = raw_data.get("matched_transcripts")
         ipa_transcript = raw_data.get("ipa_transcript")
         real_transcripts_ipa = raw_data.get("real_transcripts_ipa")
         matched_transcripts_ipa = raw_data.get("matched_transcripts_ipa")
-        is_letter_correct_all_words = raw_data.get("is_letter_correct_all_words")
+        # Run-length nếu client yêu cầu letterRuns, ngược lại là chuỗi '0'/'1'
+        is_letter_correct_all_words = raw_data.get("letter_correctness_runs",
+                                                   raw_data.get("is_letter_correct_all_words"))
         pronunciation_accuracy = raw_data.get("pronunciation_accuracy")
-        pair_accuracy_category = raw_data.get("pair_accuracy_category")
-
-        if not raw_data:
-            return "No pronunciation data available.", 404
 
-        # Xử lý dữ liệu màu sắc
-        result_1 = utils.process_line_1(real_transcripts, is_letter_correct_all_words)
-        result_2 = utils.process_line_2_v3(real_transcripts_ipa, ipa_transcript)
-        result_3, error_count = utils.process_line_3_v2(real_transcripts_ipa, ipa_transcript)
+        # Xử lý dữ liệu màu sắc (một lần, dùng cho cả JSON và HTML)
+        normalize_matched = utils.reinsert_dashes(matched_transcripts, matched_transcripts_ipa)
+        redundant = utils.find_leftover_words(matched_transcripts_ipa, ipa_transcript)
+        ipa_diff = utils.diff_ipa(real_transcripts_ipa.split(), normalize_matched.split(), redundant,
+                                  phoneme_level=raw_data.get("phoneme_level_diff", False))
+        line_3_highlights, error_count = utils.line_3_highlights(
+            real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript)
 
         print("-" * 80)
         print("Original pronunciation_accuracy:", pronunciation_accuracy)
@@ -167,37 +204,22 @@ def view_result(request_id):
         pronunciation_accuracy = int(pronunciation_accuracy)
         adjusted_score = max(pronunciation_accuracy - (error_count * 10), 0)
 
-        line1 = utils.convert_highlighted_text_to_json(highlighted_text=utils.convert_color_style_to_class(result_1), key_name="Real transcript")
-        line2 = utils.convert_highlighted_text_to_json(highlighted_text=result_2, key_name="Real transcripts ipa")
-        line3 = utils.convert_highlighted_text_to_json(highlighted_text=result_3, key_name="Your transcripts ipa")
-        line4 = {"Pronunciation Accuracy": adjusted_score}
-
-        # Chuyển đổi từ JSON string thành dictionary (Python object)
-        json_line1 = json.loads(line1)
-        json_line2 = json.loads(line2)
-        json_line3 = json.loads(line3)
-
-        # Gộp tất cả vào một dictionary
-        final_json = {
-            **json_line1,
-            **json_line2,
-            **json_line3,
-            **line4
-        }
-
-        print("-" * 80)
-        print("✅ Final JSON Data Generated!")
-
-        # Nếu người dùng yêu cầu JSON, trả về JSON thay vì hiển thị HTML
+        # Nếu người dùng yêu cầu JSON, tạo trực tiếp từ dữ liệu đúng/sai (không qua HTML)
         if response_format == "json":
-            return jsonify(final_json)  # Trả về JSON trực tiếp
+            return jsonify({
+                "Real transcript": utils.group_highlights(
+                    utils.iter_letter_highlights(real_transcripts, is_letter_correct_all_words)),
+                "Real transcripts ipa": utils.group_highlights(utils.iter_ipa_diff_highlights(ipa_diff)),
+                "Your transcripts ipa": utils.group_highlights(line_3_highlights),
+                "Pronunciation Accuracy": adjusted_score
+            })
 
         # Hiển thị giao diện với dữ liệu
         return render_template(
             "result.html",
-            colored_words=result_1,
-            corrected_ipa=result_2,
-            highlighted_ipa=result_3,
+            colored_words=utils.process_line_1(real_transcripts, is_letter_correct_all_words),
+            corrected_ipa=utils.render_ipa_diff_html(ipa_diff),
+            highlighted_ipa=utils.highlights_to_html(line_3_highlights),
             pronunciation_accuracy=adjusted_score
         )
     
@@ -8,6 +8,7 @@ import uuid
 import lambdaTTS
 import lambdaSpeechToScore
 import lambdaGetSample
+import requestTypes
 from mp3_to_base64Audio import process_audio_file_in_memory
 from urllib.parse import urlparse
 import re
@@ -37,22 +38,22 @@ def main():
 # ----------------------------------------------------------------
 @app.route(rootPath+'/getAudioFromText', methods=['POST'])
 def getAudioFromText():
-    event = {'body': json.dumps(request.get_json(force=True))}
-    return lambdaTTS.lambda_handler(event, [])
+    tts_request = requestTypes.TTSRequest.fromDict(request.get_json(force=True))
+    return lambdaTTS.process_request(tts_request)
 
 # ----------------------------------------------------------------
 @app.route(rootPath+'/getSample', methods=['POST'])
 def getNext():
-    event = {'body':  json.dumps(request.get_json(force=True))}
-    return lambdaGetSample.lambda_handler(event, [])
+    sample_request = requestTypes.SampleRequest.fromDict(request.get_json(force=True))
+    return lambdaGetSample.process_request(sample_request)
 
 # ----------------------------------------------------------------
 @app.route(rootPath+'/GetAccuracyFromRecordedAudio', methods=['POST'])
 def GetAccuracyFromRecordedAudio():
 
     try:
-        event = {'body': json.dumps(request.get_json(force=True))}
-        lambda_correct_output = lambdaSpeechToScore.lambda_handler(event, [])
+        score_request = requestTypes.SpeechToScoreRequest.fromDict(request.get_json(force=True))
+        lambda_correct_output = lambdaSpeechToScore.process_request(score_request)
     except Exception as e:
         print('Error: ', str(e))
         return {
@@ -93,7 +94,8 @@ def view_result():
         ipa_transcript = result.get("ipa_transcript")
         real_transcripts_ipa = result.get("real_transcripts_ipa")
         matched_transcripts_ipa = result.get("matched_transcripts_ipa")
-        is_letter_correct_all_words = result.get("is_letter_correct_all_words")
+        is_letter_correct_all_words = result.get("letter_correctness_runs",
+                                                 result.get("is_letter_correct_all_words"))
         pronunciation_accuracy = result.get("pronunciation_accuracy")
         matched_transcripts = result.get("matched_transcripts")
         normalize_matched = utils.reinsert_dashes(matched_transcripts, matched_transcripts_ipa)
@@ -102,24 +104,20 @@ def view_result():
             return "No pronunciation data available.", 404
             
         result_1 = utils.process_line_1(real_transcripts, is_letter_correct_all_words)
-        loss = utils.compare_ipa(real_transcripts_ipa, normalize_matched)
-        re_ipa_matched = utils.reinsert_missing_ipa(normalize_matched, loss)
-        check_diff, error_count = utils.check_diff(re_ipa_matched, real_transcripts_ipa)
-        result_2 = utils.process_line_2_v3(real_transcripts_ipa, check_diff, loss)
-        accuracy = utils.calculate_accuracy(result_2, redundant)
+        ipa_diff = utils.diff_ipa(real_transcripts_ipa.split(), normalize_matched.split(), redundant)
+        result_2 = utils.render_ipa_diff_html(ipa_diff)
+        accuracy = utils.calculate_ipa_diff_accuracy(ipa_diff)
 
         print("-" * 80)
         print("RESULT 1:", result_1)
         print("RESULT 2:", result_2)
 
-        line1 = utils.convert_highlighted_text_to_json(highlighted_text=utils.convert_color_style_to_class(result_1), key_name="Real transcript")
-        line2 = utils.parse_html_to_json(result_2)
+        # Tạo JSON trực tiếp từ dữ liệu đúng/sai, không phân tích lại HTML
+        json_line1 = {"Real transcript": utils.group_highlights(
+            utils.iter_letter_highlights(real_transcripts, is_letter_correct_all_words))}
+        json_line2 = utils.ipa_diff_to_rows(ipa_diff)
         line4 = {"Pronunciation Accuracy": accuracy}
 
-        # Chuyển đổi từ JSON string thành dictionary (Python object)
-        json_line1 = json.loads(line1)
-        json_line2 = json.loads(line2)
-
         # Gộp tất cả vào một dictionary
         final_json = {
             **json_line1,
@@ -0,0 +1,708 @@
+import sys
+import time
+import json
+import base64
+import os
+
+
+def measureCpuTime(function, repetitions: int = 20) -> float:
+    """Average CPU seconds spent per call of function"""
+    start = time.process_time()
+    for _ in range(repetitions):
+        function()
+    return (time.process_time()-start)/repetitions
+
+
+def printComparison(name: str, baseline: float, optimized: float):
+    print(name)
+    print('   baseline:  %.3f ms' % (baseline*1000))
+    print('   optimized: %.3f ms' % (optimized*1000))
+    print('   saved:     %.3f ms (%.1fx)' % ((baseline-optimized)*1000,
+                                            baseline/max(optimized, 1e-9)))
+
+
+##################### Request parsing ###########################
+
+def benchmarkRequestParsing(recording_seconds: int = 30):
+    import requestTypes
+
+    # Uncompressed 48 kHz 16 bit mono, the worst case the browser can send
+    audio_bytes = os.urandom(recording_seconds*48000*2)
+    body = {'title': 'A horse runs quickly.',
+            'base64Audio': 'data:audio/ogg;base64,' +
+            base64.b64encode(audio_bytes).decode('utf-8'),
+            'language': 'en'}
+
+    def throughFakeEvent():
+        event = {'body': json.dumps(body)}
+        data = json.loads(event['body'])
+        base64.b64decode(data['base64Audio'][22:].encode('utf-8'))
+
+    def throughRequestObject():
+        score_request = requestTypes.SpeechToScoreRequest.fromDict(body)
+        base64.b64decode(score_request.base64Audio[22:])
+
+    printComparison('Request parsing, %d s recording (%.1f MB body)' % (recording_seconds, len(body['base64Audio'])/1e6),
+                    measureCpuTime(throughFakeEvent), measureCpuTime(throughRequestObject))
+
+
+##################### TTS streaming ###########################
+
+class StandInTTSModel():
+    """Silero-like model whose synthesis time and audio length grow with the text"""
+    seconds_per_character = 0.002
+    samples_per_character = 1000
+
+    def apply_tts(self, texts, sample_rate):
+        import torch
+        time.sleep(len(texts[0])*self.seconds_per_character)
+        return [torch.zeros(len(texts[0])*self.samples_per_character)]
+
+
+def benchmarkTTSStreaming():
+    import models
+    import AIModels
+    import lambdaTTS
+    import requestTypes
+
+    sentence = ('Zwischen moosbewachsenen Bäumen rauschte ein kleiner Waldbach dahin, '
+                'und die Kinder, die am Ufer spielten, bauten aus Steinen einen Damm; '
+                'als es dunkel wurde, gingen sie nach Hause, müde, aber glücklich.')
+    language = 'de'
+    lambdaTTS.tts_model_registry.loaded_models.put(
+        (language, models.tts_speakers[language]), AIModels.NeuralTTS(StandInTTSModel(), lambdaTTS.sampling_rate))
+
+    def timeToFirstByte(render) -> float:
+        lambdaTTS.rendered_audio_cache.clear()
+        start = time.perf_counter()
+        next(iter(render()))
+        return time.perf_counter()-start
+
+    def wholeSentence():
+        yield lambdaTTS.process_request(requestTypes.TTSRequest(sentence, language))
+
+    def firstClauseOnly():
+        # The header is sent before any synthesis, so wait for the first audio chunk
+        audio_stream = lambdaTTS.stream_request(requestTypes.TTSRequest(sentence, language))
+        next(audio_stream)
+        yield next(audio_stream)
+
+    printComparison('TTS time to first audio byte, %d clauses' % len(AIModels.splitSentenceIntoClauses(sentence)),
+                    timeToFirstByte(wholeSentence), timeToFirstByte(firstClauseOnly))
+
+
+##################### ASR precision ###########################
+
+# Bundled recordings and what is said in them, None when only the float32 transcript can serve as reference
+bundled_recordings = {'test_1.mp3': None,
+                      'test_2.mp3': None,
+                      'test_3.mp3': None,
+                      'test_4.mp3': 'Good morning, how many banana are in the table? Thanks'}
+
+
+def loadRecording(path: str, sampling_rate: int = 16000):
+    import soundfile as sf
+    import torch
+    import torchaudio
+
+    audio, fs = sf.read(path, dtype='float32', always_2d=True)
+    audio = torch.from_numpy(audio.mean(axis=1)).unsqueeze(0)
+    return torchaudio.functional.resample(audio, fs, sampling_rate)
+
+
+def getModelSizeInBytes(model) -> int:
+    import io
+    import torch
+
+    model_buffer = io.BytesIO()
+    torch.save(model.state_dict(), model_buffer)
+    return len(model_buffer.getvalue())
+
+
+def getPeakRSSInBytes() -> int:
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss*1024
+
+
+def measureASRPrecision(language: str, precision: str, reference_texts: dict) -> dict:
+    """Transcripts, scores, latencies and memory of one precision. Run in a fresh process,
+    so that the peak RSS is the one of this precision alone."""
+    import models
+    import pronunciationTrainer
+    import RuleBasedModels
+
+    recordings = {path: loadRecording(path) for path in bundled_recordings}
+    rss_before_loading = getPeakRSSInBytes()
+    asr_model = models.getASRModel(language, precision=precision)
+    rss_after_loading = getPeakRSSInBytes()
+    trainer = pronunciationTrainer.PronunciationTrainer(
+        asr_model, RuleBasedModels.EngPhonemConverter())
+
+    results = {}
+    for path, audio in recordings.items():
+        real_text = reference_texts.get(path)
+        if real_text is None:
+            # float32 run on a recording without reference: it is scored against its own transcript
+            real_text = trainer.getAudioTranscript(audio)[0]
+        else:
+            # The first call also pays for lazy initializations
+            trainer.getAudioTranscript(audio)
+        start = time.perf_counter()
+        result = trainer.processAudioForGivenText(audio, real_text)
+        results[path] = {'latency': time.perf_counter()-start,
+                         'transcript': result['recording_transcript'],
+                         'score': float(result['pronunciation_accuracy'])}
+
+    return {'results': results,
+            'model_size': getModelSizeInBytes(asr_model.asr.model) if hasattr(asr_model, 'asr') else float('nan'),
+            'loading_rss': rss_after_loading-rss_before_loading,
+            'peak_rss': getPeakRSSInBytes()}
+
+
+def benchmarkASRPrecision(language: str = 'en'):
+    """Compare latency, memory, transcripts and scores of every precision against float32"""
+    import multiprocessing
+    import models
+    import WordMetrics
+
+    reference_texts = {path: text for path, text in bundled_recordings.items() if text is not None}
+    baseline = None
+    for precision in models.asr_precisions:
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            measurement = pool.apply(measureASRPrecision, (language, precision, reference_texts))
+        results = measurement['results']
+        if precision == 'float32':
+            baseline = results
+            reference_texts = {path: bundled_recordings[path] or result['transcript'] for path, result in results.items()}
+
+        latencies = sorted(result['latency'] for result in results.values())
+        word_errors, score_differences = [], []
+        for path, result in results.items():
+            baseline_words = baseline[path]['transcript'].lower().split()
+            word_errors.append(WordMetrics.edit_distance_python(
+                baseline_words, result['transcript'].lower().split())/max(len(baseline_words), 1))
+            score_differences.append(abs(result['score']-baseline[path]['score']))
+
+        print('ASR precision', precision)
+        print('   model size:             %.1f MB' % (measurement['model_size']/1e6))
+        print('   peak RSS:               %.1f MB (%.1f MB while loading the model)' % (
+            measurement['peak_rss']/1e6, measurement['loading_rss']/1e6))
+        print('   mean latency:           %.3f s' % (sum(latencies)/len(latencies)))
+        print('   max latency:            %.3f s' % latencies[-1])
+        print('   word error vs float32:  %.1f %%' % (100*sum(word_errors)/len(word_errors)))
+        print('   mean score difference:  %.1f points' % (sum(score_differences)/len(score_differences)))
+
+
+def benchmarkASRCascade(language: str = 'en', agreement_points: float = 5.):
+    """Escalation rate, latency and score agreement of the tiny -> base cascade against base only"""
+    import models
+    import pronunciationTrainer
+    import RuleBasedModels
+
+    recordings = {path: loadRecording(path) for path in bundled_recordings}
+    results = {}
+    for cascade in [False, True]:
+        asr_model = models.getASRModel(language, cascade=cascade)
+        trainer = pronunciationTrainer.PronunciationTrainer(
+            asr_model, RuleBasedModels.EngPhonemConverter())
+        latencies, scores = [], {}
+        for path, audio in recordings.items():
+            # Recordings without reference are scored against the transcript of the large model
+            real_text = bundled_recordings[path] or results.get(False, {}).get(path, {}).get('transcript')
+            if real_text is None:
+                real_text = trainer.getAudioTranscript(audio)[0]
+            start = time.perf_counter()
+            result = trainer.processAudioForGivenText(audio, real_text)
+            latencies.append(time.perf_counter()-start)
+            scores[path] = {'transcript': result['recording_transcript'],
+                            'score': float(result['pronunciation_accuracy'])}
+        results[cascade] = scores
+
+        print('ASR cascade' if cascade else 'ASR large model only')
+        print('   mean latency:           %.3f s' % (sum(latencies)/len(latencies)))
+        if cascade:
+            score_differences = [abs(scores[path]['score']-results[False][path]['score']) for path in recordings]
+            print('   escalation rate:        %.1f %%' % (100*asr_model.getStats()['escalation_rate']))
+            print('   mean score difference:  %.1f points' % (sum(score_differences)/len(score_differences)))
+            print('   scores within %.0f points: %.1f %%' % (
+                agreement_points, 100*sum(difference <= agreement_points for difference in score_differences)/len(score_differences)))
+
+
+def benchmarkReferenceDecoding(language: str = 'en'):
+    """Decoder steps and latency of every reference decoding mode, and whether a reference that does
+    not match the recording pulls the transcript towards it instead of what was said"""
+    import models
+    import pronunciationTrainer
+    import RuleBasedModels
+    import whisper_wrapper
+
+    recordings = {path: loadRecording(path) for path in bundled_recordings}
+    unguided_transcripts = {}
+    for mode in whisper_wrapper.reference_decoding_modes:
+        asr_model = models.getASRModel(language, cascade=False, reference_decoding=mode)
+        trainer = pronunciationTrainer.PronunciationTrainer(
+            asr_model, RuleBasedModels.EngPhonemConverter())
+        if mode == 'off':
+            # Recordings without reference are read as their unguided transcript
+            for path, audio in recordings.items():
+                unguided_transcripts[path] = trainer.transcribeAudio(audio)[0]
+        references = {path: bundled_recordings[path] or unguided_transcripts[path] for path in recordings}
+        # The sentence of another recording stands for a learner who says something else than the reference
+        paths = list(recordings.keys())
+        wrong_references = {path: references[paths[(idx+1) % len(paths)]] for idx, path in enumerate(paths)}
+
+        latencies, steps, changes, drifts = [], [], [], []
+        for path, audio in recordings.items():
+            start_steps = asr_model.decoder_steps
+            start = time.perf_counter()
+            trainer.transcribeAudio(audio, references[path])
+            latencies.append(time.perf_counter()-start)
+            steps.append(asr_model.decoder_steps-start_steps)
+
+            transcript = trainer.transcribeAudio(audio, wrong_references[path])[0]
+            changes.append(whisper_wrapper.getReferenceWordErrorRate(transcript, unguided_transcripts[path], language))
+            drifts.append(whisper_wrapper.getReferenceWordErrorRate(unguided_transcripts[path], wrong_references[path], language) -
+                          whisper_wrapper.getReferenceWordErrorRate(transcript, wrong_references[path], language))
+
+        print('Reference decoding', mode)
+        print('   mean latency:                      %.3f s' % (sum(latencies)/len(latencies)))
+        print('   mean decoder steps per clip:       %.1f' % (sum(steps)/len(steps)))
+        print('   wrong reference, word changes:     %.1f %%' % (100*sum(changes)/len(changes)))
+        print('   wrong reference, drift towards it: %.1f %%' % (100*sum(drifts)/len(drifts)))
+
+##################### Long audio ###########################
+
+def benchmarkLongAudio(recording_seconds: int = 120):
+    """Throughput of the chunked Whisper transcription on the bundled recordings repeated into one long input"""
+    import torch
+    import models
+
+    recordings = [loadRecording(path) for path in bundled_recordings]
+    repetitions = int(recording_seconds*16000//sum([recording.shape[1] for recording in recordings]))+1
+    audio = torch.cat(recordings*repetitions, dim=1)[:, :recording_seconds*16000]
+
+    asr_model = models.getASRModel('en')
+    for batch_size in [1, 4]:
+        asr_model.batch_size = batch_size
+        start = time.perf_counter()
+        asr_model.processAudio(audio)
+        duration = time.perf_counter()-start
+        print('Long audio, %d s, batch size %d' % (recording_seconds, batch_size))
+        print('   transcription time: %.1f s (%.1fx real time)' % (duration, recording_seconds/duration))
+        print('   words:              %d' % len(asr_model.getWordLocations()))
+
+
+##################### IPA diff ###########################
+
+def benchmarkIpaDiff():
+    import utils
+
+    real_transcripts_ipa = ('ðə ˈlaʊdər ðə mˈjuzɪk ɪz, ðə mɔr ˈpipəl drɪŋk bɪˈkəz ðeɪ spɛnd lɛs taɪm ˈtɔkɪŋ. '
+                            'ə smɔl ˈfɔrɪst brʊk floʊd bɪtˈwin ðə triz.')
+    matched_transcripts_ipa = ('ðə ˈlaʊdə ðə mˈjuzk ɪz ðə mɔr ˈpipl drɪŋks bɪˈkəz ðeɪ - lɛs taɪm ˈtɔkɪn '
+                               'ə smɔl ˈfɔrɪst bʊk floʊ bɪtˈwin ðə tri')
+    redundant = ['ˈsəmθɪŋ']
+
+    def previousChain():
+        loss = utils.compare_ipa(real_transcripts_ipa, matched_transcripts_ipa)
+        re_ipa_matched = utils.reinsert_missing_ipa(matched_transcripts_ipa, loss)
+        check_diff, _ = utils.check_diff(re_ipa_matched, real_transcripts_ipa)
+        html = utils.process_line_2_v3(real_transcripts_ipa, check_diff, loss)
+        utils.calculate_accuracy(html, redundant)
+
+    def singlePass():
+        ipa_diff = utils.diff_ipa(real_transcripts_ipa.split(), matched_transcripts_ipa.split(), redundant)
+        utils.render_ipa_diff_html(ipa_diff)
+        utils.calculate_ipa_diff_accuracy(ipa_diff)
+
+    printComparison('IPA diff post-processing, %d words' % len(real_transcripts_ipa.split()),
+                    measureCpuTime(previousChain, 200), measureCpuTime(singlePass, 200))
+
+
+def benchmarkPhonemeDistance():
+    import numpy as np
+    import WordMetrics
+    import ipaSegmentation
+
+    real_transcripts_ipa = ('ðə ˈlaʊdər ðə mˈjuzɪk ɪz, ðə mɔr ˈpipəl drɪŋk bɪˈkəz ðeɪ spɛnd lɛs taɪm ˈtɔkɪŋ. '
+                            'ə smɔl ˈfɔrɪst brʊk floʊd bɪtˈwin ðə triz.')
+    recording_ipa = ('ðə ˈlaʊdə ðə mˈjuzk ɪz ðə mɔr ˈpipl drɪŋks bɪˈkəz ðeɪ lɛs taɪm ˈtɔkɪn '
+                     'ə smɔl ˈfɔrɪst bʊk floʊ bɪtˈwin ðə tri')
+
+    def characters():
+        WordMetrics.edit_distance_python(real_transcripts_ipa, recording_ipa)
+
+    def phonemeIds():
+        WordMetrics.edit_distance_ids(
+            np.concatenate([ipaSegmentation.encodeWord(word) for word in real_transcripts_ipa.split()]),
+            np.concatenate([ipaSegmentation.encodeWord(word) for word in recording_ipa.split()]))
+
+    printComparison('Edit distance between sentence transcriptions, characters vs phoneme ids',
+                    measureCpuTime(characters, 20), measureCpuTime(phonemeIds, 20))
+
+
+def benchmarkWeightedScoring():
+    import eng_to_ipa
+    import pronunciationTrainer
+
+    trainer = pronunciationTrainer.PronunciationTrainer(None, None)
+    real_words = ('the louder the music is the more people drink because they spend less time talking '
+                  'a small forest brook flowed between the trees').split()
+    recorded_words = ('the lauder the music is the more peoples drinks because they - less time talkin '
+                      'a small forrest book flow between the tree').split()
+    words_pairs = list(zip(real_words, recorded_words))
+    ipa_pairs = [(eng_to_ipa.convert(real_word), eng_to_ipa.convert(recorded_word))
+                 for real_word, recorded_word in words_pairs]
+
+    def unweighted():
+        trainer.getPronunciationAccuracy(words_pairs)
+
+    def weighted():
+        trainer.getPronunciationAccuracy(ipa_pairs, weighted_phonemes=True)
+
+    printComparison('Pronunciation accuracy of %d words, unweighted letters vs weighted phonemes' % len(words_pairs),
+                    measureCpuTime(unweighted, 200), measureCpuTime(weighted, 200))
+
+
+def benchmarkIpaDictionary():
+    import eng_to_ipa
+    import RuleBasedModels
+
+    start = time.perf_counter()
+    dictionary = RuleBasedModels.CMUDictionary()
+    print('In-memory CMU dictionary: loaded %d words in %.3f s, %.1f MB' % (
+        len(dictionary.words), time.perf_counter()-start,
+        (dictionary.words.nbytes+dictionary.offsets.nbytes+len(dictionary.pronunciations))/1e6))
+
+    sentence = ('The louder the music is, the more people drink because they spend less time talking. '
+                'A small forest brook flowed between the trees.')
+    words = sentence.split()
+
+    def perWordQueries():
+        for word in words:
+            eng_to_ipa.convert(word)
+
+    def coldLookup():
+        dictionary.word_ipa_cache.clear()
+        for word in words:
+            dictionary.convert(word)
+
+    def warmLookup():
+        for word in words:
+            dictionary.convert(word)
+
+    baseline = measureCpuTime(perWordQueries, 5)
+    printComparison('Per-word IPA conversion of %d words, SQLite queries vs in-memory dictionary' % len(words),
+                    baseline, measureCpuTime(coldLookup, 20))
+    printComparison('   same, words already converted', baseline, measureCpuTime(warmLookup, 200))
+    printComparison('   whole sentence in one call', measureCpuTime(lambda: eng_to_ipa.convert(sentence), 5),
+                    measureCpuTime(lambda: dictionary.convert(sentence), 200))
+
+
+def benchmarkGermanIpa():
+    import epitran
+    import RuleBasedModels
+
+    epitran_model = epitran.Epitran('deu-Latn')
+    start = time.perf_counter()
+    converter = RuleBasedModels.EpitranPhonemConverter(
+        epitran_model, RuleBasedModels.getVocabulary('./databases/data_de.csv'))
+    print('German word table: %d words precomputed in %.3f s' % (
+        len(converter.word_table), time.perf_counter()-start))
+
+    sentence = 'Zwischen moosbewachsenen Bäumen rauschte ein kleiner Waldbach dahin.'
+    unseen_sentence = 'Quietschvergnügte Schornsteinfeger frühstücken Pfannkuchen.'
+
+    def unseenWords():
+        converter.learned_words.clear()
+        converter.convertToPhonem(unseen_sentence)
+
+    printComparison('German sentence to IPA, epitran vs word table',
+                    measureCpuTime(lambda: epitran_model.transliterate(sentence), 200),
+                    measureCpuTime(lambda: converter.convertToPhonem(sentence), 200))
+    printComparison('   same, words not in the vocabulary',
+                    measureCpuTime(lambda: epitran_model.transliterate(unseen_sentence), 200),
+                    measureCpuTime(unseenWords, 200))
+    english_converter = RuleBasedModels.EngPhonemConverter()
+    english_converter.convertToPhonem('A small forest brook flowed between the trees.')
+    print('   English sentence for comparison: %.3f ms' % (1000*measureCpuTime(
+        lambda: english_converter.convertToPhonem('A small forest brook flowed between the trees.'), 200)))
+
+
+def benchmarkCompiledReference():
+    import contextlib
+    import io
+    import torch
+    import RuleBasedModels
+    import pronunciationTrainer
+
+    trainer = pronunciationTrainer.PronunciationTrainer(
+        None, RuleBasedModels.EngPhonemConverter(), language='en')
+    real_text = ('The louder the music is, the more people drink because they spend 3 hours talking. '
+                 'A small forest brook flowed between the trees.')
+    recording_transcript = ('the lauder the music is the more peoples drinks because they three hours talkin '
+                            'a small forrest book flow between the tree')
+    recording_ipa = trainer.ipa_converter.convertToPhonem(recording_transcript)
+    audio = torch.randn(1, 8*trainer.sampling_rate)
+    word_locations = [(idx*4000, idx*4000+3000) for idx in range(len(recording_transcript.split()))]
+
+    def scoreRecording(clear_cache: bool):
+        if clear_cache:
+            trainer.compiled_references.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            trainer.processTranscriptForGivenText(audio, real_text, recording_transcript,
+                                                  recording_ipa, word_locations)
+
+    scoreRecording(True)  # Warm up the word mapping
+    printComparison('Scoring a transcribed recording of a %d word sentence, compiling the sentence every time vs once'
+                    % len(real_text.split()),
+                    measureCpuTime(lambda: scoreRecording(True), 100),
+                    measureCpuTime(lambda: scoreRecording(False), 100))
+    printComparison('   sentence side only',
+                    measureCpuTime(lambda: trainer.compileReference(real_text), 100),
+                    measureCpuTime(lambda: trainer.getCompiledReference(real_text), 100))
+
+
+def benchmarkScoringCache():
+    import contextlib
+    import io
+    import torch
+    import lambdaSpeechToScore
+    import requestTypes
+
+    trainer = lambdaSpeechToScore.trainer_SST_lambda['en']
+    score_request = requestTypes.SpeechToScoreRequest(
+        title='The louder the music is, the more people drink because they spend less time talking.',
+        base64Audio='', language='en')
+    recording_transcript = 'the louder the music is the more people drink because they spend less time talking'
+    audio = torch.randn(1, 6*trainer.sampling_rate)
+    word_locations = [(idx*6000, idx*6000+5000) for idx in range(len(recording_transcript.split()))]
+
+    def scoreTranscript(clear_cache: bool):
+        if clear_cache:
+            lambdaSpeechToScore.scored_transcripts_cache.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            lambdaSpeechToScore.getTranscriptScoreResponse(
+                trainer, score_request, audio, recording_transcript, word_locations)
+
+    scoreTranscript(True)  # Warm up the word mapping
+    printComparison('Scoring a correctly read %d word sentence, after ASR, cache miss vs hit'
+                    % len(recording_transcript.split()),
+                    measureCpuTime(lambda: scoreTranscript(True), 100),
+                    measureCpuTime(lambda: scoreTranscript(False), 100))
+    print('   cache stats:', lambdaSpeechToScore.getScoringCacheStats())
+
+
+##################### Text normalization ###########################
+
+def benchmarkTextNormalization():
+    import re
+    import num2words
+    from string import punctuation
+    import textNormalization
+
+    ipa_words = 'ðə ˈlaʊdər ðə mˈjuzɪk ɪz, ðə mɔr ˈpipəl drɪŋk bɪˈkəz ðeɪ spɛnd lɛs taɪm ˈtɔkɪŋ.'.split()
+    words = 'The louder the music is, the more people drink because they spend less time talking.'.split()
+    text_with_numbers = 'I bought 3 apples, 12 pears and 250 grams of cheese for 7 friends in 2021.'
+
+    def stripIpaWithRegex():
+        for word in ipa_words:
+            re.sub(r"[,?!…ˈ\.]", "", word)
+
+    def stripIpaWithTable():
+        for word in ipa_words:
+            textNormalization.removeIpaPunctuation(word)
+
+    def removePunctuationPerCharacter():
+        for word in words:
+            ''.join([char for char in word if char not in punctuation])
+
+    def removePunctuationWithTable():
+        for word in words:
+            textNormalization.removePunctuation(word)
+
+    def convertNumbersWithReplace():
+        text = text_with_numbers
+        for num in re.findall(r'\d+', text):
+            text = text.replace(num, num2words.num2words(int(num), lang='en'), 1)
+
+    def convertNumbersWithPattern():
+        textNormalization.convertNumbersInText(text_with_numbers)
+
+    printComparison('IPA punctuation removal, %d words' % len(ipa_words),
+                    measureCpuTime(stripIpaWithRegex, 2000), measureCpuTime(stripIpaWithTable, 2000))
+    printComparison('Punctuation removal, %d words' % len(words),
+                    measureCpuTime(removePunctuationPerCharacter, 2000), measureCpuTime(removePunctuationWithTable, 2000))
+    printComparison('Number expansion, 5 numbers',
+                    measureCpuTime(convertNumbersWithReplace, 2000), measureCpuTime(convertNumbersWithPattern, 2000))
+
+
+##################### Word mapping ###########################
+
+def corruptTranscript(words: list, rng) -> list:
+    """Transcript of a learner that drops, adds and mispronounces some of the words"""
+    transcript = []
+    for word in words:
+        draw = rng.random()
+        if draw < 0.1:
+            continue
+        if draw < 0.3:
+            position = rng.randrange(len(word))
+            word = word[:position] + rng.choice('aeiou') + word[position+1:]
+        transcript.append(word)
+        if rng.random() < 0.05:
+            transcript.append(rng.choice(['uh', 'the', 'and']))
+    return transcript
+
+
+def getMappingCost(mapped_words: list, words_real: list) -> int:
+    import WordMetrics
+    return sum([len(real_word) if mapped_word == '-' else WordMetrics.edit_distance_python(mapped_word, real_word)
+                for mapped_word, real_word in zip(mapped_words, words_real)])
+
+
+def benchmarkWordMapping():
+    import random
+    import pandas as pd
+    import WordMatching
+
+    rng = random.Random(0)
+    sentences = pd.read_csv('./databases/data_en.csv', delimiter=';')['sentence'].tolist()
+    for number_of_words in [10, 50, 200]:
+        pairs = []
+        for _ in range(20):
+            words_real = []
+            while len(words_real) < number_of_words:
+                words_real += rng.choice(sentences).lower().split()
+            words_real = words_real[:number_of_words]
+            pairs.append((corruptTranscript(words_real, rng), words_real))
+
+        def mapAll(use_dtw: bool) -> list:
+            return [WordMatching.get_best_mapped_words(words_estimated, words_real, use_dtw=use_dtw, use_anchors=False)[0]
+                    for words_estimated, words_real in pairs]
+
+        costs = {use_dtw: sum([getMappingCost(mapped_words, words_real) for mapped_words, (_, words_real)
+                               in zip(mapAll(use_dtw), pairs)]) for use_dtw in [True, False]}
+
+        # Both share the word distance matrix, so only the solvers are timed
+        matrices = [WordMatching.get_word_distance_matrix(words_estimated, words_real)
+                    for words_estimated, words_real in pairs]
+        printComparison('Word mapping solver, %d words (DTW as baseline, exact DP as optimized)' % number_of_words,
+                        measureCpuTime(lambda: [WordMatching.dtw_from_distance_matrix(matrix.T).get_warping_path()
+                                                for matrix in matrices], 5)/len(pairs),
+                        measureCpuTime(lambda: [WordMatching.get_best_path_from_distance_matrix(matrix)
+                                                for matrix in matrices], 5)/len(pairs))
+        print('   mapping cost:  DTW %d, exact DP %d (sum of word edit distances, lower is better)' % (
+            costs[True], costs[False]))
+
+
+def benchmarkParagraphAlignment():
+    import random
+    import pandas as pd
+    import WordMatching
+
+    rng = random.Random(0)
+    sentences = pd.read_csv('./databases/data_en.csv', delimiter=';')['sentence'].tolist()
+    for number_of_words in [100, 250, 500, 1000]:
+        words_real = []
+        while len(words_real) < number_of_words:
+            words_real += rng.choice(sentences).lower().split()
+        words_real = words_real[:number_of_words]
+        words_estimated = corruptTranscript(words_real, rng)
+
+        full_mapping = WordMatching.get_best_mapped_words(words_estimated, words_real, use_anchors=False)[0]
+        anchored_mapping = WordMatching.get_best_mapped_words(words_estimated, words_real, use_anchors=True)[0]
+        printComparison('Paragraph alignment, %d words (dense DTW as baseline, anchors and bands as optimized)' % number_of_words,
+                        measureCpuTime(lambda: WordMatching.get_best_mapped_words(
+                            words_estimated, words_real, use_anchors=False), 1),
+                        measureCpuTime(lambda: WordMatching.get_best_mapped_words(
+                            words_estimated, words_real, use_anchors=True), 3))
+        print('   mapping cost:  dense DTW %d, anchored %d, %d anchors' % (
+            getMappingCost(full_mapping, words_real), getMappingCost(anchored_mapping, words_real),
+            len(WordMatching.get_anchor_pairs(words_estimated, words_real))))
+
+
+##################### View rendering ###########################
+
+def benchmarkViewRendering():
+    import utils
+
+    real_transcripts = 'The louder the music is, the more people drink because they spend less time talking.'
+    is_letter_correct_all_words = ' '.join(['1'*len(word) if index % 3 else '0'+'1'*(len(word)-1)
+                                            for index, word in enumerate(real_transcripts.split())]) + ' '
+
+    def throughHtml():
+        html = utils.process_line_1(real_transcripts, is_letter_correct_all_words)
+        json.loads(utils.convert_highlighted_text_to_json(
+            utils.convert_color_style_to_class(html), 'Real transcript'))
+
+    def direct():
+        utils.group_highlights(utils.iter_letter_highlights(
+            real_transcripts, is_letter_correct_all_words))
+
+    printComparison('Highlighted transcript to JSON, %d words' % len(real_transcripts.split()),
+                    measureCpuTime(throughHtml, 500), measureCpuTime(direct, 500))
+
+
+##################### Intonation ###########################
+
+def benchmarkIntonation(recording_seconds: int = 30, number_of_words: int = 80):
+    import numpy as np
+    import torch
+    import pronunciationTrainer
+
+    trainer = pronunciationTrainer.PronunciationTrainer(None, None)
+    audio = torch.randn(1, recording_seconds*trainer.sampling_rate)
+    word_length = audio.shape[1]//number_of_words
+    word_locations = [(word*word_length, word*word_length+int(0.8*word_length))
+                      for word in range(number_of_words)]
+
+    def perWordLoop():
+        intonations = torch.zeros((len(word_locations), 1))
+        intonation_fade_samples = 0.3*trainer.sampling_rate
+        for word in range(len(word_locations)):
+            intonation_start = int(np.maximum(
+                0, word_locations[word][0]-intonation_fade_samples))
+            intonation_end = int(np.minimum(
+                audio.shape[1]-1, word_locations[word][1]+intonation_fade_samples))
+            intonations[word] = torch.sqrt(torch.mean(
+                audio[0][intonation_start:intonation_end]**2))
+        return intonations/torch.mean(intonations)
+
+    def prefixSums():
+        trainer.getWordsRelativeIntonation(audio, word_locations)
+
+    printComparison('Word intonation, %d s recording, %d words' % (recording_seconds, number_of_words),
+                    measureCpuTime(perWordLoop, 50), measureCpuTime(prefixSums, 50))
+    print('   with contours: %.3f ms' % (1000*measureCpuTime(
+        lambda: trainer.getWordsIntonationContours(audio, word_locations), 50)))
+
+
+benchmarks = {
+    'request_parsing': benchmarkRequestParsing,
+    'tts_streaming': benchmarkTTSStreaming,
+    'asr_precision': benchmarkASRPrecision,
+    'asr_cascade': benchmarkASRCascade,
+    'reference_decoding': benchmarkReferenceDecoding,
+    'long_audio': benchmarkLongAudio,
+    'ipa_diff': benchmarkIpaDiff,
+    'phoneme_distance': benchmarkPhonemeDistance,
+    'weighted_scoring': benchmarkWeightedScoring,
+    'ipa_dictionary': benchmarkIpaDictionary,
+    'german_ipa': benchmarkGermanIpa,
+    'compiled_reference': benchmarkCompiledReference,
+    'scoring_cache': benchmarkScoringCache,
+    'text_normalization': benchmarkTextNormalization,
+    'view_rendering': benchmarkViewRendering,
+    'word_mapping': benchmarkWordMapping,
+    'paragraph_alignment': benchmarkParagraphAlignment,
+    'intonation': benchmarkIntonation,
+}
+
+if __name__ == '__main__':
+    selected = sys.argv[1:] if len(sys.argv) > 1 else list(benchmarks.keys())
+    for benchmark_name in selected:
+        benchmarks[benchmark_name]()
@@ -0,0 +1,91 @@
+import threading
+import unicodedata
+from functools import lru_cache
+
+import numpy as np
+
+import textNormalization
+
+# Phonemes written with more than one code point by eng_to_ipa and epitran.
+# Segmentation is greedy, so the longest unit starting at a position wins.
+multi_character_phonemes = {
+    # English diphthongs and r-colored schwa
+    'eɪ', 'aɪ', 'ɔɪ', 'aʊ', 'oʊ', 'ɪə', 'eə', 'ʊə', 'ər',
+    # Affricates written without a tie bar
+    'tʃ', 'dʒ',
+}
+longest_phoneme = max(len(phoneme) for phoneme in multi_character_phonemes)
+
+tie_bar = '͡'
+# Marks that modify the phoneme written before them
+attached_marks = {'ː', 'ˑ', 'ʰ', 'ʲ', 'ʷ', '̯'}
+
+# Interned phonemes: phoneme_table[phoneme_ids[phoneme]] == phoneme
+phoneme_ids = {}
+phoneme_table = []
+phoneme_ids_lock = threading.Lock()
+
+
+def isAttachedMark(character: str) -> bool:
+    return character in attached_marks or unicodedata.combining(character) != 0
+
+
+def getPhonemeId(phoneme: str) -> int:
+    phoneme_id = phoneme_ids.get(phoneme)
+    if phoneme_id is None:
+        with phoneme_ids_lock:
+            phoneme_id = phoneme_ids.get(phoneme)
+            if phoneme_id is None:
+                phoneme_id = len(phoneme_table)
+                phoneme_table.append(phoneme)
+                phoneme_ids[phoneme] = phoneme_id
+    return phoneme_id
+
+
+@lru_cache(maxsize=65536)
+def segmentWord(ipa_word: str) -> tuple:
+    """Split an IPA word into phonemes, keeping stress marks and punctuation as their own segments,
+    e.g. 'ˈlaʊdər' -> ('ˈ', 'l', 'aʊ', 'd', 'ər')"""
+    segments = []
+    i = 0
+    while i < len(ipa_word):
+        if ipa_word[i] in textNormalization.ipa_ignored_tokens:
+            segments.append(ipa_word[i])
+            i += 1
+            continue
+
+        length = 1
+        for candidate_length in range(min(longest_phoneme, len(ipa_word)-i), 1, -1):
+            if ipa_word[i:i+candidate_length] in multi_character_phonemes:
+                length = candidate_length
+                break
+        end = i + length
+        while end < len(ipa_word):
+            if ipa_word[end] == tie_bar and end+1 < len(ipa_word):
+                end += 2
+            elif isAttachedMark(ipa_word[end]):
+                end += 1
+            else:
+                break
+        segments.append(ipa_word[i:end])
+        i = end
+    return tuple(segments)
+
+
+def getPhonemes(ipa_word: str) -> tuple:
+    """Phonemes of the word without stress marks and punctuation"""
+    return tuple(segment for segment in segmentWord(ipa_word)
+                 if segment not in textNormalization.ipa_ignored_tokens)
+
+
+@lru_cache(maxsize=65536)
+def encodeWord(ipa_word: str) -> np.ndarray:
+    """Interned phoneme ids of the word as a read-only int32 array"""
+    phoneme_codes = np.array([getPhonemeId(phoneme) for phoneme in getPhonemes(ipa_word)],
+                             dtype=np.int32)
+    phoneme_codes.setflags(write=False)
+    return phoneme_codes
+
+
+def decodeWord(phoneme_codes) -> str:
+    return ''.join(phoneme_table[phoneme_id] for phoneme_id in phoneme_codes)
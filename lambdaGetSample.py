@@ -5,6 +5,7 @@ import RuleBasedModels
 import epitran
 import random
 import pickle
+import requestTypes
 
 
 class TextDataset():
@@ -68,12 +69,14 @@ predefined_samples = {
 #     return json.dumps(result)
 
 def lambda_handler(event, context):
+    return process_request(requestTypes.SampleRequest.fromEvent(event))
 
-    body = json.loads(event['body'])
 
-    category = int(body['category'])
+def process_request(request: requestTypes.SampleRequest):
 
-    language = body['language']
+    category = request.category
+
+    language = request.language
 
     sample_in_category = False
 
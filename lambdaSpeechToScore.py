@@ -13,22 +13,29 @@ from torchaudio.transforms import Resample
 import io
 import tempfile
 import utils
+import requestTypes
+import cacheUtils
 
 trainer_SST_lambda = {}
 trainer_SST_lambda['de'] = pronunciationTrainer.getTrainer("de")
 trainer_SST_lambda['en'] = pronunciationTrainer.getTrainer("en")
 
+# Text side of the responses, keyed by (language, sentence, transcript, options changing the text side):
+# learners reading a sentence correctly all get the same transcript
+scored_transcripts_cache = cacheUtils.LRUCache(max_size=4096)
+
 transform = Resample(orig_freq=48000, new_freq=16000)
 
 
 def lambda_handler(event, context):
+    return process_request(requestTypes.SpeechToScoreRequest.fromEvent(event))
+
 
-    data = json.loads(event['body'])
+def process_request(request: requestTypes.SpeechToScoreRequest):
 
-    real_text = data['title']
-    file_bytes = base64.b64decode(
-        data['base64Audio'][22:].encode('utf-8'))
-    language = data['language']
+    real_text = request.title
+    file_bytes = base64.b64decode(request.base64Audio[22:])
+    language = request.language
 
     if len(real_text) == 0:
         return {
@@ -48,28 +55,84 @@ def lambda_handler(event, context):
         tmp.flush()
         tmp_name = tmp.name
         signal, fs = audioread_load(tmp_name)
-    signal = transform(torch.Tensor(signal)).unsqueeze(0)
+    # torch.from_numpy shares the decoded buffer, the resampler writes the 16 kHz copy
+    signal = transform(torch.from_numpy(signal)).unsqueeze(0)
     
 
 
-    result = trainer_SST_lambda[language].processAudioForGivenText(
-        signal, real_text)
-
+    trainer = trainer_SST_lambda[language]
     start = time.time()
-    real_transcripts_ipa = ' '.join(
-        [word[0] for word in result['real_and_transcribed_words_ipa']])
+    recording_transcript, word_locations = trainer.transcribeAudio(signal, real_text)
+    print('Time for NN to transcript audio: ', str(time.time()-start))
+
+    return json.dumps(getTranscriptScoreResponse(trainer, request, signal, recording_transcript, word_locations))
+
+
+def getTranscriptScoreResponse(trainer: pronunciationTrainer.PronunciationTrainer, request, recordedAudio: torch.Tensor,
+                               recording_transcript: str, word_locations: list) -> dict:
+    """Response to a transcribed recording, shared by the single request and the streaming endpoint.
+    Only the intonation depends on the audio, the rest is memoized in scored_transcripts_cache."""
+    # Transcripts that only differ in whitespace share an entry, the response keeps the transcript as recognized
+    cache_key = (request.language, request.title, ' '.join(recording_transcript.split()),
+                 request.letterRuns, request.phonemeDiff, request.weightedPhonemes)
+
+    cached_response = scored_transcripts_cache.get(cache_key)
+    if cached_response is None:
+        reference = trainer.getCompiledReference(request.title)
+        recording_ipa = trainer.ipa_converter.convertToPhonem(recording_transcript)
+        result = trainer.scoreTranscript(reference, recording_transcript, recording_ipa,
+                                         weighted_phonemes=request.weightedPhonemes)
+        cached_response = (result['mapped_words_indices'], getTextScoreResponse(result, request),
+                           recording_transcript, recording_ipa)
+        scored_transcripts_cache.put(cache_key, cached_response)
+
+    mapped_words_indices, text_response, scored_transcript, recording_ipa = cached_response
+    if scored_transcript != recording_transcript:
+        # The German converter keeps the spacing of the transcript
+        recording_ipa = trainer.ipa_converter.convertToPhonem(recording_transcript)
+    intonation = trainer.getRealWordsIntonation(recordedAudio, word_locations, mapped_words_indices,
+                                                intonation_contours=request.intonationContours)
+    return {**text_response, 'real_transcript': recording_transcript, 'ipa_transcript': recording_ipa,
+            **getIntonationResponse(intonation, request)}
+
+
+def getScoringCacheStats() -> dict:
+    lookups = scored_transcripts_cache.hits + scored_transcripts_cache.misses
+    return {'size': len(scored_transcripts_cache),
+            'hits': scored_transcripts_cache.hits,
+            'misses': scored_transcripts_cache.misses,
+            'hit_rate': scored_transcripts_cache.hits/lookups if lookups > 0 else 0.}
+
+
+def getScoreResponse(result: dict, request: requestTypes.SpeechToScoreRequest) -> dict:
+    """Response fields of a scored recording"""
+    return {**getTextScoreResponse(result, request), **getIntonationResponse(result, request)}
+
+
+def getIntonationResponse(intonation: dict, request) -> dict:
+    response = {'words_intonation': intonation['words_intonation']}
+    if request.intonationContours:
+        response['intonation_contours'] = intonation['intonation_contours']
+    return response
+
+
+def getTextScoreResponse(result: dict, request) -> dict:
+    """Response fields that only depend on the sentence and the transcript"""
+    start = time.time()
+    # The sentence side was compiled once for every recording of it
+    reference = result['reference']
+    real_transcripts_ipa = reference.transcript_ipa
     matched_transcripts_ipa = ' '.join(
         [word[1] for word in result['real_and_transcribed_words_ipa']])
 
-    real_transcripts = ' '.join(
-        [word[0] for word in result['real_and_transcribed_words']])
+    real_transcripts = reference.transcript
     matched_transcripts = ' '.join(
         [word[1] for word in result['real_and_transcribed_words']])
-    
-    words_real = real_transcripts.lower().split()
+
+    words_real = reference.words_lower
     mapped_words = matched_transcripts.split()
 
-    is_letter_correct_all_words = ''
+    letter_runs = []
     for idx, word_real in enumerate(words_real):
 
         mapped_letters, mapped_words_indices = wm.get_best_mapped_words(
@@ -78,8 +141,7 @@ def lambda_handler(event, context):
         is_letter_correct = wm.getWhichLettersWereTranscribedCorrectly(
             word_real, mapped_letters)  # , mapped_letters_indices)
 
-        is_letter_correct_all_words += ''.join([str(is_correct)
-                                                for is_correct in is_letter_correct]) + ' '
+        letter_runs.append(utils.letter_correctness_to_runs(is_letter_correct))
 
     pair_accuracy_category = ' '.join(
         [str(category) for category in result['pronunciation_categories']])
@@ -89,13 +151,13 @@ def lambda_handler(event, context):
 
     normalize_matched = utils.reinsert_dashes(matched_transcripts, matched_transcripts_ipa)
 
-    redundant = utils.find_leftover_words(matched_transcripts_ipa, ipa_transcript)
+    redundant, redundant_positions = utils.find_leftover_words_with_positions(
+        matched_transcripts_ipa, ipa_transcript)
 
-    loss = utils.compare_ipa(real_transcripts_ipa, normalize_matched)
-    re_ipa_matched = utils.reinsert_missing_ipa(normalize_matched, loss)
-    check_diff, error_count = utils.check_diff(re_ipa_matched, real_transcripts_ipa)
-    result_2 = utils.process_line_2_v3(real_transcripts_ipa, check_diff, loss)
-    accuracy = utils.calculate_accuracy(result_2, redundant)
+    ipa_diff = utils.diff_ipa(real_transcripts_ipa.split(), normalize_matched.split(), redundant,
+                              phoneme_level=request.phonemeDiff)
+    result_2 = utils.render_ipa_diff_html(ipa_diff)
+    accuracy = utils.calculate_ipa_diff_accuracy(ipa_diff)
 
     res = {'real_transcript': result['recording_transcript'],
            'ipa_transcript': result['recording_ipa'],
@@ -103,21 +165,29 @@ def lambda_handler(event, context):
            'real_transcripts': real_transcripts, 'matched_transcripts': matched_transcripts,
            'real_transcripts_ipa_html': result_2, 'matched_transcripts_ipa': matched_transcripts_ipa,
            'pair_accuracy_category': pair_accuracy_category,
-           'is_letter_correct_all_words': is_letter_correct_all_words,
-           'real_transcripts_ipa': real_transcripts_ipa
+           'real_transcripts_ipa': real_transcripts_ipa,
+           'redundant_words': redundant,
+           'redundant_word_positions': redundant_positions
            }
-    
-    return json.dumps(res)
+    if request.phonemeDiff:
+        res['phoneme_level_diff'] = True
+    if request.letterRuns:
+        res['letter_correctness_runs'] = letter_runs
+    else:
+        res['is_letter_correct_all_words'] = utils.letter_runs_to_string(letter_runs)
+
+    return res
 
 
 
 def audioread_load(path, offset=0.0, duration=None, dtype=np.float32):
     """Load an audio buffer using audioread.
 
-    This loads one block at a time, and then concatenates the results.
+    This loads one block at a time and appends its 16 bit samples to a single
+    byte buffer, which is converted to floating point once at the end.
     """
 
-    y = []
+    y = bytearray()
     with audioread.audio_open(path) as input_file:
         sr_native = input_file.samplerate
         n_channels = input_file.channels
@@ -133,7 +203,8 @@ def audioread_load(path, offset=0.0, duration=None, dtype=np.float32):
         n = 0
 
         for frame in input_file:
-            frame = buf_to_float(frame, dtype=dtype)
+            # View of the samples of the block, without converting them
+            frame = memoryview(frame).cast('h')
             n_prev = n
             n = n + len(frame)
 
@@ -155,10 +226,10 @@ def audioread_load(path, offset=0.0, duration=None, dtype=np.float32):
                 frame = frame[(s_start - n_prev):]
 
             # tack on the current frame
-            y.append(frame)
+            y += frame
 
     if y:
-        y = np.concatenate(y)
+        y = buf_to_float(y, dtype=dtype)
         if n_channels > 1:
             y = y.reshape((-1, n_channels)).T
     else:
@@ -197,5 +268,7 @@ def buf_to_float(x, n_bytes=2, dtype=np.float32):
     # Construct the format string
     fmt = "<i{:d}".format(n_bytes)
 
-    # Rescale and format the data buffer
-    return scale * np.frombuffer(x, fmt).astype(dtype)
+    # Rescale and format the data buffer, in place to keep a single float copy
+    x_float = np.frombuffer(x, fmt).astype(dtype)
+    x_float *= scale
+    return x_float
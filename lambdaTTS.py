@@ -2,34 +2,37 @@
 import models
 import soundfile as sf
 import json
-import AIModels
 #from flask import Response
-import utilsFileIO
 import os
+import sys
+import io
 import base64
+import hashlib
+import struct
+import numpy as np
+import requestTypes
+import cacheUtils
 
 sampling_rate = 16000
-model_TTS_lambda = AIModels.NeuralTTS(models.getTTSModel('de'), sampling_rate)
+linear_factor = 0.2
+# Voices are loaded on the first request for their language
+tts_model_registry = models.TTSModelRegistry(sampling_rate, max_loaded_models=2)
 
+# Rendered WAV files, keyed by (language, speaker, text, sampling rate)
+rendered_audio_cache = cacheUtils.LRUCache(max_size=512)
+precomputed_audio_folder = './databases/'
+precomputed_audio_store = {}
 
-def lambda_handler(event, context):
-
-    body = json.loads(event['body'])
-
-    text_string = body['value']
 
-    linear_factor = 0.2
-    audio = model_TTS_lambda.getAudioFromSentence(
-        text_string).detach().numpy()*linear_factor
-    random_file_name = utilsFileIO.generateRandomString(20)+'.wav'
+def lambda_handler(event, context):
+    return process_request(requestTypes.TTSRequest.fromEvent(event))
 
-    sf.write('./'+random_file_name, audio, 16000)
 
-    with open(random_file_name, "rb") as f:
-        audio_byte_array = f.read()
+def process_request(request: requestTypes.TTSRequest):
 
-    os.remove(random_file_name)
+    text_string = request.value
 
+    audio_byte_array = getRenderedAudio(request.language, text_string)
 
     return {
         'statusCode': 200,
@@ -40,7 +43,130 @@ def lambda_handler(event, context):
         },
         'body': json.dumps(
             {
-                "wavBase64": str(base64.b64encode(audio_byte_array))[2:-1],
+                "wavBase64": base64.b64encode(audio_byte_array).decode('utf-8'),
             },
         )
     }
+
+
+def stream_request(request: requestTypes.TTSRequest, number_of_workers: int = 1):
+    """Yield a WAV file in pieces: a header with open-ended length, then the PCM of each synthesized clause"""
+    language = request.language
+    cache_key = (language, models.getTTSSpeaker(language),
+                 request.value, sampling_rate)
+
+    audio_byte_array = rendered_audio_cache.get(cache_key)
+    if audio_byte_array is not None:
+        yield audio_byte_array
+        return
+
+    audio = getPrecomputedAudio(cache_key)
+    if audio is not None:
+        audio_byte_array = encodeWav(audio, sampling_rate)
+        rendered_audio_cache.put(cache_key, audio_byte_array)
+        yield audio_byte_array
+        return
+
+    yield getStreamingWavHeader(sampling_rate)
+
+    audio_chunks = []
+    for audio in tts_model_registry.getModel(language).getAudioChunksFromSentence(
+            request.value, number_of_workers=number_of_workers):
+        audio = audio.detach().numpy()*linear_factor
+        audio_chunks.append(audio)
+        yield floatToPCM16(audio)
+
+    rendered_audio_cache.put(cache_key, encodeWav(
+        np.concatenate(audio_chunks), sampling_rate))
+
+
+def getRenderedAudio(language: str, text_string: str) -> bytes:
+    """WAV bytes for the sentence, synthesized only if neither the cache nor the precomputed store has it"""
+    cache_key = (language, models.getTTSSpeaker(language),
+                 text_string, sampling_rate)
+
+    audio_byte_array = rendered_audio_cache.get(cache_key)
+    if audio_byte_array is not None:
+        return audio_byte_array
+
+    audio = getPrecomputedAudio(cache_key)
+    if audio is None:
+        audio = synthesizeAudio(language, text_string)
+
+    audio_byte_array = encodeWav(audio, sampling_rate)
+    rendered_audio_cache.put(cache_key, audio_byte_array)
+    return audio_byte_array
+
+
+def synthesizeAudio(language: str, text_string: str) -> np.ndarray:
+    return tts_model_registry.getModel(language).getAudioFromSentence(
+        text_string).detach().numpy()*linear_factor
+
+
+def encodeWav(audio: np.ndarray, sampling_rate: int) -> bytes:
+    wav_buffer = io.BytesIO()
+    sf.write(wav_buffer, audio, sampling_rate, format='WAV', subtype='PCM_16')
+    return wav_buffer.getvalue()
+
+
+def floatToPCM16(audio: np.ndarray) -> bytes:
+    return (np.clip(audio, -1, 1)*32767).astype('<i2').tobytes()
+
+
+def getStreamingWavHeader(sampling_rate: int, number_of_channels: int = 1) -> bytes:
+    """Header of a 16 bit PCM WAV whose length is unknown while streaming"""
+    unknown_size = 0xFFFFFFFF
+    bytes_per_sample = 2
+    return (b'RIFF' + struct.pack('<I', unknown_size) + b'WAVE' +
+            b'fmt ' + struct.pack('<IHHIIHH', 16, 1, number_of_channels, sampling_rate,
+                                  sampling_rate*number_of_channels*bytes_per_sample,
+                                  number_of_channels*bytes_per_sample, 8*bytes_per_sample) +
+            b'data' + struct.pack('<I', unknown_size))
+
+
+##################### Precomputed audio store ###########################
+
+def getStoreKey(cache_key: tuple) -> str:
+    return hashlib.sha1('|'.join([str(field) for field in cache_key]).encode('utf-8')).hexdigest()
+
+
+def getStorePath(language: str) -> str:
+    return os.path.join(precomputed_audio_folder, 'tts_' + language + '_' +
+                        models.getTTSSpeaker(language) + '.npz')
+
+
+def getPrecomputedAudio(cache_key: tuple):
+    language = cache_key[0]
+    if language not in precomputed_audio_store:
+        store_path = getStorePath(language)
+        precomputed_audio_store[language] = np.load(
+            store_path) if os.path.exists(store_path) else None
+
+    store = precomputed_audio_store[language]
+    store_key = getStoreKey(cache_key)
+    if store is None or store_key not in store.files:
+        return None
+    return store[store_key].astype(np.float32)/32767
+
+
+def precomputeSampleDatabase(language: str):
+    """Synthesize every sentence of the sample database and save it as int16 audio in a compressed npz file"""
+    import pandas as pd
+
+    sentences = pd.read_csv(precomputed_audio_folder + 'data_' +
+                            language + '.csv', delimiter=';')['sentence']
+    rendered_sentences = {}
+    for sentence in sentences.drop_duplicates():
+        cache_key = (language, models.getTTSSpeaker(language),
+                     sentence, sampling_rate)
+        audio = np.clip(synthesizeAudio(language, sentence), -1, 1)
+        rendered_sentences[getStoreKey(cache_key)] = (
+            audio*32767).astype(np.int16)
+
+    np.savez_compressed(getStorePath(language), **rendered_sentences)
+    precomputed_audio_store.pop(language, None)
+
+
+if __name__ == '__main__':
+    for language in sys.argv[1:] or list(models.tts_speakers.keys()):
+        precomputeSampleDatabase(language)
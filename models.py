@@ -1,15 +1,53 @@
 import torch
 import torch.nn as nn
 import pickle
+import os
+import threading
 from ModelInterfaces import IASRModel
-from AIModels import NeuralASR 
+from AIModels import NeuralASR, NeuralTTS
+from cacheUtils import LRUCache
 
-def getASRModel(language: str,use_whisper:bool=True) -> IASRModel:
+# 'float32', 'int8' (dynamically quantized linear layers) or 'bfloat16'.
+# 'int8' and 'bfloat16' are experimental until 'python benchmarks.py asr_precision' has measured their
+# latency, peak memory and accuracy against float32 with the real weights.
+asr_precisions = ['float32', 'int8', 'bfloat16']
+asr_precision = os.environ.get('ASR_PRECISION', 'float32')
+# Hugging Face name or local folder of the Whisper model
+asr_model_name = os.environ.get('ASR_MODEL', 'openai/whisper-base')
+# ASR_CASCADE=1 transcribes with cascade_small_model first and escalates to the default model
+# only when its transcript is not trusted
+asr_cascade = os.environ.get('ASR_CASCADE', '0') == '1'
+cascade_small_model = os.environ.get('ASR_CASCADE_SMALL_MODEL', 'openai/whisper-tiny')
+# One of whisper_wrapper.reference_decoding_modes
+asr_reference_decoding = os.environ.get('ASR_REFERENCE_DECODING', 'off')
+
+
+def getASRModel(language: str,use_whisper:bool=True, precision: str = None, cascade: bool = None,
+                reference_decoding: str = None) -> IASRModel:
+
+    if precision is None:
+        precision = asr_precision
+    if precision not in asr_precisions:
+        raise ValueError('Precision not implemented')
+    if cascade is None:
+        cascade = asr_cascade
+    if reference_decoding is None:
+        reference_decoding = asr_reference_decoding
 
     if use_whisper:
-        from whisper_wrapper import WhisperASRModel
-        return WhisperASRModel()
-    
+        from whisper_wrapper import WhisperASRModel, CascadeASRModel
+        if cascade:
+            return CascadeASRModel(WhisperASRModel(model_name=cascade_small_model, precision=precision,
+                                                   reference_decoding=reference_decoding),
+                                   WhisperASRModel(model_name=asr_model_name, precision=precision,
+                                                   reference_decoding=reference_decoding),
+                                   language=language)
+        return WhisperASRModel(model_name=asr_model_name, precision=precision, reference_decoding=reference_decoding)
+
+    if precision != 'float32':
+        # Silero models are TorchScript, which can be neither dynamically quantized nor cast safely
+        print('Precision', precision, 'is not supported by the Silero models, using float32')
+
     if language == 'de':
 
         model, decoder, utils = torch.hub.load(repo_or_dir='snakers4/silero-models',
@@ -37,28 +75,55 @@ def getASRModel(language: str,use_whisper:bool=True) -> IASRModel:
         raise ValueError('Language not implemented')
 
 
-def getTTSModel(language: str) -> nn.Module:
+# Silero v2 voices: torch.hub returns (model, example_text) and model.apply_tts takes
+# texts=[...] and sample_rate=16000
+tts_speakers = {'de': 'thorsten_v2',  # 16 kHz
+                'en': 'lj_v2'}  # 16 kHz
 
-    if language == 'de':
-
-        speaker = 'thorsten_v2'  # 16 kHz
-        model, _ = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                                  model='silero_tts',
-                                  language=language,
-                                  speaker=speaker)
 
-    elif language == 'en':
-        speaker = 'lj_16khz'  # 16 kHz
-        model = torch.hub.load(repo_or_dir='snakers4/silero-models',
-                               model='silero_tts',
-                               language=language,
-                               speaker=speaker)
-    else:
+def getTTSSpeaker(language: str, speaker: str = None) -> str:
+    if language not in tts_speakers:
         raise ValueError('Language not implemented')
+    return tts_speakers[language] if speaker is None else speaker
+
+
+def getTTSModel(language: str, speaker: str = None) -> nn.Module:
+
+    speaker = getTTSSpeaker(language, speaker)
+
+    model, _ = torch.hub.load(repo_or_dir='snakers4/silero-models',
+                              model='silero_tts',
+                              language=language,
+                              speaker=speaker)
 
     return model
 
 
+class TTSModelRegistry():
+    """Loads TTS voices on first use and keeps at most max_loaded_models of them in memory"""
+
+    def __init__(self, sampling_rate: int, max_loaded_models: int = 2) -> None:
+        self.sampling_rate = sampling_rate
+        self.loaded_models = LRUCache(max_size=max_loaded_models)
+        self.loading_lock = threading.Lock()
+
+    def getModel(self, language: str, speaker: str = None) -> NeuralTTS:
+        speaker = getTTSSpeaker(language, speaker)
+
+        model = self.loaded_models.get((language, speaker))
+        if model is not None:
+            return model
+
+        with self.loading_lock:
+            # Another request may have loaded it while we waited
+            if (language, speaker) in self.loaded_models:
+                return self.loaded_models.get((language, speaker))
+            model = NeuralTTS(getTTSModel(language, speaker),
+                              self.sampling_rate)
+            self.loaded_models.put((language, speaker), model)
+        return model
+
+
 def getTranslationModel(language: str) -> nn.Module:
     from transformers import AutoTokenizer
     from transformers import AutoModelForSeq2SeqLM
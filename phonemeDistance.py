@@ -0,0 +1,69 @@
+import threading
+import unicodedata
+
+import numpy as np
+import panphon.featuretable
+
+import ipaSegmentation
+
+# A substitution that changes this many articulatory features costs as much as deleting the phoneme
+full_substitution_features = 8.0
+
+# eng_to_ipa spellings that panphon knows under another form
+panphon_spellings = {'g': 'ɡ', 'ʧ': 't͡ʃ', 'ʤ': 'd͡ʒ', 'tʃ': 't͡ʃ', 'dʒ': 'd͡ʒ'}
+
+# Phonemes of the English and German converters, interned up front so the cost matrix is
+# usually computed once
+base_inventory = ('p b t d k g f v θ ð s z ʃ ʒ h ʧ ʤ tʃ dʒ m n ŋ l r j w '
+                  'i ɪ ɛ æ ɑ ɔ ʊ u ʌ ə e o a eɪ aɪ ɔɪ aʊ oʊ ər '
+                  'ç x ʁ t͡s p͡f y ʏ ø œ ɐ aː eː iː oː uː ɛː yː øː aɪ̯ aʊ̯ ɔɪ̯ ɔʏ̯').split()
+
+feature_table = panphon.featuretable.FeatureTable()
+
+phoneme_features = np.zeros((0, len(feature_table.names)), dtype=np.float32)
+substitution_costs = np.zeros((0, 0), dtype=np.float32)
+substitution_costs_lock = threading.Lock()
+
+
+def getPhonemeFeatures(phoneme: str) -> np.ndarray:
+    """Articulatory features of the phoneme (averaged over the parts of a diphthong or
+    affricate), NaN if panphon does not know all of its segments"""
+    spelling = unicodedata.normalize('NFD', panphon_spellings.get(phoneme, phoneme))
+    segments = feature_table.ipa_segs(spelling)
+    if len(segments) == 0 or unicodedata.normalize('NFD', ''.join(segments)) != spelling:
+        return np.full(len(feature_table.names), np.nan, dtype=np.float32)
+    return np.mean(feature_table.word_array(feature_table.names, spelling), axis=0, dtype=np.float32)
+
+
+def computeSubstitutionCosts(features: np.ndarray) -> np.ndarray:
+    feature_changes = np.abs(features[:, None, :] - features[None, :, :]).sum(axis=2)/2
+    costs = np.minimum(feature_changes/full_substitution_features, 1)
+    costs[np.isnan(costs)] = 1
+    np.fill_diagonal(costs, 0)
+    costs.setflags(write=False)
+    return costs
+
+
+def getSubstitutionCosts() -> np.ndarray:
+    """Dense matrix of substitution costs in [0, 1] indexed by the interned phoneme ids.
+    It is extended when new phonemes were interned since the last call."""
+    global phoneme_features, substitution_costs
+    if substitution_costs.shape[0] < len(ipaSegmentation.phoneme_table):
+        with substitution_costs_lock:
+            phonemes = ipaSegmentation.phoneme_table[phoneme_features.shape[0]:]
+            if len(phonemes) > 0:
+                phoneme_features = np.concatenate(
+                    [phoneme_features] + [getPhonemeFeatures(phoneme)[None] for phoneme in phonemes])
+                substitution_costs = computeSubstitutionCosts(phoneme_features)
+    return substitution_costs
+
+
+def getPhonemeSubstitutionCost(phoneme1: str, phoneme2: str) -> float:
+    phoneme_id1 = ipaSegmentation.getPhonemeId(phoneme1)
+    phoneme_id2 = ipaSegmentation.getPhonemeId(phoneme2)
+    return float(getSubstitutionCosts()[phoneme_id1, phoneme_id2])
+
+
+for phoneme in base_inventory:
+    ipaSegmentation.getPhonemeId(phoneme)
+getSubstitutionCosts()
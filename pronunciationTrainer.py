@@ -1,14 +1,20 @@
 
+from dataclasses import dataclass
+
 import torch
 import numpy as np
 import models as mo
 import WordMetrics
+import ipaSegmentation
+import phonemeDistance
 import WordMatching as wm
 import epitran
 import ModelInterfaces as mi
 import AIModels
 import RuleBasedModels
-from string import punctuation
+import textNormalization
+import cacheUtils
+import threading
 import time
 
 
@@ -18,18 +24,39 @@ def getTrainer(language: str):
     
     if language == 'de':
         phonem_converter = RuleBasedModels.EpitranPhonemConverter(
-            epitran.Epitran('deu-Latn'))
+            epitran.Epitran('deu-Latn'), RuleBasedModels.getVocabulary('./databases/data_de.csv'))
     elif language == 'en':
         phonem_converter = RuleBasedModels.EngPhonemConverter()
     else:
         raise ValueError('Language not implemented')
 
     trainer = PronunciationTrainer(
-        asr_model, phonem_converter)
+        asr_model, phonem_converter, language=language)
 
     return trainer
 
 
+@dataclass(frozen=True)
+class CompiledReference:
+    """Everything about a sentence to practice that does not depend on the recording"""
+    language: str
+    text: str
+    words: tuple                # words after spelling out the numbers
+    words_ipa: tuple
+    words_lower: tuple
+    words_letters: tuple        # lower case words without punctuation, as scored
+    words_letter_codes: tuple   # WordMetrics.letter_codes of each of words_letters
+    words_phoneme_codes: tuple  # ipaSegmentation.encodeWord of each IPA word
+
+    @property
+    def transcript(self) -> str:
+        return ' '.join(self.words)
+
+    @property
+    def transcript_ipa(self) -> str:
+        return ' '.join(self.words_ipa)
+
+
 class PronunciationTrainer:
     current_transcript: str
     current_ipa: str
@@ -42,51 +69,164 @@ class PronunciationTrainer:
     categories_thresholds = np.array([80, 60, 59])
 
     sampling_rate = 16000
+    prefix_sum_block_size = 1024
 
-    def __init__(self, asr_model: mi.IASRModel, word_to_ipa_coverter: mi.ITextToPhonemModel) -> None:
+    def __init__(self, asr_model: mi.IASRModel, word_to_ipa_coverter: mi.ITextToPhonemModel,
+                 language: str = None, compiled_references_cache_size: int = 4096) -> None:
         self.asr_model = asr_model
         self.ipa_converter = word_to_ipa_coverter
+        self.language = language
+        # Learners practice the same sentences over and over
+        self.compiled_references = cacheUtils.LRUCache(max_size=compiled_references_cache_size)
+        # The ASR model keeps the last transcript as state, so requests and streaming sessions take turns
+        self.asr_lock = threading.Lock()
 
     def getTranscriptAndWordsLocations(self, audio_length_in_samples: int):
 
         audio_transcript = self.asr_model.getTranscript()
         audio_transcript = self.convert_numbers_in_text(audio_transcript)
-        word_locations_in_samples = self.asr_model.getWordLocations()
+        word_locations_in_samples = self.getFadedWordLocations(
+            self.asr_model.getWordLocations(), audio_length_in_samples)
 
+        return audio_transcript, word_locations_in_samples
+
+    def getFadedWordLocations(self, word_locations_in_samples: list, audio_length_in_samples: int) -> list:
         fade_duration_in_samples = 0.05*self.sampling_rate
-        word_locations_in_samples = [(int(np.maximum(0, word['start_ts']-fade_duration_in_samples)), int(np.minimum(
+        return [(int(np.maximum(0, word['start_ts']-fade_duration_in_samples)), int(np.minimum(
             audio_length_in_samples-1, word['end_ts']+fade_duration_in_samples))) for word in word_locations_in_samples]
 
-        return audio_transcript, word_locations_in_samples
+    def getBlockBuffer(self, length: int) -> torch.tensor:
+        """Zeroed buffer of whole prefix sum blocks holding at least length values"""
+        number_of_blocks = length//self.prefix_sum_block_size+1
+        return torch.zeros(number_of_blocks*self.prefix_sum_block_size)
+
+    def getBlockPrefixSums(self, block_buffer: torch.tensor):
+        """Prefix sums of the buffer, accumulated in place in float32 inside blocks and in float64
+        across blocks, so that long recordings keep their precision without a float64 copy"""
+        within_blocks = block_buffer.view(-1, self.prefix_sum_block_size)
+        torch.cumsum(within_blocks, 1, out=within_blocks)
+        block_offsets = torch.nn.functional.pad(torch.cumsum(
+            within_blocks[:, -1], 0, dtype=torch.float64), (1, 0))
+        return within_blocks, block_offsets
+
+    def getPrefixSumAt(self, prefix_sums, indices: torch.tensor) -> torch.tensor:
+        """Sum of the first indices values, for a tensor of indices"""
+        within_blocks, block_offsets = prefix_sums
+        block = torch.div(indices, self.prefix_sum_block_size, rounding_mode='floor')
+        position = indices-block*self.prefix_sum_block_size
+        return block_offsets[block] + torch.where(
+            position > 0, within_blocks[block, (position-1).clamp(min=0)], 0.)
+
+    def getIntonationPrefixSums(self, Audio: torch.tensor, zero_crossings: bool = False):
+        """Prefix sums of the squared samples and, if asked, of the crossings of the mean
+        (zero crossings that a DC offset does not hide)"""
+        number_of_samples = Audio.shape[1]
+        signal = self.getBlockBuffer(number_of_samples)
+        signal[:number_of_samples].copy_(Audio[0])
+
+        crossing_sums = None
+        if zero_crossings:
+            negative = signal[:number_of_samples] < torch.mean(Audio[0])
+            crossings = self.getBlockBuffer(number_of_samples-1)
+            torch.ne(negative[1:], negative[:-1], out=crossings[:number_of_samples-1])
+            crossing_sums = self.getBlockPrefixSums(crossings)
+
+        return self.getBlockPrefixSums(signal.square_()), crossing_sums
+
+    def getIntonationWindows(self, Audio: torch.tensor, word_locations: list):
+        intonation_fade_samples = 0.3*self.sampling_rate
+        locations = torch.tensor(word_locations, dtype=torch.float64).reshape(-1, 2)
+        intonation_start = torch.clamp(
+            locations[:, 0]-intonation_fade_samples, min=0).long()
+        intonation_end = torch.clamp(
+            locations[:, 1]+intonation_fade_samples, max=Audio.shape[1]-1).long()
+        return intonation_start, torch.maximum(intonation_end, intonation_start)
+
+    def getWindowsRMS(self, squared_sums, start: torch.tensor, end: torch.tensor) -> torch.tensor:
+        return torch.sqrt((self.getPrefixSumAt(squared_sums, end)-self.getPrefixSumAt(squared_sums, start)) /
+                          (end-start))
 
     def getWordsRelativeIntonation(self, Audio: torch.tensor, word_locations: list):
-        intonations = torch.zeros((len(word_locations), 1))
-        intonation_fade_samples = 0.3*self.sampling_rate
-        print(intonations.shape)
-        for word in range(len(word_locations)):
-            intonation_start = int(np.maximum(
-                0, word_locations[word][0]-intonation_fade_samples))
-            intonation_end = int(np.minimum(
-                Audio.shape[1]-1, word_locations[word][1]+intonation_fade_samples))
-            intonations[word] = torch.sqrt(torch.mean(
-                Audio[0][intonation_start:intonation_end]**2))
+        squared_sums, _ = self.getIntonationPrefixSums(Audio)
+        intonation_start, intonation_end = self.getIntonationWindows(
+            Audio, word_locations)
+        intonations = self.getWindowsRMS(
+            squared_sums, intonation_start, intonation_end).float().unsqueeze(1)
 
         intonations = intonations/torch.mean(intonations)
         return intonations
 
+    def getWordsIntonationContours(self, Audio: torch.tensor, word_locations: list, number_of_frames: int = 8):
+        """Energy relative to the mean word energy and a zero-crossing pitch estimate in Hz,
+        for number_of_frames equal frames of every word window"""
+        squared_sums, crossing_sums = self.getIntonationPrefixSums(
+            Audio, zero_crossings=True)
+        intonation_start, intonation_end = self.getIntonationWindows(
+            Audio, word_locations)
+        frame_bounds = intonation_start.unsqueeze(1) + torch.div(
+            (intonation_end-intonation_start).unsqueeze(1)*torch.arange(number_of_frames+1),
+            number_of_frames, rounding_mode='floor')
+        frame_start, frame_end = frame_bounds[:, :-1], frame_bounds[:, 1:]
+
+        energy = self.getWindowsRMS(squared_sums, frame_start, frame_end)
+        energy = energy/torch.mean(self.getWindowsRMS(
+            squared_sums, intonation_start, intonation_end))
+
+        # A crossing between samples k and k+1 is inside the frame when both samples are
+        last_pair = torch.maximum(frame_end-1, frame_start)
+        crossings = self.getPrefixSumAt(crossing_sums, last_pair) - \
+            self.getPrefixSumAt(crossing_sums, frame_start)
+        pitch = crossings*self.sampling_rate/(2*(frame_end-frame_start))
+
+        return torch.nan_to_num(energy.float()), torch.nan_to_num(pitch.float())
+
+    def getRealWordsIntonation(self, Audio: torch.tensor, word_locations: list, mapped_words_indices: list,
+                               intonation_contours: bool = False) -> dict:
+        """Intonation of every word of the real text, None for words that were not found in the recording"""
+        def forRealWords(values: torch.tensor) -> list:
+            return [values[idx].tolist() if 0 <= idx < len(values) else None for idx in mapped_words_indices]
+
+        words_intonation = self.getWordsRelativeIntonation(Audio, word_locations)[:, 0]
+        intonation = {'words_intonation': forRealWords(
+            torch.nan_to_num(words_intonation))}
+        if intonation_contours:
+            energy, pitch = self.getWordsIntonationContours(Audio, word_locations)
+            intonation['intonation_contours'] = {'energy': forRealWords(energy),
+                                                 'pitch': forRealWords(pitch)}
+        return intonation
+
     ##################### ASR Functions ###########################
 
-    def processAudioForGivenText(self, recordedAudio: torch.Tensor = None, real_text=None):
+    def processAudioForGivenText(self, recordedAudio: torch.Tensor = None, real_text=None, intonation_contours: bool = False,
+                                 weighted_phonemes: bool = False):
 
         start = time.time()
-        real_text = self.convert_numbers_in_text(real_text)
         recording_transcript, recording_ipa, word_locations = self.getAudioTranscript(
-            recordedAudio)
+            recordedAudio, real_text)
         print('Time for NN to transcript audio: ', str(time.time()-start))
 
+        return self.processTranscriptForGivenText(recordedAudio, real_text, recording_transcript, recording_ipa,
+                                                  word_locations, intonation_contours=intonation_contours,
+                                                  weighted_phonemes=weighted_phonemes)
+
+    def processTranscriptForGivenText(self, recordedAudio: torch.Tensor, real_text: str, recording_transcript: str,
+                                      recording_ipa: str, word_locations: list, intonation_contours: bool = False,
+                                      weighted_phonemes: bool = False):
+        """Score an already transcribed recording, e.g. one transcribed piecewise while it was streamed"""
+        result = self.scoreTranscript(real_text, recording_transcript, recording_ipa,
+                                      weighted_phonemes=weighted_phonemes)
+        result.update(self.getRealWordsIntonation(recordedAudio, word_locations, result['mapped_words_indices'],
+                                                  intonation_contours=intonation_contours))
+        return result
+
+    def scoreTranscript(self, real_text, recording_transcript: str, recording_ipa: str,
+                        weighted_phonemes: bool = False) -> dict:
+        """The part of the scoring that only depends on the texts, real_text is a CompiledReference or the sentence"""
+        reference = real_text if isinstance(real_text, CompiledReference) else self.getCompiledReference(real_text)
+
         start = time.time()
         real_and_transcribed_words, real_and_transcribed_words_ipa, mapped_words_indices = self.matchSampleAndRecordedWords(
-            real_text, recording_transcript)
+            reference, recording_transcript)
         
         print('Time for matching transcripts: ', str(time.time()-start))
 
@@ -94,35 +234,46 @@ class PronunciationTrainer:
         #     word_locations, mapped_words_indices)
 
         pronunciation_accuracy, current_words_pronunciation_accuracy = self.getPronunciationAccuracy(
-            real_and_transcribed_words)  # _ipa
+            real_and_transcribed_words_ipa if weighted_phonemes else real_and_transcribed_words,
+            weighted_phonemes=weighted_phonemes, reference=reference)
 
         pronunciation_categories = self.getWordsPronunciationCategory(
             current_words_pronunciation_accuracy)
 
         result = {'recording_transcript': recording_transcript,
+                  'reference': reference,
                   'real_and_transcribed_words': real_and_transcribed_words,
                   'recording_ipa': recording_ipa,
                   'real_and_transcribed_words_ipa': real_and_transcribed_words_ipa, 'pronunciation_accuracy': pronunciation_accuracy,
                   'pronunciation_categories': pronunciation_categories,
+                  'mapped_words_indices': mapped_words_indices
                   }
 
         return result
 
-    def getAudioTranscript(self, recordedAudio: torch.Tensor = None):
-        current_recorded_audio = recordedAudio
-
-        current_recorded_audio = self.preprocessAudio(
-            current_recorded_audio)
-
-        self.asr_model.processAudio(current_recorded_audio)
-
-        current_recorded_transcript, current_recorded_word_locations = self.getTranscriptAndWordsLocations(
-            current_recorded_audio.shape[1])
+    def getAudioTranscript(self, recordedAudio: torch.Tensor = None, real_text: str = None):
+        current_recorded_transcript, current_recorded_word_locations = self.transcribeAudio(
+            recordedAudio, real_text)
         current_recorded_ipa = self.ipa_converter.convertToPhonem(
             current_recorded_transcript)
 
         return current_recorded_transcript, current_recorded_ipa, current_recorded_word_locations
 
+    def transcribeAudio(self, recordedAudio: torch.Tensor, real_text: str = None):
+        """ASR only: the transcript and the word locations in samples.
+        The sentence to read is given to ASR models that use it, such as the cascade.
+        recordedAudio is left unchanged, the intonation is computed from it afterwards."""
+        current_recorded_audio = self.preprocessAudio(
+            recordedAudio.clone())
+
+        with self.asr_lock:
+            if real_text is not None and getattr(self.asr_model, 'uses_reference_text', False):
+                self.asr_model.processAudio(current_recorded_audio, reference_text=real_text)
+            else:
+                self.asr_model.processAudio(current_recorded_audio)
+
+            return self.getTranscriptAndWordsLocations(current_recorded_audio.shape[1])
+
     def getWordLocationsFromRecordInSeconds(self, word_locations, mapped_words_indices) -> list:
         start_time = []
         end_time = []
@@ -134,32 +285,40 @@ class PronunciationTrainer:
         return ' '.join([str(time) for time in start_time]), ' '.join([str(time) for time in end_time])
     
     def convert_numbers_in_text(self, text):
-        import re
-        import num2words
-        # Tìm tất cả các số trong văn bản
-        numbers = re.findall(r'\d+', text)
-
-        for num in numbers:
-            # Chuyển số thành chữ
-            word = num2words.num2words(int(num), lang='en')
-            # Thay thế số bằng chữ trong chuỗi gốc
-            text = text.replace(num, word, 1)  # Thay thế số đầu tiên tìm thấy
-
-        return text
+        return textNormalization.convertNumbersInText(text)
 
     ##################### END ASR Functions ###########################
 
     ##################### Evaluation Functions ###########################
+    def compileReference(self, real_text: str) -> CompiledReference:
+        words = tuple(self.convert_numbers_in_text(real_text).split())
+        words_ipa = tuple([self.ipa_converter.convertToPhonem(word) for word in words])
+        words_letters = tuple([self.removePunctuation(word).lower() for word in words])
+        return CompiledReference(
+            language=self.language, text=real_text, words=words, words_ipa=words_ipa,
+            words_lower=tuple([word.lower() for word in words]), words_letters=words_letters,
+            words_letter_codes=tuple([WordMetrics.letter_codes(word) for word in words_letters]),
+            words_phoneme_codes=tuple([ipaSegmentation.encodeWord(word_ipa) for word_ipa in words_ipa]))
+
+    def getCompiledReference(self, real_text: str) -> CompiledReference:
+        cache_key = (self.language, real_text)
+        reference = self.compiled_references.get(cache_key)
+        if reference is None:
+            reference = self.compileReference(real_text)
+            self.compiled_references.put(cache_key, reference)
+        return reference
+
     def matchSampleAndRecordedWords(self, real_text, recorded_transcript):
+        """real_text is a CompiledReference or the sentence itself"""
         words_estimated = recorded_transcript.split()
-        
+
         if real_text is None:
-            words_real = self.current_transcript[0].split()
-        else:
-            words_real = real_text.split()
+            real_text = self.current_transcript[0]
+        reference = real_text if isinstance(real_text, CompiledReference) else self.getCompiledReference(real_text)
+        words_real = list(reference.words)
 
         mapped_words, mapped_words_indices = wm.get_best_mapped_words(
-            words_estimated, words_real)
+            words_estimated, words_real, use_anchors=True)
 
         real_and_transcribed_words = []
         real_and_transcribed_words_ipa = []
@@ -168,21 +327,28 @@ class PronunciationTrainer:
                 mapped_words.append('-')
             real_and_transcribed_words.append(
                 (words_real[word_idx],    mapped_words[word_idx]))
-            real_and_transcribed_words_ipa.append((self.ipa_converter.convertToPhonem(words_real[word_idx]),
+            real_and_transcribed_words_ipa.append((reference.words_ipa[word_idx],
                                                    self.ipa_converter.convertToPhonem(mapped_words[word_idx])))
         return real_and_transcribed_words, real_and_transcribed_words_ipa, mapped_words_indices
 
-    def getPronunciationAccuracy(self, real_and_transcribed_words_ipa) -> float:
+    def getPronunciationAccuracy(self, real_and_transcribed_words_ipa, weighted_phonemes: bool = False,
+                                 reference: CompiledReference = None) -> float:
+        """reference: the compiled sentence of the real words of the pairs, to skip normalizing them again"""
+        if weighted_phonemes:
+            return self.getWeightedPronunciationAccuracy(real_and_transcribed_words_ipa, reference)
         total_mismatches = 0.
         number_of_phonemes = 0.
         current_words_pronunciation_accuracy = []
-        for pair in real_and_transcribed_words_ipa:
-
-            real_without_punctuation = self.removePunctuation(pair[0]).lower()
-            number_of_word_mismatches = WordMetrics.edit_distance_python(
-                real_without_punctuation, self.removePunctuation(pair[1]).lower())
+        for word_idx, pair in enumerate(real_and_transcribed_words_ipa):
+
+            if reference is None:
+                real_codes = WordMetrics.letter_codes(self.removePunctuation(pair[0]).lower())
+            else:
+                real_codes = reference.words_letter_codes[word_idx]
+            number_of_word_mismatches = WordMetrics.edit_distance_ids(
+                real_codes, WordMetrics.letter_codes(self.removePunctuation(pair[1]).lower()))
             total_mismatches += number_of_word_mismatches
-            number_of_phonemes_in_word = len(real_without_punctuation)
+            number_of_phonemes_in_word = len(real_codes)
             number_of_phonemes += number_of_phonemes_in_word
 
             current_words_pronunciation_accuracy.append(float(
@@ -193,8 +359,30 @@ class PronunciationTrainer:
 
         return np.round(percentage_of_correct_pronunciations), current_words_pronunciation_accuracy
 
+    def getWeightedPronunciationAccuracy(self, real_and_transcribed_words_ipa,
+                                         reference: CompiledReference = None) -> float:
+        """Like getPronunciationAccuracy but on phonemes, a substitution costing less the closer
+        the two sounds are articulated (e.g. ɪ -> i costs 0.125, ɪ -> k 0.875)"""
+        if reference is None:
+            real_codes = [ipaSegmentation.encodeWord(pair[0]) for pair in real_and_transcribed_words_ipa]
+        else:
+            real_codes = reference.words_phoneme_codes
+        encoded_pairs = [(real_word_codes, ipaSegmentation.encodeWord(pair[1]))
+                         for real_word_codes, pair in zip(real_codes, real_and_transcribed_words_ipa)]
+        words_mismatches = WordMetrics.weighted_edit_distances_ids(
+            encoded_pairs, phonemeDistance.getSubstitutionCosts())
+        words_number_of_phonemes = np.array([len(real_codes) for real_codes, _ in encoded_pairs])
+
+        current_words_pronunciation_accuracy = [
+            float(number_of_phonemes-mismatches)/max(number_of_phonemes, 1)*100
+            for number_of_phonemes, mismatches in zip(words_number_of_phonemes, words_mismatches)]
+        percentage_of_correct_pronunciations = (
+            words_number_of_phonemes.sum()-words_mismatches.sum())/max(words_number_of_phonemes.sum(), 1)*100
+
+        return np.round(percentage_of_correct_pronunciations), current_words_pronunciation_accuracy
+
     def removePunctuation(self, word: str) -> str:
-        return ''.join([char for char in word if char not in punctuation])
+        return textNormalization.removePunctuation(word)
 
     def getWordsPronunciationCategory(self, accuracies) -> list:
         categories = []
@@ -209,6 +397,8 @@ class PronunciationTrainer:
         return np.argmin(abs(self.categories_thresholds-accuracy))
 
     def preprocessAudio(self, audio: torch.tensor) -> torch.tensor:
-        audio = audio-torch.mean(audio)
-        audio = audio/torch.max(torch.abs(audio))
+        """Remove the mean and scale to a peak of 1, in place: pass a tensor nobody else reads"""
+        audio -= torch.mean(audio)
+        audio_min, audio_max = torch.aminmax(audio)
+        audio /= torch.maximum(-audio_min, audio_max)
         return audio
@@ -0,0 +1,93 @@
+import json
+from dataclasses import dataclass
+
+
+def getEventBody(event) -> dict:
+    """Return the parsed body of an AWS-Lambda-style event.
+
+    The body may already be a dict when the handler is called in-process."""
+    body = event['body']
+    if isinstance(body, (str, bytes)):
+        body = json.loads(body)
+    return body
+
+
+@dataclass
+class SpeechToScoreRequest:
+    title: str
+    base64Audio: str
+    language: str
+    # Send the per-letter correctness as run lengths instead of the '0'/'1' string
+    letterRuns: bool = False
+    # Add per-word energy and pitch contours to the intonation feedback
+    intonationContours: bool = False
+    # Compare the IPA phoneme by phoneme instead of character by character
+    phonemeDiff: bool = False
+    # Score phonemes with substitutions weighted by articulatory distance instead of letters
+    weightedPhonemes: bool = False
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'SpeechToScoreRequest':
+        return cls(title=data['title'],
+                   base64Audio=data['base64Audio'],
+                   language=data['language'],
+                   letterRuns=bool(data.get('letterRuns', False)),
+                   intonationContours=bool(data.get('intonationContours', False)),
+                   phonemeDiff=bool(data.get('phonemeDiff', False)),
+                   weightedPhonemes=bool(data.get('weightedPhonemes', False)))
+
+    @classmethod
+    def fromEvent(cls, event) -> 'SpeechToScoreRequest':
+        return cls.fromDict(getEventBody(event))
+
+
+@dataclass
+class TTSRequest:
+    value: str
+    language: str = 'de'
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'TTSRequest':
+        return cls(value=data['value'],
+                   language=data.get('language', 'de'))
+
+    @classmethod
+    def fromEvent(cls, event) -> 'TTSRequest':
+        return cls.fromDict(getEventBody(event))
+
+
+@dataclass
+class SampleRequest:
+    category: int
+    language: str
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'SampleRequest':
+        return cls(category=int(data['category']),
+                   language=data['language'])
+
+    @classmethod
+    def fromEvent(cls, event) -> 'SampleRequest':
+        return cls.fromDict(getEventBody(event))
+
+
+@dataclass
+class StreamingScoreRequest:
+    """First message of a streaming assessment, the audio follows as 16 bit mono PCM chunks"""
+    title: str
+    language: str
+    sampleRate: int = 16000
+    letterRuns: bool = False
+    intonationContours: bool = False
+    phonemeDiff: bool = False
+    weightedPhonemes: bool = False
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'StreamingScoreRequest':
+        return cls(title=data['title'],
+                   language=data['language'],
+                   sampleRate=int(data.get('sampleRate', 16000)),
+                   letterRuns=bool(data.get('letterRuns', False)),
+                   intonationContours=bool(data.get('intonationContours', False)),
+                   phonemeDiff=bool(data.get('phonemeDiff', False)),
+                   weightedPhonemes=bool(data.get('weightedPhonemes', False)))
@@ -0,0 +1,146 @@
+import json
+import time
+
+import numpy as np
+import torch
+import torchaudio
+
+import WordMatching as wm
+import lambdaSpeechToScore
+import pronunciationTrainer
+import requestTypes
+
+
+class StreamingAssessment():
+    """Scores a recording while it is being recorded.
+
+    Every step_seconds of new audio, the part of the recording that is not committed yet is
+    transcribed again. Words that end more than window_seconds before the live edge are committed
+    and never transcribed again, so every step and the final one work on about one window of audio."""
+
+    def __init__(self, request: requestTypes.StreamingScoreRequest, trainer: pronunciationTrainer.PronunciationTrainer,
+                 step_seconds: float = 1., window_seconds: float = 3.) -> None:
+        self.request = request
+        self.trainer = trainer
+        self.reference = trainer.getCompiledReference(request.title)
+        self.sampling_rate = trainer.sampling_rate
+        self.step = int(step_seconds*self.sampling_rate)
+        self.window = int(window_seconds*self.sampling_rate)
+
+        self.pcm = bytearray()  # 16 bit samples at the trainer sampling rate
+        self.committed_words = []
+        self.committed_until = 0
+        self.transcribed_until = 0
+
+    @property
+    def number_of_samples(self) -> int:
+        return len(self.pcm)//2
+
+    def addAudio(self, pcm_chunk: bytes):
+        """Append a chunk of 16 bit PCM, and return a partial result when a step is due"""
+        if self.request.sampleRate != self.sampling_rate:
+            audio = torch.from_numpy(np.frombuffer(pcm_chunk, '<i2').astype(np.float32))
+            audio = torchaudio.functional.resample(audio, self.request.sampleRate, self.sampling_rate)
+            pcm_chunk = audio.round().clamp(-32768, 32767).numpy().astype('<i2').tobytes()
+        self.pcm += pcm_chunk
+
+        if self.number_of_samples-self.transcribed_until < self.step:
+            return None
+        return self.getPartialResult()
+
+    def getPartialResult(self) -> dict:
+        pending_words = self.transcribePendingAudio(final=False)
+        words = self.committed_words + pending_words
+        result = {'type': 'partial',
+                  'transcript': ' '.join([word['word'] for word in words]),
+                  'committed_words': len(self.committed_words),
+                  'words': []}
+        if len(words) == 0:
+            return result
+
+        # Provisional results only need the word accuracies, the phonemes are left for the final result
+        words_real = list(self.reference.words)
+        mapped_words, _ = wm.get_best_mapped_words(result['transcript'].split(), words_real, use_anchors=True)
+        real_and_transcribed_words = list(zip(words_real, mapped_words))
+        _, words_accuracy = self.trainer.getPronunciationAccuracy(
+            real_and_transcribed_words, reference=self.reference)
+        result['words'] = [{'real_word': real_word, 'transcribed_word': transcribed_word,
+                            'accuracy': accuracy,
+                            'category': int(self.trainer.getPronunciationCategoryFromAccuracy(accuracy))}
+                           for (real_word, transcribed_word), accuracy in zip(real_and_transcribed_words, words_accuracy)]
+        return result
+
+    def finalize(self) -> dict:
+        """Transcribe what is left and score the whole recording like a single request"""
+        words = self.committed_words + self.transcribePendingAudio(final=True)
+        recording_transcript = ' '.join([word['word'] for word in words])
+
+        audio = torch.from_numpy(lambdaSpeechToScore.buf_to_float(self.pcm)).unsqueeze(0)
+        if self.number_of_samples > 0 and torch.any(audio != 0):
+            audio = self.trainer.preprocessAudio(audio)
+        word_locations = self.trainer.getFadedWordLocations(words, self.number_of_samples)
+
+        return {'type': 'final', **lambdaSpeechToScore.getTranscriptScoreResponse(
+            self.trainer, self.request, audio, recording_transcript, word_locations)}
+
+    def transcribePendingAudio(self, final: bool) -> list:
+        """Words of the audio after the committed words, committing those that are old enough"""
+        self.transcribed_until = self.number_of_samples
+        pending_audio = lambdaSpeechToScore.buf_to_float(self.pcm[2*self.committed_until:])
+        if len(pending_audio) == 0 or not np.any(pending_audio):
+            words = []
+        else:
+            with self.trainer.asr_lock:
+                self.trainer.asr_model.processAudio(
+                    self.trainer.preprocessAudio(torch.from_numpy(pending_audio).unsqueeze(0)))
+                words = [{'word': self.trainer.convert_numbers_in_text(word['word'].strip()),
+                          'start_ts': word['start_ts']+self.committed_until,
+                          'end_ts': word['end_ts']+self.committed_until}
+                         for word in self.trainer.asr_model.getWordLocations()]
+        if final:
+            return words
+
+        # Words well before the live edge will not change any more
+        commit_horizon = self.number_of_samples-self.window
+        pending_words = []
+        for word in words:
+            if word['end_ts'] <= commit_horizon and len(pending_words) == 0:
+                self.committed_words.append(word)
+            else:
+                pending_words.append(word)
+        commit_point = pending_words[0]['start_ts'] if pending_words else commit_horizon
+        self.committed_until = max(self.committed_until, int(min(commit_point, commit_horizon)))
+        return pending_words
+
+
+def serve(websocket):
+    """Protocol of the streaming endpoint:
+    the client sends the StreamingScoreRequest as JSON, then binary chunks of 16 bit little endian
+    mono PCM while recording, then the text message 'end'. The server answers with a JSON partial
+    result every step and with the final result, the same fields as GetAccuracyFromRecordedAudio,
+    after 'end'. An invalid request is answered with {"type": "error", "error": ...} before closing."""
+    try:
+        request = requestTypes.StreamingScoreRequest.fromDict(json.loads(websocket.receive()))
+    except (KeyError, TypeError, ValueError) as error:
+        return closeWithError(websocket, 'Invalid request: ' + repr(error))
+    if request.language not in lambdaSpeechToScore.trainer_SST_lambda:
+        return closeWithError(websocket, 'Language not implemented')
+    assessment = StreamingAssessment(
+        request, lambdaSpeechToScore.trainer_SST_lambda[request.language])
+
+    while True:
+        message = websocket.receive()
+        if isinstance(message, str):
+            break
+        partial_result = assessment.addAudio(message)
+        if partial_result is not None:
+            websocket.send(json.dumps(partial_result))
+
+    start = time.time()
+    websocket.send(json.dumps(assessment.finalize()))
+    print('Time to finalize streamed assessment: ', str(time.time()-start))
+
+
+def closeWithError(websocket, error: str):
+    websocket.send(json.dumps({'type': 'error', 'error': error}))
+    websocket.close()
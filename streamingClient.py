@@ -0,0 +1,63 @@
+"""Streams a recording to the /streamAccuracy endpoint as if the learner was speaking it,
+printing the partial results and how long the final result took after the end of the audio.
+
+    python streamingClient.py test_4.mp3 "Good morning, how many banana are in the table? Thanks" en
+"""
+import sys
+import json
+import time
+
+import soundfile as sf
+import torch
+import torchaudio
+import simple_websocket
+
+sampling_rate = 16000
+chunk_seconds = 0.25
+
+
+def loadPCM(path: str) -> bytes:
+    audio, fs = sf.read(path, dtype='float32', always_2d=True)
+    audio = torchaudio.functional.resample(
+        torch.from_numpy(audio.mean(axis=1)), fs, sampling_rate)
+    return (torch.clamp(audio, -1, 1)*32767).numpy().astype('<i2').tobytes()
+
+
+def streamRecording(url: str, path: str, title: str, language: str, real_time: bool = True) -> dict:
+    pcm = loadPCM(path)
+    chunk_size = 2*int(chunk_seconds*sampling_rate)
+
+    websocket = simple_websocket.Client.connect(url)
+    websocket.send(json.dumps({'title': title, 'language': language, 'sampleRate': sampling_rate}))
+    for start in range(0, len(pcm), chunk_size):
+        websocket.send(pcm[start:start+chunk_size])
+        if real_time:
+            time.sleep(chunk_seconds)
+        # Print the partial results that arrived meanwhile
+        message = websocket.receive(timeout=0)
+        while message is not None:
+            print('partial:', json.loads(message)['transcript'])
+            message = websocket.receive(timeout=0)
+
+    end_of_audio = time.perf_counter()
+    websocket.send('end')
+    while True:
+        result = json.loads(websocket.receive())
+        if result['type'] == 'error':
+            websocket.close()
+            raise ValueError(result['error'])
+        if result['type'] == 'final':
+            break
+        print('partial:', result['transcript'])
+    print('Time from end of audio to final result: %.2f s' % (time.perf_counter()-end_of_audio))
+    websocket.close()
+    return result
+
+
+if __name__ == '__main__':
+    path, title = sys.argv[1], sys.argv[2]
+    language = sys.argv[3] if len(sys.argv) > 3 else 'en'
+    url = sys.argv[4] if len(sys.argv) > 4 else 'ws://127.0.0.1:3000/streamAccuracy'
+    result = streamRecording(url, path, title, language)
+    print('transcript:', result['real_transcript'])
+    print('pronunciation accuracy:', result['pronunciation_accuracy'])
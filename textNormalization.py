@@ -0,0 +1,39 @@
+import re
+from functools import lru_cache
+from string import punctuation
+
+import num2words
+
+# Characters ignored when comparing IPA words
+ipa_ignored_characters = ",?!…ˈ."
+ipa_ignored_table = str.maketrans('', '', ipa_ignored_characters)
+ipa_ignored_tokens = set(ipa_ignored_characters)
+
+stress_mark = "ˈ"
+stress_mark_table = str.maketrans('', '', stress_mark)
+
+punctuation_table = str.maketrans('', '', punctuation)
+
+number_pattern = re.compile(r'\d+')
+
+
+def removeIpaPunctuation(ipa_text: str) -> str:
+    return ipa_text.translate(ipa_ignored_table)
+
+
+def removeStressMarks(ipa_text: str) -> str:
+    return ipa_text.translate(stress_mark_table)
+
+
+def removePunctuation(text: str) -> str:
+    return text.translate(punctuation_table)
+
+
+@lru_cache(maxsize=4096)
+def numberToWords(number: str, language: str = 'en') -> str:
+    return num2words.num2words(int(number), lang=language)
+
+
+def convertNumbersInText(text: str, language: str = 'en') -> str:
+    """Spell out every number of the text, e.g. '3 cats' -> 'three cats'"""
+    return number_pattern.sub(lambda match: numberToWords(match.group(), language), text)
@@ -4,8 +4,17 @@ import ModelInterfaces
 import lambdaGetSample
 import RuleBasedModels
 import epitran
+import eng_to_ipa
 import json
+import random
+import numpy as np
+import torch
 import pronunciationTrainer
+import WordMetrics
+import cacheUtils
+import utils
+import textNormalization
+import ipaSegmentation
 
 
 def test_category(category: int, threshold_min: int, threshold_max: int):
@@ -57,6 +66,14 @@ class TestPhonemConverter(unittest.TestCase):
         self.assertTrue(check_phonem_converter(
             phonem_converter, 'Hello, this is a test', 'hɛˈloʊ, ðɪs ɪz ə tɛst'))
 
+    def test_same_as_eng_to_ipa(self):
+        phonem_converter = RuleBasedModels.EngPhonemConverter()
+        for sentence in ["Hello, World! It's three o'clock, isn't it?",
+                         'The louder the music is the more people drink.',
+                         'Qwertzuiop café -- naïve "quoted" 1990s']:
+            self.assertEqual(phonem_converter.convertToPhonem(sentence),
+                             eng_to_ipa.convert(sentence).replace('*', ''))
+
     def test_german(self):
         phonem_converter = RuleBasedModels.EpitranPhonemConverter(
             epitran.Epitran('deu-Latn'))
@@ -64,6 +81,18 @@ class TestPhonemConverter(unittest.TestCase):
         self.assertTrue(check_phonem_converter(
             phonem_converter, 'Hallo, das ist ein Test', 'haloː, dɑːs ɪst ain tɛst'))
 
+    def test_german_word_table(self):
+        epitran_model = epitran.Epitran('deu-Latn')
+        phonem_converter = RuleBasedModels.EpitranPhonemConverter(
+            epitran_model, ['Könnten', 'Sie', 'den', 'Bildschirm'])
+        sentence = 'Könnten Sie den Bildschirm etwas heller stellen?'
+
+        # Each word gets the same phonemes inside the sentence as on its own
+        self.assertEqual(phonem_converter.convertToPhonem(sentence),
+                         ' '.join([epitran_model.transliterate(word) for word in sentence[:-1].split()]) + '?')
+        self.assertIn('stellen', phonem_converter.learned_words)
+        self.assertNotIn('Sie', phonem_converter.learned_words)
+
 
 trainer_SST_lambda = {}
 trainer_SST_lambda['de'] = pronunciationTrainer.getTrainer("de")
@@ -94,6 +123,719 @@ class TestScore(unittest.TestCase):
 
         self.assertTrue(int(pronunciation_accuracy) == 71)
 
+    def test_compiled_reference(self):
+        trainer = trainer_SST_lambda['de']
+        words_real = 'Ich habe 2 Katzen, am Leben'
+        reference = trainer.getCompiledReference(words_real)
+
+        self.assertIs(trainer.getCompiledReference(words_real), reference)
+        self.assertEqual(reference.words, ('Ich', 'habe', trainer.convert_numbers_in_text('2'),
+                                           'Katzen,', 'am', 'Leben'))
+        self.assertEqual(reference.words_letters[3], 'katzen')
+        self.assertEqual(reference.words_ipa[3], trainer.ipa_converter.convertToPhonem('Katzen,'))
+
+        # Scoring with the compiled sentence is the same as with the words themselves
+        real_and_transcribed_words, _, _ = trainer.matchSampleAndRecordedWords(
+            reference, 'ich habe zwei katze am leben')
+        self.assertEqual(trainer.getPronunciationAccuracy(real_and_transcribed_words, reference=reference),
+                         trainer.getPronunciationAccuracy(real_and_transcribed_words))
+
+    def test_weighted_phonemes(self):
+        words_real = 'Ich habe sehr viel glück, am leben und gesund zu sein'
+
+        _, real_and_transcribed_words_ipa, _ = trainer_SST_lambda['de'].matchSampleAndRecordedWords(
+            words_real, words_real)
+        pronunciation_accuracy, _ = trainer_SST_lambda['de'].getPronunciationAccuracy(
+            real_and_transcribed_words_ipa, weighted_phonemes=True)
+        self.assertEqual(int(pronunciation_accuracy), 100)
+
+        # A close vowel is a smaller mistake than a consonant in its place
+        _, words_accuracy = trainer_SST_lambda['de'].getPronunciationAccuracy(
+            [('bɪt', 'bit'), ('bɪt', 'bkt'), ('bɪt', 'bt')], weighted_phonemes=True)
+        self.assertGreater(words_accuracy[0], words_accuracy[1])
+        self.assertGreater(words_accuracy[1], words_accuracy[2])
+        self.assertLess(words_accuracy[0], 100)
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_least_recently_used_is_evicted(self):
+        cache = cacheUtils.LRUCache(max_size=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+
+
+# (real_transcripts_ipa, matched_transcripts_ipa) pairs checked against the compare_ipa/check_diff chain
+ipa_diff_golden_corpus = [
+    ('gʊd ˈmɔrnɪŋ, haʊ ˈmɛni bəˈnænəz ər ɔn ðə ˈteɪbəl? θæŋks',
+     'gʊd ˈmɔrnɪŋ haʊ ˈmɛni bəˈnænə ər ɔn ə ˈteɪbəl θæŋks'),
+    ('ə smɔl ˈfɔrɪst brʊk floʊd bɪtˈwin ðə moss-covered triz.',
+     'ə smɔl ˈfɔrɪst bʊk floʊ bɪtˈwin - moss-covered tri'),
+    ('doʊnt ju wɔnt tɪ goʊ tɪ ðə ˈpɑrti?',
+     'doʊnt ju woʊnt tɪ goʊ tɪ ðə ˈpɑrtiz'),
+    ('ðə drimz əv ˈoʊnɪŋ ə ˈpoʊˌni.', 'ðə drim əv oʊn ə ˈpoʊˌni'),
+    ('tɑmz rɪkˈwɛst ɪz ənˈriznəbəl.', 'tərmz rɪkˈwɛst ɪz ˈrizənəbəl'),
+    ('ɪts ɔl ˈoʊvər bɪtˈwin ˈjuˈɛs.', 'ɪts ɔl ˈoʊvər bɪtˈwin ˈjuˈɛs.'),
+    ('ʃi sɛlz si ʃɛlz baɪ ðə si ʃɔr.', 'ʃi sɛl - ʃɛlz baɪ ðə si ʃʊr'),
+]
+
+
+class TestIpaDiff(unittest.TestCase):
+
+    def test_matches_previous_chain(self):
+        for real_transcripts_ipa, matched_transcripts_ipa in ipa_diff_golden_corpus:
+            redundant = ['ˈsəmθɪŋ']
+            loss = utils.compare_ipa(real_transcripts_ipa, matched_transcripts_ipa)
+            re_ipa_matched = utils.reinsert_missing_ipa(matched_transcripts_ipa, loss)
+            check_diff, _ = utils.check_diff(re_ipa_matched, real_transcripts_ipa)
+            expected_html = utils.process_line_2_v3(real_transcripts_ipa, check_diff, loss)
+            expected_accuracy = utils.calculate_accuracy(expected_html, redundant)
+
+            ipa_diff = utils.diff_ipa(real_transcripts_ipa.split(),
+                                      matched_transcripts_ipa.split(), redundant)
+
+            self.assertEqual(utils.render_ipa_diff_html(ipa_diff), expected_html)
+            self.assertEqual(utils.calculate_ipa_diff_accuracy(ipa_diff), expected_accuracy)
+
+    def test_edit_types(self):
+        word_diff = utils.diff_ipa_word('drimz', 'drim')
+        self.assertEqual([edit.type for edit in word_diff.edits],
+                         [utils.EDIT_MATCH]*4 + [utils.EDIT_MISSING])
+
+        word_diff = utils.diff_ipa_word('ɔn', '-')
+        self.assertEqual([edit.type for edit in word_diff.edits],
+                         [utils.EDIT_SUBSTITUTE]*2)
+
+
+class TestIpaSegmentation(unittest.TestCase):
+
+    def test_multi_character_phonemes(self):
+        self.assertEqual(ipaSegmentation.segmentWord('ˈlaʊdər,'),
+                         ('ˈ', 'l', 'aʊ', 'd', 'ər', ','))
+        self.assertEqual(ipaSegmentation.segmentWord('t͡svaɪ̯'), ('t͡s', 'v', 'aɪ̯'))
+        self.assertEqual(ipaSegmentation.decodeWord(
+            ipaSegmentation.encodeWord('ˈmɛːdçən')), 'mɛːdçən')
+
+    def test_edit_distance_ids(self):
+        rng = np.random.default_rng(0)
+        for _ in range(200):
+            seq1 = rng.integers(0, 4, rng.integers(0, 10))
+            seq2 = rng.integers(0, 4, rng.integers(0, 10))
+            self.assertEqual(WordMetrics.edit_distance_ids(seq1, seq2),
+                             WordMetrics.edit_distance_python(list(seq1), list(seq2)))
+
+    def test_letter_codes(self):
+        for word1, word2 in [('mädchen', 'madchen'), ('größe', 'grösse'), ('', 'ab'), ('ˈlaʊdər', 'lɔdər')]:
+            self.assertEqual(WordMetrics.edit_distance_ids(WordMetrics.letter_codes(word1),
+                                                           WordMetrics.letter_codes(word2)),
+                             WordMetrics.edit_distance_python(word1, word2))
+
+    def test_phoneme_level_diff(self):
+        ipa_diff = utils.diff_ipa(['ˈlaʊdər', 'goʊ'], ['ˈlɔdər', '-'], phoneme_level=True)
+        self.assertEqual([(edit.type, edit.text, edit.expected) for edit in ipa_diff.words[0].edits],
+                         [(utils.EDIT_MATCH, 'ˈ', None), (utils.EDIT_MATCH, 'l', None),
+                          (utils.EDIT_SUBSTITUTE, 'aʊ', 'ɔ'), (utils.EDIT_MATCH, 'd', None),
+                          (utils.EDIT_MATCH, 'ər', None)])
+        self.assertEqual([edit.type for edit in ipa_diff.words[1].edits],
+                         [utils.EDIT_SUBSTITUTE]*2)
+        self.assertEqual(utils.calculate_ipa_diff_accuracy(ipa_diff), 50.0)
+
+
+class TestHighlightJson(unittest.TestCase):
+
+    def test_rows_match_parsed_html(self):
+        for real_transcripts_ipa, matched_transcripts_ipa in ipa_diff_golden_corpus:
+            ipa_diff = utils.diff_ipa(real_transcripts_ipa.split(),
+                                      matched_transcripts_ipa.split())
+            expected_rows = json.loads(utils.parse_html_to_json(
+                utils.render_ipa_diff_html(ipa_diff)))
+            self.assertEqual(utils.ipa_diff_to_rows(ipa_diff), expected_rows)
+
+    def test_letters_match_parsed_html(self):
+        real_transcripts = 'Hello, my friend'
+        is_letter_correct_all_words = '110111 01 001111 '
+        expected = json.loads(utils.convert_highlighted_text_to_json(
+            utils.convert_color_style_to_class(utils.process_line_1(
+                real_transcripts, is_letter_correct_all_words)), 'Real transcript'))
+        self.assertEqual(utils.group_highlights(utils.iter_letter_highlights(
+            real_transcripts, is_letter_correct_all_words)), expected['Real transcript'])
+
+    def test_letter_runs(self):
+        is_letter_correct_all_words = '110111 01 001111 '
+        letter_runs = [[2, 1, 3], [0, 1, 1], [0, 2, 4]]
+        self.assertEqual(utils.letter_correctness_to_runs([1, 1, 0, 1, 1, 1]), letter_runs[0])
+        self.assertEqual(utils.letter_runs_to_string(letter_runs), is_letter_correct_all_words)
+        self.assertEqual(list(utils.iter_letter_highlights('Hello, my friend', letter_runs)),
+                         list(utils.iter_letter_highlights('Hello, my friend', is_letter_correct_all_words)))
+
+
+def find_leftover_words_with_list_removal(matched_text, transcript_text):
+    matched_temp = matched_text.lower().strip().split()
+    redundant = []
+    for token in transcript_text.lower().strip().split():
+        if token in matched_temp:
+            matched_temp.remove(token)
+        else:
+            redundant.append(token)
+    return redundant
+
+
+class TestLeftoverWords(unittest.TestCase):
+
+    def test_same_as_list_removal(self):
+        random_generator = random.Random(0)
+        vocabulary = ['ðə', 'ə', 'kæt', 'ˈsəmθɪŋ', 'ɪz', 'Ɪz', 'hɪr']
+        for _ in range(500):
+            matched_text = ' '.join(random_generator.choices(
+                vocabulary, k=random_generator.randint(0, 12)))
+            transcript_text = ' '.join(random_generator.choices(
+                vocabulary, k=random_generator.randint(0, 16)))
+
+            redundant, positions = utils.find_leftover_words_with_positions(
+                matched_text, transcript_text)
+
+            self.assertEqual(redundant, find_leftover_words_with_list_removal(
+                matched_text, transcript_text))
+            transcript_tokens = transcript_text.lower().split()
+            self.assertEqual([transcript_tokens[position]
+                             for position in positions], redundant)
+            self.assertEqual(positions, sorted(positions))
+
+
+def process_line_3_with_transcript_scan(real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript):
+    real_words = real_transcripts_ipa.split()
+    differences = []
+    for i, ipa_word in enumerate(matched_transcripts_ipa.split()):
+        temp_ipa_word = ipa_word.replace("ˈ", "")
+        real_word = real_words[i].replace("ˈ", "") if i < len(real_words) else ""
+        for j in range(len(temp_ipa_word)):
+            expected = real_word[j] if j < len(real_word) else (
+                real_word[-1] if real_word else None)
+            if expected != temp_ipa_word[j]:
+                for k, element in enumerate(ipa_transcript.replace("ˈ", "").split()):
+                    if element == ipa_word:
+                        differences.append({"word": ipa_word, "position": j, "expected": expected,
+                                            "actual": temp_ipa_word[j], "position_word": k})
+    return differences
+
+
+class TestProcessLine3(unittest.TestCase):
+
+    def test_same_as_transcript_scan(self):
+        random_generator = random.Random(0)
+        vocabulary = ['ðə', 'ðɪ', 'kæt', 'kət', 'ˈsəmθɪŋ', 'ɪz', 'hɪr', 'hir']
+        for _ in range(300):
+            real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript = [' '.join(
+                random_generator.choices(vocabulary, k=random_generator.randint(0, 10))) for _ in range(3)]
+
+            differences, error_count = utils.process_line_3_v3(
+                real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript)
+
+            self.assertEqual(differences, process_line_3_with_transcript_scan(
+                real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript))
+            self.assertEqual(error_count, len(differences))
+
+
+class TestTextNormalization(unittest.TestCase):
+
+    def test_numbers_are_spelled_out(self):
+        self.assertEqual(textNormalization.convertNumbersInText('12 cats and 1 dog in 2021'),
+                         'twelve cats and one dog in two thousand and twenty-one')
+        self.assertEqual(textNormalization.convertNumbersInText('no numbers'), 'no numbers')
+
+    def test_punctuation_is_removed(self):
+        self.assertEqual(textNormalization.removePunctuation("don't, stop!"), 'dont stop')
+        self.assertEqual(textNormalization.removeIpaPunctuation('ˈpɑrti?'), 'pɑrti')
+        self.assertEqual(textNormalization.removeStressMarks('rɪˈhərsɪŋ.'), 'rɪhərsɪŋ.')
+
+
+def words_relative_intonation_with_loop(audio, word_locations, sampling_rate=16000):
+    intonations = torch.zeros((len(word_locations), 1))
+    intonation_fade_samples = 0.3*sampling_rate
+    for word in range(len(word_locations)):
+        intonation_start = int(np.maximum(
+            0, word_locations[word][0]-intonation_fade_samples))
+        intonation_end = int(np.minimum(
+            audio.shape[1]-1, word_locations[word][1]+intonation_fade_samples))
+        intonations[word] = torch.sqrt(torch.mean(
+            audio[0][intonation_start:intonation_end]**2))
+    return intonations/torch.mean(intonations)
+
+
+class TestIntonation(unittest.TestCase):
+
+    trainer = pronunciationTrainer.PronunciationTrainer(None, None)
+
+    def test_same_as_loop(self):
+        torch.manual_seed(0)
+        # With a DC offset, as recorded by some microphones
+        audio = torch.randn(1, 16000*10)*torch.linspace(0.01, 1, 16000*10) + 0.3
+        word_locations = [(start, start+6000) for start in range(0, 16000*10, 8000)]
+        self.assertTrue(torch.allclose(self.trainer.getWordsRelativeIntonation(audio, word_locations),
+                                       words_relative_intonation_with_loop(audio, word_locations)))
+
+    def test_pitch_contour(self):
+        audio = torch.sin(2*np.pi*200*torch.arange(16000)/16000).unsqueeze(0)
+        energy, pitch = self.trainer.getWordsIntonationContours(audio, [(6000, 10000)])
+        self.assertTrue(torch.allclose(energy, torch.ones_like(energy), atol=1e-2))
+        self.assertTrue(torch.allclose(pitch, torch.full_like(pitch, 200.), rtol=0.05))
+        _, biased_pitch = self.trainer.getWordsIntonationContours(audio+0.5, [(6000, 10000)])
+        self.assertTrue(torch.allclose(biased_pitch, pitch))
+
+
+class FakeAudioFile():
+    """audioread-like reader yielding 16 bit blocks of a 48 kHz mono recording"""
+    samplerate = 48000
+    channels = 1
+    block_size = 4096
+
+    def __init__(self, number_of_samples: int) -> None:
+        self.number_of_samples = number_of_samples
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __iter__(self):
+        for start in range(0, self.number_of_samples, self.block_size):
+            samples = np.arange(start, min(start+self.block_size, self.number_of_samples))
+            yield (samples % 200 - 100).astype('<i2').tobytes()
+
+
+class TestAudioPipeline(unittest.TestCase):
+
+    def test_decoding_keeps_one_float_copy(self):
+        import tracemalloc
+        from unittest import mock
+        import lambdaSpeechToScore
+
+        number_of_samples = 48000*60
+        with mock.patch.object(lambdaSpeechToScore.audioread, 'audio_open',
+                               lambda path: FakeAudioFile(number_of_samples)):
+            tracemalloc.start()
+            signal, fs = lambdaSpeechToScore.audioread_load('recording.ogg')
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        self.assertEqual(signal.dtype, np.float32)
+        self.assertEqual(signal.shape, (number_of_samples,))
+        # The int16 buffer and the float32 signal, but no second full-length float copy
+        full_length_copies = peak/(number_of_samples*signal.itemsize)
+        self.assertLess(full_length_copies, 1.75)
+        self.assertTrue(torch.from_numpy(signal).data_ptr() == signal.ctypes.data)
+
+    def test_request_copies_the_recording_three_times(self):
+        import base64
+        from unittest import mock
+        from torch.profiler import profile, ProfilerActivity
+        import lambdaSpeechToScore
+        import requestTypes
+
+        number_of_samples = 48000*60
+        asr_model = FixedASRModel('hello')
+        trainer = pronunciationTrainer.PronunciationTrainer(asr_model, RuleBasedModels.EngPhonemConverter())
+        asr_audio, scored_audio = [], []
+        request = requestTypes.SpeechToScoreRequest(title='hello', base64Audio=base64.b64encode(b'ogg').decode(),
+                                                    language='en')
+        with mock.patch.object(lambdaSpeechToScore.audioread, 'audio_open',
+                               lambda path: FakeAudioFile(number_of_samples)), \
+                mock.patch.dict(lambdaSpeechToScore.trainer_SST_lambda, {'en': trainer}), \
+                mock.patch.object(asr_model, 'processAudio', side_effect=asr_audio.append), \
+                mock.patch.object(lambdaSpeechToScore, 'getTranscriptScoreResponse',
+                                  lambda trainer, request, audio, *args: scored_audio.append(audio) or {}):
+            with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as profiler:
+                lambdaSpeechToScore.process_request(request)
+
+        # Tensors of at least one 16 kHz recording: the padded 48 kHz input and the output of the
+        # resampler, then the normalized copy given to the ASR
+        signal_bytes = number_of_samples//3*4
+        copies = [event for event in profiler.events() if event.name in ('aten::empty', 'aten::empty_strided')
+                  and event.cpu_memory_usage >= signal_bytes]
+        self.assertLessEqual(len(copies), 3)
+
+        # The ASR gets its own normalized copy, the intonation the recording as decoded
+        self.assertNotEqual(asr_audio[0].data_ptr(), scored_audio[0].data_ptr())
+        self.assertAlmostEqual(float(torch.max(torch.abs(asr_audio[0]))), 1, places=5)
+        self.assertLess(float(torch.max(torch.abs(scored_audio[0]))), 0.01)
+
+    def test_preprocessing_is_in_place(self):
+        audio = torch.randn(1, 16000)+0.5
+        preprocessed_audio = pronunciationTrainer.PronunciationTrainer(None, None).preprocessAudio(audio)
+        self.assertEqual(preprocessed_audio.data_ptr(), audio.data_ptr())
+        self.assertAlmostEqual(float(torch.mean(preprocessed_audio)), 0, places=5)
+        self.assertAlmostEqual(float(torch.max(torch.abs(preprocessed_audio))), 1, places=5)
+
+
+class FakeSileroVoice():
+    """Stands for a silero v2 voice, whose apply_tts returns one tensor per text"""
+
+    def apply_tts(self, texts: list, sample_rate: int) -> list:
+        return [torch.zeros(sample_rate*len(text)//100) for text in texts]
+
+
+class TestTTSModels(unittest.TestCase):
+
+    def test_every_language_loads_a_voice(self):
+        from unittest import mock
+        import models
+
+        with mock.patch.object(models.torch.hub, 'load', return_value=(FakeSileroVoice(), 'example')) as hub_load:
+            registry = models.TTSModelRegistry(16000)
+            for language, speaker in models.tts_speakers.items():
+                audio = registry.getModel(language).getAudioFromSentence('Hello there')
+                self.assertEqual(hub_load.call_args.kwargs['speaker'], speaker)
+                self.assertEqual(len(audio), 16000*len('Hello there')//100)
+
+    def test_unsupported_language(self):
+        import lambdaTTS
+
+        with self.assertRaises(ValueError):
+            lambdaTTS.getRenderedAudio('fr', 'Bonjour')
+
+    def test_streaming_uses_precomputed_audio(self):
+        import io
+        import tempfile
+        import soundfile as sf
+        from unittest import mock
+        import lambdaTTS
+        import requestTypes
+
+        sentence = 'Guten Morgen'
+        cache_key = ('de', 'thorsten_v2', sentence, lambdaTTS.sampling_rate)
+        audio = (0.1*np.sin(np.arange(1600, dtype=np.float32))*32767).astype(np.int16)
+        with tempfile.TemporaryDirectory() as folder, \
+                mock.patch.object(lambdaTTS, 'precomputed_audio_folder', folder), \
+                mock.patch.dict(lambdaTTS.precomputed_audio_store, clear=True), \
+                mock.patch.object(lambdaTTS.tts_model_registry, 'getModel', side_effect=AssertionError):
+            np.savez_compressed(lambdaTTS.getStorePath('de'), **{lambdaTTS.getStoreKey(cache_key): audio})
+            lambdaTTS.rendered_audio_cache.clear()
+            wav = b''.join(lambdaTTS.stream_request(requestTypes.TTSRequest(sentence, 'de')))
+            lambdaTTS.precomputed_audio_store.clear()
+        lambdaTTS.rendered_audio_cache.clear()
+
+        streamed_audio, fs = sf.read(io.BytesIO(wav), dtype='int16')
+        self.assertEqual(fs, lambdaTTS.sampling_rate)
+        np.testing.assert_allclose(streamed_audio, audio, atol=1)
+
+
+class TestLongAudioChunking(unittest.TestCase):
+
+    def test_words_are_stitched_once(self):
+        import whisper_wrapper
+
+        sample_rate = 16000
+        torch.manual_seed(0)
+        audio = torch.randn(sample_rate*95).numpy()
+        # A word of 0.3 s every 0.5 s, as the ASR would locate them in the whole recording
+        words = [{"word": " w%d" % idx, "start_ts": idx*sample_rate//2, "end_ts": idx*sample_rate//2 + int(0.3*sample_rate)}
+                 for idx in range(len(audio)*2//sample_rate)]
+
+        chunk_bounds = whisper_wrapper.getChunkBounds(audio, 30*sample_rate, 4*sample_rate)
+        self.assertEqual(chunk_bounds[0][0], 0)
+        self.assertEqual(chunk_bounds[-1][1], len(audio))
+        for (start, end), (next_start, _) in zip(chunk_bounds[:-1], chunk_bounds[1:]):
+            self.assertLessEqual(end-start, 30*sample_rate)
+            self.assertEqual(end-next_start, 4*sample_rate)
+
+        # Every chunk hears the words that are complete inside of it
+        chunk_words = [[{"word": word["word"], "start_ts": word["start_ts"]-start, "end_ts": word["end_ts"]-start}
+                        for word in words if start <= word["start_ts"] and word["end_ts"] <= end]
+                       for start, end in chunk_bounds]
+        self.assertEqual(whisper_wrapper.stitchChunkWords(chunk_bounds, chunk_words), words)
+
+
+class TestReferenceDecoding(unittest.TestCase):
+
+    def test_speech_end(self):
+        import whisper_wrapper
+
+        sample_rate = 16000
+        torch.manual_seed(0)
+        audio = np.zeros(sample_rate*5, dtype=np.float32)
+        audio[sample_rate//2:2*sample_rate] = 0.5*torch.randn(3*sample_rate//2).numpy()
+        audio[2*sample_rate:] += 1e-4*torch.randn(3*sample_rate).numpy()
+        self.assertEqual(whisper_wrapper.getSpeechEnd(audio, sample_rate), 2*sample_rate + sample_rate//4)
+        self.assertEqual(whisper_wrapper.getSpeechEnd(audio[:2*sample_rate], sample_rate), 2*sample_rate)
+
+
+class FixedASRModel(ModelInterfaces.IASRModel):
+    """Returns the same transcript for any audio"""
+
+    def __init__(self, transcript: str, confidence: float = 1.) -> None:
+        self.transcript = transcript
+        self.confidence = confidence
+        self.calls = 0
+
+    def processAudio(self, audio):
+        self.calls += 1
+
+    def getTranscript(self) -> str:
+        return self.transcript
+
+    def getWordLocations(self) -> list:
+        return [{'word': ' ' + word, 'start_ts': 0, 'end_ts': 0} for word in self.transcript.split()]
+
+    def getTokenConfidence(self, language: str = None) -> float:
+        return self.confidence
+
+
+class TestASRCascade(unittest.TestCase):
+
+    def getCascade(self, small_transcript: str, confidence: float):
+        import whisper_wrapper
+        return whisper_wrapper.CascadeASRModel(FixedASRModel(small_transcript, confidence),
+                                               FixedASRModel('large transcript'))
+
+    def test_accepts_confident_match(self):
+        cascade = self.getCascade(' I have 2 cats.', 0.9)
+        trainer = pronunciationTrainer.PronunciationTrainer(cascade, RuleBasedModels.EngPhonemConverter())
+        transcript, _ = trainer.transcribeAudio(torch.zeros(1, 16000), 'I have two cats')
+        self.assertEqual(transcript, ' I have two cats.')
+        self.assertEqual(cascade.large_model.calls, 0)
+
+    def test_escalates(self):
+        for small_transcript, confidence in [(' I have two hats', 0.9), (' I have two cats', 0.5),
+                                             (' I have two cats', float('nan'))]:
+            cascade = self.getCascade(small_transcript, confidence)
+            cascade.processAudio(torch.zeros(1, 16000), reference_text='I have two cats')
+            self.assertEqual(cascade.getTranscript(), 'large transcript')
+        self.assertEqual(cascade.getStats()['escalation_rate'], 1.)
+
+
+class ToneASRModel(ModelInterfaces.IASRModel):
+    """Recognizes tone bursts as words, the word being given by the pitch of the burst"""
+
+    def __init__(self, words: list, sampling_rate: int = 16000) -> None:
+        self.words = words
+        self.sampling_rate = sampling_rate
+        self.processed_lengths = []
+
+    @staticmethod
+    def getFrequency(word_idx: int) -> float:
+        return 300.+100.*word_idx
+
+    def processAudio(self, audio: torch.Tensor):
+        audio = audio[0].numpy()
+        self.processed_lengths.append(len(audio))
+        frame_length = self.sampling_rate//100
+        active = [np.any(np.abs(audio[start:start+frame_length]) > 0.1)
+                  for start in range(0, len(audio), frame_length)]
+        self.word_locations = []
+        start = None
+        for frame_idx, is_active in enumerate(active + [False]):
+            if is_active and start is None:
+                start = frame_idx*frame_length
+            elif not is_active and start is not None:
+                burst = np.signbit(audio[start:frame_idx*frame_length])
+                frequency = np.sum(burst[1:] != burst[:-1])*self.sampling_rate/(2*len(burst))
+                word_idx = int(np.argmin([abs(frequency-self.getFrequency(idx)) for idx in range(len(self.words))]))
+                self.word_locations.append({'word': ' ' + self.words[word_idx], 'start_ts': start,
+                                            'end_ts': frame_idx*frame_length})
+                start = None
+
+    def getTranscript(self) -> str:
+        return ''.join([word['word'] for word in self.word_locations])
+
+    def getWordLocations(self) -> list:
+        return self.word_locations
+
+
+class TestStreamingAssessment(unittest.TestCase):
+
+    def test_stream_matches_reference(self):
+        import requestTypes
+        import streamingAssessment
+
+        sampling_rate = 16000
+        words = 'the quick brown fox jumps over the lazy dog today'.split()
+        time = np.arange(int(0.4*sampling_rate))/sampling_rate
+        silence = np.zeros(int(0.3*sampling_rate))
+        audio = np.concatenate([np.concatenate([0.5*np.sin(2*np.pi*ToneASRModel.getFrequency(idx)*time), silence])
+                                for idx in range(len(words))])
+        pcm = (audio*32767).astype('<i2').tobytes()
+
+        asr_model = ToneASRModel(words)
+        trainer = pronunciationTrainer.PronunciationTrainer(asr_model, RuleBasedModels.EngPhonemConverter())
+        request = requestTypes.StreamingScoreRequest(title=' '.join(words), language='en')
+        assessment = streamingAssessment.StreamingAssessment(request, trainer)
+
+        partial_results = []
+        chunk_size = 2*sampling_rate//4
+        for start in range(0, len(pcm), chunk_size):
+            partial_result = assessment.addAudio(pcm[start:start+chunk_size])
+            if partial_result is not None:
+                partial_results.append(partial_result)
+        final_result = assessment.finalize()
+
+        self.assertEqual(len(partial_results), int(len(audio)/sampling_rate))
+        self.assertGreater(partial_results[-1]['committed_words'], 0)
+        self.assertEqual(final_result['type'], 'final')
+        self.assertEqual(final_result['real_transcript'], ' '.join(words))
+        self.assertEqual(final_result['pronunciation_accuracy'], '100')
+        # Only about one window of audio is transcribed at every step
+        self.assertLess(max(asr_model.processed_lengths), 5*sampling_rate)
+
+    def test_invalid_first_message(self):
+        import streamingAssessment
+
+        class FakeWebSocket():
+            def __init__(self, first_message: str) -> None:
+                self.messages = [first_message]
+                self.sent = []
+                self.closed = False
+
+            def receive(self):
+                return self.messages.pop(0)
+
+            def send(self, message):
+                self.sent.append(json.loads(message))
+
+            def close(self):
+                self.closed = True
+
+        for first_message, error in [(json.dumps({'title': 'Bonjour', 'language': 'fr'}), 'Language not implemented'),
+                                     ('{"title": ', 'Invalid request'),
+                                     (json.dumps({'language': 'en'}), 'Invalid request')]:
+            websocket = FakeWebSocket(first_message)
+            streamingAssessment.serve(websocket)
+            self.assertEqual(len(websocket.sent), 1)
+            self.assertEqual(websocket.sent[0]['type'], 'error')
+            self.assertTrue(websocket.sent[0]['error'].startswith(error))
+            self.assertTrue(websocket.closed)
+
+    def test_requests_and_sessions_share_the_asr_lock(self):
+        import requestTypes
+        import streamingAssessment
+
+        asr_model = ToneASRModel(['tone'])
+        trainer = pronunciationTrainer.PronunciationTrainer(asr_model, RuleBasedModels.EngPhonemConverter())
+        lock_held = []
+        process_audio = asr_model.processAudio
+        asr_model.processAudio = lambda audio: (lock_held.append(trainer.asr_lock.locked()), process_audio(audio))
+
+        audio = 0.5*np.sin(2*np.pi*ToneASRModel.getFrequency(0)*np.arange(16000)/16000)
+        trainer.transcribeAudio(torch.from_numpy(audio).float().unsqueeze(0))
+        assessment = streamingAssessment.StreamingAssessment(
+            requestTypes.StreamingScoreRequest(title='tone', language='en'), trainer)
+        assessment.addAudio((audio*32767).astype('<i2').tobytes())
+        assessment.finalize()
+        self.assertGreaterEqual(len(lock_held), 2)
+        self.assertTrue(all(lock_held))
+
+
+class TestScoringCache(unittest.TestCase):
+
+    def test_hit_only_recomputes_intonation(self):
+        from unittest import mock
+        import lambdaSpeechToScore
+        import requestTypes
+
+        trainer = pronunciationTrainer.PronunciationTrainer(None, RuleBasedModels.EngPhonemConverter(), language='en')
+        request = requestTypes.SpeechToScoreRequest(title='A small forest brook flowed between 2 trees.',
+                                                    base64Audio='', language='en', letterRuns=True)
+        # The same words, spaced as Whisper and as another ASR would return them
+        recording_transcripts = [' a small forrest book flow between two tree', 'a small forrest book  flow between two tree',
+                                 ' a small forrest book flow between two tree']
+        word_locations = [(idx*4000, idx*4000+3000) for idx in range(len(recording_transcripts[0].split()))]
+        lambdaSpeechToScore.scored_transcripts_cache.clear()
+
+        responses = []
+        text_side_calls = []
+        for seed, recording_transcript in enumerate(recording_transcripts):
+            torch.manual_seed(seed)
+            audio = torch.rand(1, 3*trainer.sampling_rate)
+            with mock.patch.object(trainer, 'getCompiledReference', wraps=trainer.getCompiledReference) as compile_reference, \
+                    mock.patch.object(trainer.ipa_converter, 'convertToPhonem',
+                                      wraps=trainer.ipa_converter.convertToPhonem) as convert_to_phonem:
+                responses.append(lambdaSpeechToScore.getTranscriptScoreResponse(
+                    trainer, request, audio, recording_transcript, word_locations))
+            text_side_calls.append((compile_reference.call_count, convert_to_phonem.call_count > 0))
+
+            result = trainer.processTranscriptForGivenText(
+                audio, request.title, recording_transcript,
+                trainer.ipa_converter.convertToPhonem(recording_transcript), word_locations)
+            self.assertEqual(responses[-1], lambdaSpeechToScore.getScoreResponse(result, request))
+
+        self.assertEqual(lambdaSpeechToScore.getScoringCacheStats()['hits'], 2)
+        # Only the transcript spaced differently from the scored one is converted again
+        self.assertEqual(text_side_calls, [(1, True), (0, True), (0, False)])
+        self.assertNotEqual(responses[0]['words_intonation'], responses[1]['words_intonation'])
+
+
+def best_monotonic_mapping_cost(word_distance_matrix):
+    """Lowest mapping cost, trying every set of monotonic (estimated, real) pairs"""
+    from itertools import combinations
+    number_of_estimated_words = word_distance_matrix.shape[0]-1
+    number_of_real_words = word_distance_matrix.shape[1]
+    best_cost = np.inf
+    for number_of_pairs in range(min(number_of_estimated_words, number_of_real_words)+1):
+        for estimated in combinations(range(number_of_estimated_words), number_of_pairs):
+            for real in combinations(range(number_of_real_words), number_of_pairs):
+                blanks = set(range(number_of_real_words))-set(real)
+                best_cost = min(best_cost, sum(word_distance_matrix[estimated, real]) +
+                                sum(word_distance_matrix[-1, list(blanks)]))
+    return best_cost
+
+
+class TestWordMapping(unittest.TestCase):
+
+    def test_mapping_is_optimal(self):
+        import WordMatching
+        random.seed(0)
+        vocabulary = ['a', 'at', 'cat', 'cut', 'cats', 'the', 'then', 'there', 'sat', 'sit']
+        for _ in range(300):
+            words_estimated = random.choices(vocabulary, k=random.randint(0, 5))
+            words_real = random.choices(vocabulary, k=random.randint(1, 5))
+            word_distance_matrix = WordMatching.get_word_distance_matrix(words_estimated, words_real)
+            mapped_indices = WordMatching.get_best_path_from_distance_matrix(word_distance_matrix)
+
+            self.assertEqual(len(mapped_indices), len(words_estimated))
+            mapped_pairs = [(idx_estimated, idx_real) for idx_estimated, idx_real in enumerate(mapped_indices) if idx_real >= 0]
+            self.assertTrue(all(later[1] > earlier[1] for earlier, later in zip(mapped_pairs, mapped_pairs[1:])))
+
+            cost = sum([word_distance_matrix[pair] for pair in mapped_pairs]) + sum(
+                [word_distance_matrix[-1, idx_real] for idx_real in set(range(len(words_real)))-set(mapped_indices)])
+            self.assertEqual(cost, best_monotonic_mapping_cost(word_distance_matrix))
+
+    def test_without_dtw(self):
+        import WordMatching
+        mapped_words, mapped_words_indices = WordMatching.get_best_mapped_words(
+            'the cat sad on mat'.split(), 'the cat sat on the mat'.split(), use_dtw=False)
+        self.assertEqual(mapped_words, ['the', 'cat', 'sad', 'on', '-', 'mat'])
+        self.assertEqual(mapped_words_indices, [0, 1, 2, 3, -1, 4])
+
+    def test_anchored_alignment(self):
+        import WordMatching
+        random.seed(1)
+        words_real = ' '.join(['The louder the music is, the more people drink because they spend less time talking.',
+                               'A small forest brook flowed between the moss-covered trees.']*5).lower().split()
+        words_estimated = [random.choice([word, word[:-1], word+'s']) for word in words_real if random.random() > 0.1]
+
+        anchors = WordMatching.get_anchor_pairs(words_estimated, words_real)
+        self.assertTrue(all(later[0] > earlier[0] and later[1] > earlier[1]
+                            for earlier, later in zip(anchors, anchors[1:])))
+
+        mapped_words, mapped_words_indices = WordMatching.get_best_mapped_words(
+            words_estimated, words_real, use_anchors=True)
+        exact_mapped_words, _ = WordMatching.get_best_mapped_words(
+            words_estimated, words_real, use_dtw=False, use_anchors=False)
+        self.assertEqual(len(mapped_words), len(words_real))
+        self.assertEqual(len(mapped_words_indices), len(words_real))
+
+        def mapping_cost(mapped_words):
+            return sum([len(real_word) if mapped_word == '-' else WordMetrics.edit_distance_python(mapped_word, real_word)
+                        for mapped_word, real_word in zip(mapped_words, words_real)])
+        self.assertEqual(mapping_cost(mapped_words), mapping_cost(exact_mapped_words))
+
 
 if __name__ == '__main__':
     unittest.main()
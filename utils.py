@@ -2,7 +2,12 @@ import re
 import json
 import difflib
 import html
+from collections import Counter
+from itertools import groupby
+from typing import List, NamedTuple, Optional
 from bs4 import BeautifulSoup
+import textNormalization
+import ipaSegmentation
 
 # ----------------------------------------------------------------
 def convert_highlighted_text_to_json(highlighted_text: str, key_name="words"):
@@ -92,39 +97,92 @@ def convert_color_style_to_class(html_text: str):
     return html_text
 
 # ----------------------------------------------------------------
-def process_line_1(real_transcripts, is_letter_correct_all_words):
-    # Tách các từ và các trạng thái từ is_letter_correct_all_words
-    real_transcripts_words = real_transcripts.split(" ")
-    letters_correct_status = is_letter_correct_all_words.split(" ")
-
-    # Tạo danh sách chứa HTML cho từng từ
-    colored_words = []
-
-    # Lặp qua từng từ
-    for word_idx, real_word in enumerate(real_transcripts_words):
-        # Nếu vượt quá trạng thái được cung cấp, bỏ qua từ
-        if word_idx >= len(letters_correct_status):
-            colored_words.append(real_word)
+def letter_correctness_to_runs(is_letter_correct):
+    """
+    Mã hóa run-length trạng thái đúng/sai các chữ cái của một từ: độ dài các đoạn xen kẽ
+    đúng/sai, luôn bắt đầu bằng đoạn đúng (có thể dài 0).
+    Ví dụ: [1, 1, 0, 1, 1, 1] hoặc "110111" -> [2, 1, 3]; "001111" -> [0, 2, 4].
+    """
+    runs = []
+    for is_correct, letters in groupby(is_letter_correct, key=lambda letter: str(letter) == "1"):
+        if not runs and not is_correct:
+            runs.append(0)
+        runs.append(sum(1 for _ in letters))
+    return runs
+
+
+def parse_letter_correctness(is_letter_correct_all_words):
+    """Chuyển chuỗi '0'/'1' cách nhau bởi dấu cách thành danh sách run-length của từng từ."""
+    return [letter_correctness_to_runs(word_status) for word_status in is_letter_correct_all_words.split(" ")]
+
+
+def letter_runs_to_string(letter_runs):
+    """Tạo lại chuỗi is_letter_correct_all_words (mỗi từ kết thúc bằng dấu cách) từ run-length."""
+    return "".join("".join(("1" if run_idx % 2 == 0 else "0")*run_length
+                           for run_idx, run_length in enumerate(word_runs)) + " "
+                   for word_runs in letter_runs)
+
+
+def iter_letter_highlights(real_transcripts, letter_correctness):
+    """
+    Trả về các cặp (text, type) của process_line_1: mỗi đoạn chữ cái đúng/sai liên tiếp là
+    "highlight-green"/"highlight-red", dấu cách và các từ không có trạng thái là "normal".
+    letter_correctness là chuỗi is_letter_correct_all_words hoặc danh sách run-length của từng từ.
+    """
+    if isinstance(letter_correctness, str):
+        letter_correctness = parse_letter_correctness(letter_correctness)
+
+    for word_idx, real_word in enumerate(real_transcripts.split(" ")):
+        if word_idx > 0:
+            yield " ", "normal"
+        # Nếu vượt quá trạng thái được cung cấp, giữ nguyên từ
+        if word_idx >= len(letter_correctness):
+            if real_word:
+                yield real_word, "normal"
             continue
 
-        # Lấy trạng thái chữ cái của từ hiện tại
-        letter_status = letters_correct_status[word_idx]
-        word_html = ""
+        position = 0
+        for run_idx, run_length in enumerate(letter_correctness[word_idx]):
+            letters = real_word[position:position + run_length]
+            if letters:
+                yield letters, "highlight-green" if run_idx % 2 == 0 else "highlight-red"
+            position += run_length
+        # Các chữ cái không có trạng thái được coi là sai
+        if position < len(real_word):
+            yield real_word[position:], "highlight-red"
 
-        # Lặp qua từng chữ cái
-        for letter_idx, letter in enumerate(real_word):
-            if letter_idx < len(letter_status) and letter_status[letter_idx] == "1":
-                # Nếu chữ cái đúng, tô màu xanh
-                word_html += f'<span style="color: green;">{letter}</span>'
-            else:
-                # Nếu chữ cái sai, tô màu đỏ
-                word_html += f'<span style="color: red;">{letter}</span>'
 
-        # Thêm từ vào danh sách
-        colored_words.append(word_html)
+def process_line_1(real_transcripts, is_letter_correct_all_words):
+    # Chữ cái đúng tô màu xanh, sai tô màu đỏ (style inline)
+    html_parts = []
+    for text, highlight_type in iter_letter_highlights(real_transcripts, is_letter_correct_all_words):
+        if highlight_type == "normal":
+            html_parts.append(text)
+        else:
+            color = highlight_type[len("highlight-"):]
+            html_parts.extend(f'<span style="color: {color};">{letter}</span>' for letter in text)
+    return "".join(html_parts)
+
+
+def group_highlights(highlights):
+    """
+    Gộp các (text, type) liên tiếp cùng type, cho kết quả giống
+    convert_highlighted_text_to_json nhưng không cần tạo và parse HTML.
+    """
+    grouped = []
+    for text, highlight_type in highlights:
+        if grouped and grouped[-1][1] == highlight_type:
+            grouped[-1][0].append(text)
+        else:
+            grouped.append(([text], highlight_type))
+    return [{"text": "".join(texts), "type": highlight_type} for texts, highlight_type in grouped]
+
+
+def highlights_to_html(highlights):
+    """Tạo HTML với <span class="highlight-..."> cho từng phần được tô màu."""
+    return "".join(text if highlight_type == "normal" else f'<span class="{highlight_type}">{text}</span>'
+                   for text, highlight_type in highlights)
 
-    # Ghép danh sách lại thành chuỗi HTML
-    return " ".join(colored_words)
 # ----------------------------------------------------------------
 def process_line_2_v3(ipa1, differences, loss):
     import re
@@ -225,9 +283,9 @@ def check_diff(re_ipa_matched, real_transcripts_ipa):
 
     # So sánh từng cặp từ theo vị trí
     for i, real_word in enumerate(real_words):
-        temp_real_word = re.sub(r"[,?!…ˈ\.]", "",real_word)
+        temp_real_word = textNormalization.removeIpaPunctuation(real_word)
         # Nếu ipa có ít từ hơn real, tránh lỗi IndexError
-        temp_ipa_word = re.sub(r"[,?!…ˈ\.]", "",ipa_words[i]) if i < len(ipa_words) else ""
+        temp_ipa_word = textNormalization.removeIpaPunctuation(ipa_words[i]) if i < len(ipa_words) else ""
         
         # Lấy độ dài so sánh là max của 2 từ
         max_len = max(len(temp_ipa_word), len(temp_real_word))
@@ -251,40 +309,78 @@ def check_diff(re_ipa_matched, real_transcripts_ipa):
     return differences, error_count
 # ----------------------------------------------------------------
 
-def process_line_3_v3(real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript):
+def build_word_positions_index(text):
+    """Tạo dict từ -> danh sách vị trí của từ đó trong text.split() (một lần cho mỗi lần gọi)."""
+    word_positions = {}
+    for position, word in enumerate(text.split()):
+        word_positions.setdefault(word, []).append(position)
+    return word_positions
+
+
+def iter_process_line_3_v3(real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript):
+    """
+    Phiên bản generator của process_line_3_v3: trả về từng difference khi tìm thấy,
+    theo đúng thứ tự của process_line_3_v3.
+    """
     real_words = real_transcripts_ipa.split()
     ipa_words = matched_transcripts_ipa.split()
-
-    differences = []
-    error_count = 0
+    transcript_word_positions = build_word_positions_index(textNormalization.removeStressMarks(ipa_transcript))
 
     # So sánh từng cặp từ theo vị trí
     for i, ipa_word in enumerate(ipa_words):
-        temp_ipa_word = ipa_word.replace("ˈ", "")
+        positions_in_transcript = transcript_word_positions.get(ipa_word)
+        if not positions_in_transcript:
+            # Từ không xuất hiện trong transcript thì không có difference nào được ghi nhận
+            continue
+
+        temp_ipa_word = textNormalization.removeStressMarks(ipa_word)
         # Nếu real có ít từ hơn ipa, tránh lỗi IndexError
-        real_word = real_words[i].replace("ˈ", "") if i < len(real_words) else ""
-        
-        # Lấy độ dài so sánh là max của 2 từ
-        max_len = max(len(real_word), len(temp_ipa_word))
-        for j in range(max_len):
-            if j >= len(temp_ipa_word):
-                break
+        real_word = textNormalization.removeStressMarks(real_words[i]) if i < len(real_words) else ""
+
+        for j, actual in enumerate(temp_ipa_word):
             # Nếu chỉ số vượt quá độ dài của từ, sử dụng ký tự cuối cùng làm so sánh
             expected = real_word[j] if j < len(real_word) else (real_word[-1] if real_word else None)
-            actual = temp_ipa_word[j]
             if expected != actual:
-                for k, elemnent in enumerate(ipa_transcript.replace("ˈ", "").split()):
-                    if elemnent == ipa_word:
-                        differences.append({
-                            "word": ipa_word,      # từ có lỗi trong ipa_transcript
-                            "position": j,         # vị trí ký tự so sánh
-                            "expected": expected,  # ký tự đúng theo real_transcripts_ipa
-                            "actual": actual,       # ký tự sai trong ipa_transcripts_ipa
-                            "position_word": k # vị trí ipa trong câu
-                        })
-                        error_count += 1
+                for k in positions_in_transcript:
+                    yield {
+                        "word": ipa_word,      # từ có lỗi trong ipa_transcript
+                        "position": j,         # vị trí ký tự so sánh
+                        "expected": expected,  # ký tự đúng theo real_transcripts_ipa
+                        "actual": actual,       # ký tự sai trong ipa_transcripts_ipa
+                        "position_word": k # vị trí ipa trong câu
+                    }
+
+
+def process_line_3_v3(real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript):
+    differences = list(iter_process_line_3_v3(
+        real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript))
+    return differences, len(differences)
+
+
+def line_3_highlights(real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript):
+    """
+    Tô màu transcript của người học: ký tự sai màu đỏ, còn lại màu xanh.
+    Đọc differences trực tiếp từ generator, không tạo danh sách trung gian.
+
+    Returns:
+        tuple: (list, int) - (danh sách (text, type), số ký tự sai)
+    """
+    wrong_positions = {}
+    error_count = 0
+    for diff in iter_process_line_3_v3(real_transcripts_ipa, matched_transcripts_ipa, ipa_transcript):
+        wrong_positions.setdefault(diff["position_word"], set()).add(diff["position"])
+        error_count += 1
+
+    highlights = []
+    for k, word in enumerate(textNormalization.removeStressMarks(ipa_transcript).split()):
+        if k > 0:
+            highlights.append((" ", "normal"))
+        wrong_in_word = wrong_positions.get(k, ())
+        for j, letter in enumerate(word):
+            highlights.append((letter, "highlight-red" if j in wrong_in_word else "highlight-green"))
+
+    return highlights, error_count
 
-    return differences, error_count
 
 # ----------------------------------------------------------------
 
@@ -328,8 +424,8 @@ def find_missing_letters(correct_word, matched_word):
     Nếu không phải, tức có ký tự không khớp về thứ tự, thì bỏ qua (trả về [] cho từ đó).
     Nếu đúng, thì tiến hành so sánh chi tiết và ghi nhận loss.
     """
-    temp_correct_word = re.sub(r"[,?!…ˈ\.]", "", correct_word)
-    temp_matched_word = re.sub(r"[,?!…ˈ\.]", "", matched_word)
+    temp_correct_word = textNormalization.removeIpaPunctuation(correct_word)
+    temp_matched_word = textNormalization.removeIpaPunctuation(matched_word)
     # Bước 1: Kiểm tra subsequence
     j = 0
     for i in range(len(temp_correct_word)):
@@ -475,25 +571,30 @@ def calculate_accuracy(html, redundant):
 # ----------------------------------------------------------------
 
 def find_leftover_words(matched_text, transcript_text):
-    # Chuẩn hóa: Xóa phần đầu và loại bỏ dấu câu
-    # def clean_text(text):
-    #     text = re.sub(r"[^\wɪʊɔæəɚɑɒɛʌθðŋʃʒˌˈ ]", "", text)  # Xóa dấu câu, giữ ký tự IPA
-    #     return text.lower().strip().split()
+    redundant, _ = find_leftover_words_with_positions(matched_text, transcript_text)
+    return redundant
+
 
-    matched_tokens = matched_text.lower().strip().split()
-    transcript_tokens = transcript_text.lower().strip().split()
+def find_leftover_words_with_positions(matched_text, transcript_text):
+    """
+    Tìm các từ thừa trong transcript (các từ không có trong matched, tính cả số lần xuất hiện).
+    Dùng Counter nên chỉ duyệt transcript một lần, thay vì list.remove cho mỗi từ.
+
+    Returns:
+        (redundant, positions): danh sách từ thừa và vị trí của chúng trong transcript_text.split()
+    """
+    matched_counts = Counter(matched_text.lower().split())
 
-    # Lọc ra từ thừa bằng cách duyệt từng phần tử
-    matched_temp = matched_tokens.copy()
     redundant = []
-    
-    for token in transcript_tokens:
-        if token in matched_temp:
-            matched_temp.remove(token)  # Xóa phần tử đã match để tránh duplicate match
+    positions = []
+    for position, token in enumerate(transcript_text.lower().split()):
+        if matched_counts[token] > 0:
+            matched_counts[token] -= 1  # Mỗi từ matched chỉ được khớp một lần
         else:
-            redundant.append(token)  # Thêm vào danh sách từ dư
-    
-    return redundant
+            redundant.append(token)
+            positions.append(position)
+
+    return redundant, positions
 
 
 # ----------------------------------------------------------------
@@ -536,4 +637,252 @@ def parse_html_to_json(html):
     first_row_data = process_row(rows[0])
     second_row_data = process_row(rows[1])
 
-    return json.dumps({"row1": first_row_data, "row2": second_row_data}, ensure_ascii=False, indent=4)
\ No newline at end of file
+    return json.dumps({"row1": first_row_data, "row2": second_row_data}, ensure_ascii=False, indent=4)
+
+
+# ----------------------------------------------------------------
+# Bộ so sánh IPA một lượt: thay cho chuỗi compare_ipa -> reinsert_missing_ipa
+# -> check_diff -> process_line_2_v3 -> calculate_accuracy
+# ----------------------------------------------------------------
+
+EDIT_MATCH = "match"
+EDIT_SUBSTITUTE = "substitute"
+EDIT_MISSING = "missing"
+EDIT_EXTRA = "extra"
+
+
+EDIT_HIGHLIGHT_CLASS = {
+    EDIT_MATCH: "highlight-green",
+    EDIT_SUBSTITUTE: "highlight-red",
+    EDIT_MISSING: "highlight-yellow",
+}
+
+
+class IpaEdit(NamedTuple):
+    type: str                 # match / substitute / missing / extra
+    text: str                 # ký tự (hoặc chuỗi ký tự) của từ đúng được hiển thị
+    expected: Optional[str]   # ký tự người học thực sự nói (None nếu trùng khớp)
+
+
+class IpaWordDiff(NamedTuple):
+    real_word: str
+    matched_word: str
+    edits: List[IpaEdit]
+
+
+class IpaDiff(NamedTuple):
+    words: List[IpaWordDiff]
+    extra_words: List[IpaWordDiff]
+
+
+def find_missing_runs(temp_correct_word, temp_matched_word):
+    """
+    Giống find_missing_letters nhưng trên từ đã bỏ dấu câu và chỉ trả về (position, expected).
+    Nếu matched không phải subsequence của correct thì không có loss.
+    """
+    i, j = 0, 0
+    runs = []
+    missing_start = None
+    while i < len(temp_correct_word) and j < len(temp_matched_word):
+        if temp_correct_word[i] == temp_matched_word[j]:
+            if missing_start is not None:
+                runs.append((missing_start, temp_correct_word[missing_start:i]))
+                missing_start = None
+            j += 1
+        elif missing_start is None:
+            missing_start = i
+        i += 1
+
+    if j != len(temp_matched_word):
+        return []
+    if i < len(temp_correct_word):
+        # Phần thiếu ở cuối từ được đánh vị trí theo độ dài từ ghi nhận (như compare_ipa)
+        runs.append((len(temp_matched_word), temp_correct_word[i:]))
+    return runs
+
+
+def diff_ipa_word(real_word, matched_word):
+    """
+    So sánh một từ IPA đúng với từ IPA ghi nhận và trả về IpaWordDiff.
+    Kết quả (HTML, độ chính xác) giống hệt chuỗi hàm cũ cho cùng cặp từ.
+    """
+    temp_real_word = textNormalization.removeIpaPunctuation(real_word)
+    runs = find_missing_runs(temp_real_word, textNormalization.removeIpaPunctuation(matched_word))
+
+    # Chèn lại các ký tự thiếu vào từ ghi nhận (cùng quy ước vị trí với reinsert_missing_ipa)
+    reinserted_word = matched_word
+    offset = 0
+    for position, expected in sorted(runs, key=lambda run: run[0]):
+        pos = position + offset + 1
+        reinserted_word = reinserted_word[:pos] + expected + reinserted_word[pos:]
+        offset += len(expected)
+    temp_reinserted_word = textNormalization.removeIpaPunctuation(reinserted_word)
+
+    # Ký tự thay thế theo vị trí (như check_diff)
+    substitutions = {}
+    for j, actual in enumerate(temp_real_word):
+        if j < len(temp_reinserted_word):
+            expected = temp_reinserted_word[j]
+        else:
+            expected = "-" if temp_reinserted_word else None
+        if expected != actual:
+            substitutions[j] = expected
+
+    # Duyệt từ đúng một lần để tạo edit script (như process_line_2_v3)
+    pos_to_loss = dict(runs)
+    edits = []
+    word = real_word
+    i = 0
+    while i < len(word):
+        if word[i] == "ˈ":
+            edits.append(IpaEdit(EDIT_MATCH, word[i], None))
+            word = word[:i] + word[i+1:]
+            continue
+        if i in pos_to_loss:
+            edits.append(IpaEdit(EDIT_MISSING, pos_to_loss[i], pos_to_loss[i]))
+            i += len(pos_to_loss[i])
+            continue
+        if i in substitutions:
+            edits.append(IpaEdit(EDIT_SUBSTITUTE, word[i], substitutions[i]))
+        else:
+            edits.append(IpaEdit(EDIT_MATCH, word[i], None))
+        i += 1
+
+    if i in pos_to_loss:
+        edits.append(IpaEdit(EDIT_MISSING, pos_to_loss[i], pos_to_loss[i]))
+
+    return IpaWordDiff(real_word, matched_word, edits)
+
+
+def diff_ipa_word_phonemes(real_word, matched_word):
+    """
+    Như diff_ipa_word nhưng so sánh theo âm vị (ipaSegmentation) thay vì theo ký tự:
+    'oʊ', 'tʃ', 'aɪ̯' là một edit. Dấu nhấn và dấu câu được giữ nguyên là match.
+    Âm vị người học nói thêm bên trong từ không có chỗ trên dòng từ đúng nên bị bỏ qua.
+    """
+    segments = ipaSegmentation.segmentWord(real_word)
+    real_codes = ipaSegmentation.encodeWord(real_word)
+    phoneme_edits = []
+    if matched_word == "-":
+        phoneme_edits = [IpaEdit(EDIT_SUBSTITUTE, ipaSegmentation.phoneme_table[code], "-")
+                         for code in real_codes]
+    else:
+        matched_codes = ipaSegmentation.encodeWord(matched_word)
+        matcher = difflib.SequenceMatcher(None, real_codes.tolist(), matched_codes.tolist(),
+                                          autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            for k in range(i1, i2):
+                phoneme = ipaSegmentation.phoneme_table[real_codes[k]]
+                if tag == "equal":
+                    phoneme_edits.append(IpaEdit(EDIT_MATCH, phoneme, None))
+                elif tag == "replace" and j1 + k - i1 < j2:
+                    expected = ipaSegmentation.phoneme_table[matched_codes[j1 + k - i1]]
+                    phoneme_edits.append(IpaEdit(EDIT_SUBSTITUTE, phoneme, expected))
+                else:
+                    phoneme_edits.append(IpaEdit(EDIT_MISSING, phoneme, phoneme))
+
+    # Chèn lại dấu nhấn / dấu câu đúng vị trí của chúng trong từ đúng
+    edits = []
+    phoneme_edits = iter(phoneme_edits)
+    for segment in segments:
+        if segment in textNormalization.ipa_ignored_tokens:
+            edits.append(IpaEdit(EDIT_MATCH, segment, None))
+        else:
+            edits.append(next(phoneme_edits))
+
+    return IpaWordDiff(real_word, matched_word, edits)
+
+
+def diff_ipa(real_words, matched_words, redundant=(), phoneme_level=False):
+    """
+    real_words, matched_words: danh sách từ IPA (matched đã có dấu '-' cho từ bị thiếu).
+    redundant: các từ thừa trong bản ghi, được đưa vào extra_words.
+    phoneme_level: so sánh theo âm vị thay vì theo ký tự (xem diff_ipa_word_phonemes).
+    """
+    diff_word = diff_ipa_word_phonemes if phoneme_level else diff_ipa_word
+    words = []
+    for idx, real_word in enumerate(real_words):
+        matched_word = matched_words[idx] if idx < len(matched_words) else "-"
+        words.append(diff_word(real_word, matched_word))
+
+    extra_words = [IpaWordDiff("", word, [IpaEdit(EDIT_EXTRA, word, None)]) for word in redundant]
+    return IpaDiff(words, extra_words)
+
+
+def render_ipa_diff_html(ipa_diff):
+    """Tạo bảng HTML giống process_line_2_v3 từ IpaDiff."""
+    highlighted_words = []
+    expected_words = []
+    for word_diff in ipa_diff.words:
+        highlighted_chars = []
+        expected_chars = []
+        for edit in word_diff.edits:
+            highlighted_chars.append(f'<span class="{EDIT_HIGHLIGHT_CLASS[edit.type]}">{edit.text}</span>')
+            expected = "&nbsp;" if edit.type == EDIT_MATCH else edit.expected
+            expected_chars.append(f'<span class="expected">{expected}</span>')
+        highlighted_words.append("".join(highlighted_chars))
+        expected_words.append("".join(expected_chars))
+
+    return f"""
+    <table style="border-spacing: 0px; font-family: monospace;">
+        <tr><td>{' '.join(highlighted_words)}</td></tr>
+        <tr><td>{' '.join(expected_words)}</td></tr>
+    </table>
+    """
+
+
+def iter_ipa_diff_highlights(ipa_diff):
+    """Trả về (text, type) của dòng IPA đúng được tô màu, giống hàng đầu của render_ipa_diff_html."""
+    for idx, word_diff in enumerate(ipa_diff.words):
+        if idx > 0:
+            yield " ", "normal"
+        for edit in word_diff.edits:
+            yield edit.text, EDIT_HIGHLIGHT_CLASS[edit.type]
+
+
+def ipa_diff_to_rows(ipa_diff):
+    """
+    Tạo dict {"row1": [...], "row2": [...]} giống parse_html_to_json(render_ipa_diff_html(...)),
+    trực tiếp từ edit script.
+    """
+    def group_row(cells):
+        row = []
+        for text, class_attr in cells:
+            if row and row[-1]["class"] == class_attr:
+                row[-1]["text"] += text
+            else:
+                row.append({"text": text, "class": class_attr})
+        return row
+
+    highlighted_cells = []
+    expected_cells = []
+    for idx, word_diff in enumerate(ipa_diff.words):
+        if idx > 0:
+            highlighted_cells.append((" ", ""))
+            expected_cells.append((" ", ""))
+        for edit in word_diff.edits:
+            highlighted_cells.append((edit.text, EDIT_HIGHLIGHT_CLASS[edit.type]))
+            expected = " " if edit.type == EDIT_MATCH else str(edit.expected)
+            expected_cells.append((expected, "expected"))
+
+    return {"row1": group_row(highlighted_cells), "row2": group_row(expected_cells)}
+
+
+def calculate_ipa_diff_accuracy(ipa_diff):
+    """Giống calculate_accuracy nhưng đếm trực tiếp trên edit script, không cần parse HTML."""
+    total_tokens = 0
+    green_tokens = 0
+    for word_diff in ipa_diff.words:
+        for edit in word_diff.edits:
+            if edit.text in textNormalization.ipa_ignored_tokens:
+                continue
+            total_tokens += 1
+            green_tokens += edit.type == EDIT_MATCH
+
+    if total_tokens == 0:
+        return 0
+
+    accuracy = green_tokens / total_tokens * 100 - len(ipa_diff.extra_words) * 10
+    accuracy = 0 if accuracy < 0 else accuracy
+
+    return round(accuracy, 1)
@@ -1,12 +1,19 @@
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, Response, stream_with_context
 import webbrowser
 import os
 from flask_cors import CORS
-import json
 
 import lambdaTTS
+import models
 import lambdaSpeechToScore
 import lambdaGetSample
+import requestTypes
+import streamingAssessment
+
+try:
+    from flask_sock import Sock
+except ImportError:
+    Sock = None
 
 app = Flask(__name__)
 cors = CORS(app)
@@ -22,22 +29,34 @@ def main():
 
 @app.route(rootPath+'/getAudioFromText', methods=['POST'])
 def getAudioFromText():
-    event = {'body': json.dumps(request.get_json(force=True))}
-    return lambdaTTS.lambda_handler(event, [])
+    tts_request = requestTypes.TTSRequest.fromDict(request.get_json(force=True))
+    return lambdaTTS.process_request(tts_request)
+
+
+@app.route(rootPath+'/getAudioFromTextStream', methods=['POST'])
+def getAudioFromTextStream():
+    tts_request = requestTypes.TTSRequest.fromDict(request.get_json(force=True))
+    # Checked before streaming: once the response has started it can no longer become an error
+    try:
+        models.getTTSSpeaker(tts_request.language)
+    except ValueError as error:
+        return {"status": "error", "message": str(error)}, 400
+    return Response(stream_with_context(lambdaTTS.stream_request(tts_request)),
+                    mimetype='audio/wav')
 
 
 @app.route(rootPath+'/getSample', methods=['POST'])
 def getNext():
-    event = {'body':  json.dumps(request.get_json(force=True))}
-    return lambdaGetSample.lambda_handler(event, [])
+    sample_request = requestTypes.SampleRequest.fromDict(request.get_json(force=True))
+    return lambdaGetSample.process_request(sample_request)
 
 
 @app.route(rootPath+'/GetAccuracyFromRecordedAudio', methods=['POST'])
 def GetAccuracyFromRecordedAudio():
 
     try:
-        event = {'body': json.dumps(request.get_json(force=True))}
-        lambda_correct_output = lambdaSpeechToScore.lambda_handler(event, [])
+        score_request = requestTypes.SpeechToScoreRequest.fromDict(request.get_json(force=True))
+        lambda_correct_output = lambdaSpeechToScore.process_request(score_request)
     except Exception as e:
         print('Error: ', str(e))
         return {
@@ -54,6 +73,19 @@ def GetAccuracyFromRecordedAudio():
     return lambda_correct_output
 
 
+@app.route(rootPath+'/scoringCacheStats', methods=['GET'])
+def scoringCacheStats():
+    return lambdaSpeechToScore.getScoringCacheStats()
+
+
+if Sock is not None:
+    sock = Sock(app)
+
+    @sock.route(rootPath+'/streamAccuracy')
+    def streamAccuracy(websocket):
+        streamingAssessment.serve(websocket)
+
+
 if __name__ == "__main__":
     language = 'de'
     print(os.system('pwd'))
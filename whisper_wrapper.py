@@ -1,24 +1,151 @@
+import time
 import torch 
 from transformers import pipeline
 from ModelInterfaces import IASRModel
 from typing import Union
 import numpy as np 
+import textNormalization
+import WordMetrics
+
+def getChunkBounds(audio: np.ndarray, chunk_length: int, overlap: int, frame_length: int = 400) -> list:
+    """(start, end) sample windows of at most chunk_length samples, overlapping by overlap samples.
+
+    Every window but the last ends on the quietest frame of its final overlap region,
+    so that chunk edges fall between words where the recording allows it."""
+    chunk_bounds = []
+    start = 0
+    while start + chunk_length < len(audio):
+        search_start = start + chunk_length - overlap
+        search_region = audio[search_start:start + chunk_length]
+        frames = search_region[:len(search_region)//frame_length*frame_length].reshape(-1, frame_length)
+        quietest_frame = int(np.argmin(np.einsum('ij,ij->i', frames, frames)))
+        end = search_start + (quietest_frame+1)*frame_length
+        chunk_bounds.append((start, end))
+        start = end - overlap
+    chunk_bounds.append((start, len(audio)))
+    return chunk_bounds
+
+
+def getSpeechEnd(audio: np.ndarray, sample_rate: int = 16000, frame_length: int = 400,
+                 relative_threshold: float = 1e-3, tail_s: float = 0.25) -> int:
+    """Sample after the last frame with at least relative_threshold of the energy of the loudest
+    frame, plus a short tail: the decoder does not have to transcribe the silence that follows"""
+    frames = audio[:len(audio)//frame_length*frame_length].reshape(-1, frame_length)
+    if len(frames) == 0:
+        return len(audio)
+    frame_energies = np.einsum('ij,ij->i', frames, frames)
+    last_speech_frame = int(np.flatnonzero(frame_energies >= relative_threshold*frame_energies.max())[-1])
+    return min(len(audio), (last_speech_frame+1)*frame_length + int(tail_s*sample_rate))
+
+
+def stitchChunkWords(chunk_bounds: list, chunk_words: list) -> list:
+    """Word locations of the whole recording from the word locations of every chunk.
+
+    A word of an overlap is taken from the chunk whose edge is further away from it:
+    only words whose center is past the middle of the overlap are kept from the later chunk."""
+    cuts = [-np.inf] + [(start + previous_end)/2 for (start, _), (_, previous_end)
+                        in zip(chunk_bounds[1:], chunk_bounds[:-1])] + [np.inf]
+    words = []
+    for chunk_idx, ((chunk_start, _), words_of_chunk) in enumerate(zip(chunk_bounds, chunk_words)):
+        for word in words_of_chunk:
+            start_ts, end_ts = word["start_ts"] + chunk_start, word["end_ts"] + chunk_start
+            if cuts[chunk_idx] <= (start_ts + end_ts)/2 < cuts[chunk_idx+1]:
+                words.append({"word": word["word"], "start_ts": start_ts, "end_ts": end_ts})
+    return words
+
+
+# 'off': default generation settings
+# 'budget': trailing silence is cut and max_new_tokens is derived from the length of the reference text
+# 'prompt': 'budget' with the reference text as Whisper prompt
+# 'draft': 'prompt' with prompt lookup decoding, which drafts tokens by copying the reference.
+#          Drafts are only accepted where greedy decoding agrees, so it transcribes like 'prompt'.
+reference_decoding_modes = ['off', 'budget', 'prompt', 'draft']
+
 
 class WhisperASRModel(IASRModel):
-    def __init__(self, model_name="openai/whisper-base"):
-        self.asr = pipeline("automatic-speech-recognition", model=model_name, return_timestamps="word")
+    def __init__(self, model_name="openai/whisper-base", precision: str = 'float32',
+                 chunk_length_s: float = 30, overlap_s: float = 4, batch_size: int = 4,
+                 reference_decoding: str = 'off', token_budget_factor: float = 2., token_budget_margin: int = 10,
+                 draft_tokens: int = 4):
+        if reference_decoding not in reference_decoding_modes:
+            raise ValueError('Reference decoding mode not implemented')
+        torch_dtype = torch.bfloat16 if precision == 'bfloat16' else torch.float32
+        self.asr = pipeline("automatic-speech-recognition", model=model_name, return_timestamps="word",
+                            torch_dtype=torch_dtype)
+        if precision == 'int8':
+            self.asr.model = torch.ao.quantization.quantize_dynamic(
+                self.asr.model, {torch.nn.Linear}, dtype=torch.qint8)
+        self.precision = precision
         self._transcript = ""
         self._word_locations = []
+        # Audio of the last transcript when it fit in one window, for getTokenConfidence
+        self._audio = None
         self.sample_rate = 16000
+        # Recordings longer than one Whisper window are transcribed in overlapping chunks
+        self.chunk_length = int(chunk_length_s*self.sample_rate)
+        self.overlap = int(overlap_s*self.sample_rate)
+        self.batch_size = batch_size
+
+        self.reference_decoding = reference_decoding
+        # The trainer then passes the sentence to read to processAudio
+        self.uses_reference_text = reference_decoding != 'off'
+        self.token_budget_factor = token_budget_factor
+        self.token_budget_margin = token_budget_margin
+        self.draft_tokens = draft_tokens
+        # Decoder forward passes since the model was loaded, each one generating or verifying tokens
+        self.decoder_steps = 0
+        self.asr.model.get_decoder().register_forward_hook(self.countDecoderStep)
+
+    def countDecoderStep(self, module, inputs, outputs):
+        self.decoder_steps += 1
+
+    def getReferenceGenerateKwargs(self, reference_text: str) -> dict:
+        tokenizer = self.asr.tokenizer
+        reference_text = reference_text.strip()
+        reference_ids = tokenizer.encode(' ' + reference_text, add_special_tokens=False)
+        # Room left for the new tokens by the prompt and the 4 tokens of the task prefix
+        max_target_positions = self.asr.model.config.max_target_positions - 4
 
-    def processAudio(self, audio:Union[np.ndarray, torch.Tensor]):
+        generate_kwargs = {}
+        if self.reference_decoding in ('prompt', 'draft') and len(reference_ids) < max_target_positions//2:
+            generate_kwargs['prompt_ids'] = tokenizer.get_prompt_ids(reference_text, return_tensors='pt')
+            max_target_positions -= len(generate_kwargs['prompt_ids'])
+            if self.reference_decoding == 'draft':
+                generate_kwargs['prompt_lookup_num_tokens'] = self.draft_tokens
+        generate_kwargs['max_new_tokens'] = min(
+            int(self.token_budget_factor*len(reference_ids)) + self.token_budget_margin, max_target_positions)
+        return generate_kwargs
+
+    def processAudio(self, audio:Union[np.ndarray, torch.Tensor], reference_text: str = None):
         # 'audio' can be a path to a file or a numpy array of audio samples.
         if isinstance(audio, torch.Tensor):
             audio = audio.detach().cpu().numpy()
-        result = self.asr(audio[0])
-        self._transcript = result["text"]
-        self._word_locations = [{"word":word_info["text"], "start_ts":word_info["timestamp"][0]*self.sample_rate,
-                                 "end_ts":word_info["timestamp"][1]*self.sample_rate} for word_info in result["chunks"]]
+        audio = audio[0]
+
+        if len(audio) <= self.chunk_length:
+            generate_kwargs = {}
+            if self.reference_decoding != 'off':
+                audio = audio[:getSpeechEnd(audio, self.sample_rate)]
+                if reference_text is not None:
+                    generate_kwargs = self.getReferenceGenerateKwargs(reference_text)
+            result = self.asr(audio, generate_kwargs=generate_kwargs)
+            self._audio = audio
+            self._transcript = result["text"]
+            self._word_locations = self.getChunkWordLocations(result, len(audio))
+            return
+
+        self._audio = None
+        chunk_bounds = getChunkBounds(audio, self.chunk_length, self.overlap)
+        results = self.asr([audio[start:end] for start, end in chunk_bounds], batch_size=self.batch_size)
+        self._word_locations = stitchChunkWords(chunk_bounds, [self.getChunkWordLocations(result, end-start)
+                                                               for result, (start, end) in zip(results, chunk_bounds)])
+        self._transcript = "".join([word["word"] for word in self._word_locations])
+
+    def getChunkWordLocations(self, result: dict, chunk_length: int) -> list:
+        # The last word of a window can come without an end timestamp
+        return [{"word": word_info["text"], "start_ts": word_info["timestamp"][0]*self.sample_rate,
+                 "end_ts": chunk_length if word_info["timestamp"][1] is None else word_info["timestamp"][1]*self.sample_rate}
+                for word_info in result["chunks"]]
 
     def getTranscript(self) -> str:
         return self._transcript
@@ -26,3 +153,97 @@ class WhisperASRModel(IASRModel):
     def getWordLocations(self) -> list:
         
         return self._word_locations
+
+    def getTokenConfidence(self, language: str = None) -> float:
+        """Mean probability the model gives to the tokens of its last transcript, from one
+        teacher-forced decoder pass. NaN when the recording was transcribed in chunks."""
+        if self._audio is None:
+            return float('nan')
+        tokenizer = self.asr.tokenizer
+        prefix_tokens = ['<|startoftranscript|>', '<|%s|>' % language, '<|transcribe|>', '<|notimestamps|>']
+        prefix_ids = [token_id for token_id in tokenizer.convert_tokens_to_ids(prefix_tokens)
+                      if token_id is not None and token_id != tokenizer.unk_token_id]
+        text_ids = tokenizer.encode(self._transcript, add_special_tokens=False)
+        if len(text_ids) == 0:
+            return float('nan')
+        token_ids = torch.tensor([prefix_ids + text_ids + [tokenizer.eos_token_id]])
+
+        features = self.asr.feature_extractor(self._audio, sampling_rate=self.sample_rate,
+                                              return_tensors='pt').input_features
+        with torch.no_grad():
+            logits = self.asr.model(input_features=features.to(self.asr.model.dtype),
+                                    decoder_input_ids=token_ids[:, :-1]).logits[0].float()
+        # Logits at position i predict token i+1: keep the predictions of the text tokens
+        text_positions = torch.arange(len(prefix_ids)-1, len(prefix_ids)-1+len(text_ids))
+        probabilities = torch.softmax(logits[text_positions], dim=-1)
+        return float(probabilities.gather(1, torch.tensor(text_ids)[:, None]).mean())
+
+
+def getReferenceWordErrorRate(transcript: str, reference_text: str, language: str = 'en') -> float:
+    """Word level edit distance between the transcript and the sentence to read, relative to the
+    number of words of the sentence; case, punctuation and spelled out numbers are ignored"""
+    def normalizeWords(text: str) -> list:
+        return textNormalization.removePunctuation(
+            textNormalization.convertNumbersInText(text, language)).lower().split()
+
+    reference_words = normalizeWords(reference_text)
+    return WordMetrics.edit_distance_python(normalizeWords(transcript), reference_words)/max(len(reference_words), 1)
+
+
+class CascadeASRModel(IASRModel):
+    """Transcribes with a small model and only runs the large model when the small model's
+    transcript is not close to the sentence to read or the small model is unsure of it.
+    Without a reference text only the confidence is checked."""
+
+    # The trainer passes the sentence to read to processAudio
+    uses_reference_text = True
+
+    def __init__(self, small_model: WhisperASRModel, large_model: IASRModel, language: str = 'en',
+                 max_reference_word_error_rate: float = 0.15, min_token_confidence: float = 0.75):
+        self.small_model = small_model
+        self.large_model = large_model
+        self.language = language
+        self.max_reference_word_error_rate = max_reference_word_error_rate
+        self.min_token_confidence = min_token_confidence
+        self.selected_model = small_model
+        self.transcriptions = 0
+        self.escalations = 0
+        self.total_latency = 0.
+
+    def acceptsSmallTranscript(self, reference_text: str = None) -> bool:
+        if reference_text is not None and getReferenceWordErrorRate(
+                self.small_model.getTranscript(), reference_text, self.language) > self.max_reference_word_error_rate:
+            return False
+        # NaN (no confidence available) fails the comparison and escalates
+        return self.small_model.getTokenConfidence(self.language) >= self.min_token_confidence
+
+    @staticmethod
+    def processAudioWith(asr_model: IASRModel, audio: Union[np.ndarray, torch.Tensor], reference_text: str = None):
+        if reference_text is not None and getattr(asr_model, 'uses_reference_text', False):
+            asr_model.processAudio(audio, reference_text=reference_text)
+        else:
+            asr_model.processAudio(audio)
+
+    def processAudio(self, audio: Union[np.ndarray, torch.Tensor], reference_text: str = None):
+        start = time.perf_counter()
+        self.processAudioWith(self.small_model, audio, reference_text)
+        if self.acceptsSmallTranscript(reference_text):
+            self.selected_model = self.small_model
+        else:
+            self.processAudioWith(self.large_model, audio, reference_text)
+            self.selected_model = self.large_model
+            self.escalations += 1
+        self.transcriptions += 1
+        self.total_latency += time.perf_counter()-start
+
+    def getTranscript(self) -> str:
+        return self.selected_model.getTranscript()
+
+    def getWordLocations(self) -> list:
+        return self.selected_model.getWordLocations()
+
+    def getStats(self) -> dict:
+        return {'transcriptions': self.transcriptions,
+                'escalations': self.escalations,
+                'escalation_rate': self.escalations/self.transcriptions if self.transcriptions else 0.,
+                'average_latency_s': self.total_latency/self.transcriptions if self.transcriptions else 0.}